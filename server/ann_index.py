@@ -0,0 +1,331 @@
+# encoding: utf-8
+"""Approximate nearest neighbour search across all the indexed documents.
+
+An IVF (inverted file) index: the chunk embeddings are clustered with
+k-means, each chunk is assigned to its nearest centroid (its list), and a
+query only scores the chunks of the nprobe lists nearest to it. More lists
+probed means a better recall and a slower search.
+
+The vectors are not copied, the lists point into the per-document indexes
+written by create_index (see vector_store). On disk there are only the
+centroids and one small assignment file per document, so adding or
+removing a document doesn't touch the others:
+- static/ann/centroids.npy
+- static/ann/<name>.npz: the list of each chunk of the document
+
+Below min_train chunks the collection isn't clustered and the search is
+exact. Documents indexed by other processes (the ingest workers) are picked
+up on the next search.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+from retrieval import best_of, scores_of, top_k
+from vector_store import VectorIndex, index_prefix
+
+staticPath = "static"
+
+
+def assign_lists(vectors, centroids, block_rows=65536):
+    """Nearest centroid (by dot product) of each row."""
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return lists
+
+
+def kmeans(data, nlist, iterations=10, seed=0):
+    """Spherical k-means, returns the normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        lists = assign_lists(data, centroids)
+        order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        centroids[filled] = np.add.reduceat(data[order], starts[filled], axis=0)
+        # restart empty lists from random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class AnnIndex:
+    """
+    Args:
+        path: directory of the centroids and the assignment files
+        nlist: number of lists (clusters), 0 disables the approximate search
+        nprobe: default number of lists searched per query
+        min_train: chunks in the collection before it is clustered, defaults
+            to 39 per list (below that k-means has too few points per list)
+        train_size: max chunks sampled to train the centroids
+        refresh_interval: min seconds between two syncs with the indexes on
+            disk when searching
+    """
+    def __init__(self,
+                 path=f"{staticPath}/ann",
+                 nlist=256,
+                 nprobe=8,
+                 min_train=None,
+                 train_size=65536,
+                 refresh_interval=1.0):
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train if min_train is not None else 39 * nlist
+        self.train_size = train_size
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = 0.0
+        self.centroids = None
+        self.version = None
+        self._centroids_mtime = None
+        # name -> {"mtime", "index", "lists"}
+        self._docs = {}
+        # postings of all documents grouped by list, rebuilt after changes
+        self._postings = None
+        self._lock = threading.RLock()
+
+    # -- files
+
+    def _assignment_path(self, name):
+        return f"{self.path}/{name}.npz"
+
+    def _centroids_path(self):
+        return f"{self.path}/centroids.npy"
+
+    def _load_centroids(self):
+        """(Re)load the centroids if another process trained them."""
+        path = self._centroids_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        if mtime == self._centroids_mtime:
+            return
+        self._set_centroids(np.load(path), mtime)
+
+    def _set_centroids(self, centroids, mtime):
+        self.centroids = centroids.astype(np.float32)
+        self.version = hashlib.sha256(self.centroids.tobytes()).hexdigest()[:16]
+        self._centroids_mtime = mtime
+        self._postings = None
+
+    @staticmethod
+    def _document_names():
+        return [os.path.splitext(os.path.basename(path))[0]
+                for path in glob.glob(f"{index_prefix('*')}.json")]
+
+    # -- documents
+
+    def _assign(self, name, index, mtime):
+        """Lists of the chunks of a document, from its assignment file if
+        it is up to date, else computed and saved."""
+        path = self._assignment_path(name)
+        if os.path.exists(path) and os.path.getmtime(path) >= mtime:
+            saved = np.load(path)
+            if str(saved["version"]) == self.version and len(saved["lists"]) == len(index):
+                return saved["lists"]
+        lists = assign_lists(index.vectors, self.centroids)
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, lists=lists, version=self.version)
+        os.replace(tmp, path)
+        return lists
+
+    def _load_document(self, name):
+        meta_path = f"{index_prefix(name)}.json"
+        try:
+            mtime = os.path.getmtime(meta_path)
+            index = VectorIndex.load(name)
+        except (OSError, ValueError):
+            # not built yet, or a json index from before the binary format
+            return None
+        lists = None
+        if self.centroids is not None and len(index):
+            lists = self._assign(name, index, mtime)
+        # plain ndarray view, indexing a np.memmap has a python overhead
+        return {"mtime": mtime, "index": index, "vectors": np.asarray(index.vectors),
+                "lists": lists}
+
+    def add(self, name):
+        """Add (or update) a document after it was indexed. The collection
+        is clustered once it has min_train chunks."""
+        with self._lock:
+            self._load_centroids()
+            doc = self._load_document(name)
+            if doc is None:
+                self._docs.pop(name, None)
+            else:
+                self._docs[name] = doc
+            self._postings = None
+            if self.centroids is None and self.nlist:
+                self.refresh()
+                if self._total() >= self.min_train:
+                    self.train()
+
+    def remove(self, name):
+        with self._lock:
+            self._docs.pop(name, None)
+            self._postings = None
+            path = self._assignment_path(name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def refresh(self):
+        """Sync with the indexes on disk: documents added, re-indexed or
+        deleted by other processes."""
+        with self._lock:
+            self._refreshed_at = time.monotonic()
+            self._load_centroids()
+            names = set(self._document_names())
+            for name in list(self._docs):
+                if name not in names:
+                    self._docs.pop(name)
+                    self._postings = None
+            for name in names:
+                doc = self._docs.get(name)
+                try:
+                    mtime = os.path.getmtime(f"{index_prefix(name)}.json")
+                except OSError:
+                    continue
+                stale = doc is None or doc["mtime"] != mtime or (
+                    self.centroids is not None and doc["lists"] is None and len(doc["index"]))
+                if stale:
+                    doc = self._load_document(name)
+                    if doc is not None:
+                        self._docs[name] = doc
+                    self._postings = None
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+    def _total(self):
+        return sum(len(doc["index"]) for doc in self._docs.values())
+
+    # -- training
+
+    def train(self, seed=0):
+        """Cluster a sample of all the chunks and assign every document."""
+        with self._lock:
+            self.refresh()
+            total = self._total()
+            if total < self.nlist:
+                return False
+            rng = np.random.default_rng(seed)
+            share = min(1.0, self.train_size / total)
+            samples = []
+            for name in sorted(self._docs):
+                vectors = self._docs[name]["index"].vectors
+                count = int(np.ceil(len(vectors) * share))
+                if count:
+                    rows = np.sort(rng.choice(len(vectors), count, replace=False))
+                    samples.append(np.asarray(vectors[rows], dtype=np.float32))
+            centroids = kmeans(np.concatenate(samples), self.nlist, seed=seed)
+            os.makedirs(self.path, exist_ok=True)
+            tmp = f"{self._centroids_path()}.tmp.npy"
+            np.save(tmp, centroids)
+            os.replace(tmp, self._centroids_path())
+            self._set_centroids(centroids, os.path.getmtime(self._centroids_path()))
+            for name, doc in self._docs.items():
+                if len(doc["index"]):
+                    doc["lists"] = self._assign(name, doc["index"], doc["mtime"])
+            return True
+
+    # -- search
+
+    def _build_postings(self):
+        """All chunks sorted by list: (names, doc of each chunk, row of
+        each chunk, start of each list)."""
+        names = sorted(name for name, doc in self._docs.items() if doc["lists"] is not None)
+        doc_ids = [np.full(len(self._docs[name]["lists"]), i, dtype=np.int32)
+                   for i, name in enumerate(names)]
+        rows = [np.arange(len(self._docs[name]["lists"]), dtype=np.int32) for name in names]
+        lists = [self._docs[name]["lists"] for name in names]
+        if not names:
+            return names, np.empty(0, np.int32), np.empty(0, np.int32), np.zeros(self.nlist + 1, np.int64)
+        lists = np.concatenate(lists)
+        order = np.argsort(lists, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))))
+        return names, np.concatenate(doc_ids)[order], np.concatenate(rows)[order], offsets
+
+    def _candidates(self, vector, nprobe):
+        """(names, doc ids, rows) of the chunks in the nprobe nearest lists,
+        grouped by document."""
+        if self._postings is None:
+            self._postings = self._build_postings()
+        names, doc_ids, rows, offsets = self._postings
+        probe = top_k(self.centroids, vector, nprobe)[0]
+        picked = np.concatenate([np.arange(offsets[l], offsets[l + 1]) for l in probe])
+        doc_ids, rows = doc_ids[picked], rows[picked]
+        # grouped by document, in row order so the memmap is read forward
+        order = np.lexsort((rows, doc_ids))
+        return names, doc_ids[order], rows[order]
+
+    def search(self, vector, k=10, nprobe=None):
+        """Return the k best chunks of all the documents as (name, row,
+        score), best first."""
+        return [(name, row, score) for name, _, row, score in self._search(vector, k, nprobe)]
+
+    def _search(self, vector, k, nprobe):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._maybe_refresh()
+            if self.centroids is None or not self.nlist:
+                return self._exact_search(vector, k)
+            names, doc_ids, rows = self._candidates(vector, nprobe or self.nprobe)
+            docs = [self._docs[name] for name in names]
+
+        # score the candidates document by document, then pick the best k
+        # of all of them at once
+        bounds = np.flatnonzero(np.diff(doc_ids)) + 1
+        starts = np.concatenate(([0], bounds)).astype(int)
+        scores = np.concatenate([np.empty(0, np.float32)] + [
+            scores_of(docs[doc_ids[start]]["vectors"][part], vector)
+            for start, part in zip(starts, np.split(rows, bounds)) if len(part)])
+        best, best_scores = best_of(scores, k)
+        return [(names[doc_ids[i]], docs[doc_ids[i]]["index"], int(rows[i]), score)
+                for i, score in zip(best.tolist(), best_scores.tolist())]
+
+    def _exact_search(self, vector, k):
+        found = []
+        for name, doc in self._docs.items():
+            best, scores = top_k(doc["vectors"], vector, k)
+            found.extend((name, doc["index"], row, score)
+                         for row, score in zip(best.tolist(), scores.tolist()))
+        found.sort(key=lambda item: -item[3])
+        return found[:k]
+
+    def search_sources(self, vector, k=10, nprobe=None):
+        """Like `search`, as source dicts (see retrieval.Retriever.search)
+        with the document name."""
+        sources = []
+        for name, index, row, score in self._search(vector, k, nprobe):
+            sources.append({**index.extra_info[row], "document": name,
+                            "text": index.text(row), "score": round(score, 4)})
+        return sources
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "chunks": self._total(),
+                "trained": self.centroids is not None,
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+            }
+
+
+ann_index = AnnIndex(
+    nlist=int(os.environ.get("ANN_NLIST", "256")),
+    nprobe=int(os.environ.get("ANN_NPROBE", "8")),
+)
@@ -1,28 +1,22 @@
 import json
 import logging
 import os
-import time
-from pathlib import Path
 
-import openai
-from create_index import create_index
-from gpt4_wrapper import DialogManager 
+from ann_index import ann_index
+from catalog import Catalog
+from embedding import embed_texts
+from file_delivery import IMMUTABLE, REVALIDATE, send_document
+from ingest import QUEUED, IngestQueue
+from lexical_index import remove_lexical_index
+from gpt4_wrapper import DialogManager, response_cache, retriever, semantic_cache
+from manifest import Manifest
+from session_cache import SessionCache
+from summarizer import Summarizer
+from streaming import END_JSON_MARKER, stream_answer
+from vector_store import remove_index
 from dotenv import load_dotenv
 from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
-from llama_index import (
-    GPTListIndex,
-    GPTSimpleVectorIndex,
-    MockEmbedding,
-    MockLLMPredictor,
-    ServiceContext,
-    download_loader,
-)
-from llama_index.optimization.optimizer import SentenceEmbeddingOptimizer
-
-#openai_proxy = os.environ.get("OPENAI_PROXY", "https://api.openai.com/v1")
-#openai.api_base = openai_proxy
-
 
 staticPath = "static"
 
@@ -52,6 +46,15 @@ logger.addHandler(file_handler)
 
 load_dotenv()
 
+# the documents of the side menu, updated by upload, delete and the ingest
+# jobs instead of listing the directory on every request
+catalog = Catalog()
+catalog.sync()
+
+ingest_queue = IngestQueue(workers=int(os.environ.get("INGEST_WORKERS", "2")),
+                           catalog_path=f"{staticPath}/catalog.db")
+ingest_queue.resume()
+
 
 @app.errorhandler(Exception)
 def handle_error(error):
@@ -67,72 +70,67 @@ def handle_error(error):
     return response
 
 
+# file hashes, extracted pages and summaries, one connection for the app
+manifest = Manifest()
+
+# summaries are cached by file content, uncached ones are a map-reduce over
+# the document with SUMMARY_WORKERS chunks summarized at a time
+summarizer = Summarizer(
+    cache=manifest,
+    workers=int(os.environ.get("SUMMARY_WORKERS", "4")),
+    model=os.environ.get("SUMMARY_MODEL", "gpt-3.5-turbo"),
+)
+
+
+def uploaded_path(file):
+    return os.path.join(f"{staticPath}/file", os.path.basename(file))
+
+
+def summarize_file(file, open_ai_key=None):
+    """Returns the estimated cost and the generator of the streamed summary
+    of a file. The key is passed per call."""
+    return summarizer.summarize(uploaded_path(file), api_key=open_ai_key or None)
+
+
 @app.route("/api/summarize", methods=["GET"])
 def summarize_index():
     file = request.args.get("file")
     open_ai_key = request.args.get("openAiKey")
-    if open_ai_key:
-        os.environ["OPENAI_API_KEY"] = open_ai_key
-
-    UnstructuredReader = download_loader("UnstructuredReader")
-    loader = UnstructuredReader()
-    documents = loader.load_data(file=Path(f"./{staticPath}/file/{file}"))
-    index = GPTListIndex.from_documents(documents)
-
-    # predictor cost
-    llm_predictor = MockLLMPredictor(max_tokens=256)
-    embed_model = MockEmbedding(embed_dim=1536)
-    service_context = ServiceContext.from_defaults(
-        llm_predictor=llm_predictor, embed_model=embed_model
-    )
-
-    # TODO: Format everything as markdown
-    prompt = f"""
-        Summarize this document and provide three questions related to the summary. Try to use your own words when possible. Keep your answer under 5 sentences. 
-
-        Use the following format:
-        <summary text>
-
-
-        Questions you may want to ask 🤔
-        1. <question text>
-        2. <question text>
-        3. <question text>
-        """
-
-    index.query(
-        prompt,
-        response_mode="tree_summarize",
-        service_context=service_context,
-        optimizer=SentenceEmbeddingOptimizer(percentile_cutoff=0.8),
-    )
-
-    res = index.query(
-        prompt,
-        streaming=True,
-        response_mode="tree_summarize",
-        optimizer=SentenceEmbeddingOptimizer(percentile_cutoff=0.8),
-    )
-    cost = embed_model.last_token_usage + llm_predictor.last_token_usage
+    cost, summary_gen = summarize_file(file, open_ai_key)
 
     def response_generator():
         yield json.dumps({"cost": cost, "sources": []})
-        yield "\n ###endjson### \n\n"
-        for text in res.response_gen:
+        yield END_JSON_MARKER
+        for text in summary_gen:
             yield text
 
-    # 用完了就删掉，防止key被反复使用
-    if open_ai_key:
-        os.environ["OPENAI_API_KEY"] = ""
-
     return Response(stream_with_context(response_generator()))
 
 # Edit by Yixuan
-#TODO: storing the DialogHistoryManager for each index might not be scalable, 
-# here we assume it's for single user, so we can use a global variable 
-# to store the history for each index
-#TODO: reset the dataase when user delete the pdf file
-id2chatbot = {}
+# DialogManagers are cached per (session, document) with LRU eviction and an
+# idle TTL, the history itself lives in sqlite so evicted sessions are rebuilt
+# lazily. Without a sessionId every user shares the history of the document.
+def create_chatbot(key, major=""):
+    session_id, index_name = key
+    db_dir = f"{staticPath}/db"
+    if session_id:
+        db_dir = f"{db_dir}/{os.path.basename(session_id)}"
+    return DialogManager(file_path=f"{db_dir}/{index_name}.db", major=major,
+                         index_name=index_name)
+
+
+session_cache = SessionCache(
+    create_chatbot,
+    max_entries=int(os.environ.get("SESSION_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("SESSION_CACHE_TTL", "3600")),
+    on_evict=lambda chatbot: chatbot.close(),
+)
+
+
+def get_chatbot(index_name, major, session_id=""):
+    return session_cache.get((session_id or "", index_name), major=major)
+
+
 @app.route("/api/query", methods=["GET"])
 def query_index():
     # the current prompt text, it would be concatenated with the history
@@ -142,55 +140,35 @@ def query_index():
     index_name = request.args.get("index") 
     open_ai_key = request.args.get("openAiKey")
     major = request.args.get("userMajor") 
+    session_id = request.args.get("sessionId")
 
     # for debug
     print("-------- query text: ", query_text)
     print("-------- index name: ", index_name)
     print("-------- open ai key: ", open_ai_key)
     print("-------- user major: ", major)
-    if open_ai_key:
-        os.environ["OPENAI_API_KEY"] = open_ai_key
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-    else:
-        openai.api_key = ""
-
-    if index_name not in id2chatbot:
-        chatbot = DialogManager(file_path=f"{staticPath}/db/{index_name}.db",
-                                major=major)
-        id2chatbot[index_name] = chatbot
-    else:
-        chatbot = id2chatbot[index_name]
-
-    response = chatbot.get_response(query=query_text, 
-                                    major=major)
+    chatbot = get_chatbot(index_name, major, session_id)
+    # the key only goes along with this request's api calls
+    response, sources = chatbot.get_response(query=query_text, 
+                                             major=major,
+                                             api_key=open_ai_key or None)
     print("-------- response: ", response)
     #response = chatbot.debug(query_text, "explain")
 
-    # stream api response config
-    delay_time = 0.01
-    
-    def response_gen():
-        yield json.dumps({"cost": 0, "sources": ""})
-        yield "\n ###endjson### \n\n"
-        full_text = ""
-        for event in response:
-            event_text = event["choices"][0]["delta"]
-            answer = event_text.get("content", "")
-            time.sleep(delay_time)
-            full_text += answer
-            yield answer
-        chatbot.collect_response(full_text)
-
-    if open_ai_key:
-        os.environ["OPENAI_API_KEY"] = ""
-
-    return Response(stream_with_context(response_gen()))
+    # flush deltas as soon as they arrive, optionally coalesced by
+    # STREAM_COALESCE_BYTES / STREAM_COALESCE_MS (see streaming.py)
+    response_gen = stream_answer(response,
+                                 on_complete=chatbot.collect_response,
+                                 sources=sources)
+
+    # tell nginx not to buffer the stream
+    return Response(stream_with_context(response_gen),
+                    headers={"X-Accel-Buffering": "no"})
 
 # Edit by Yixuan
-# Upload the file locally and create the index
-# The original code would create them via another indexing model for text
-# sumaarization, which is not in use in our project, so we delete it.
-# However, at the client side, we still need the json file to generate the 
+# Upload the file locally, extraction and indexing run as a background job
+# (see ingest.py) so the upload returns right away with the job id.
+# At the client side, we still need the json file to generate the 
 # file list for the side menu. 
 @app.route("/api/upload", methods=["POST"])
 def upload_file():
@@ -198,53 +176,125 @@ def upload_file():
     try:
         uploaded_file = request.files["file"]
         filename = uploaded_file.filename
-        print(os.getcwd(), os.path.abspath(__file__))
-        # directly upload the pdf to static, don't extract index
         filepath = os.path.join(f"{staticPath}/file", os.path.basename(filename))
-        #filepath = os.path.join(f"{staticPath}/temp", os.path.basename(filename))
         uploaded_file.save(filepath)
         print("--- debug: ", filepath, filename)
 
-        #token_usage = create_index(filepath, filename)
-        #print(type(token_usage))
+        # the hash is recorded by the job, it reads the whole file
+        catalog.put(os.path.basename(filename), size=os.path.getsize(filepath), status=QUEUED)
+        job_id = ingest_queue.submit(filepath, os.path.basename(filename),
+                                     api_key=request.form.get("openAiKey"))
     except Exception as e:
         logger.error(e, exc_info=True)
         # cleanup temp file
         print(e, "upload error")
         if filepath is not None and os.path.exists(filepath):
             os.remove(filepath)
+            catalog.remove(os.path.basename(filepath))
 
         return "Error: {}".format(str(e)), 500
 
-    # cleanup temp file
-    #if filepath is not None and os.path.exists(filepath):
-    #    os.remove(filepath)
+    return jsonify({"jobId": job_id}), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"message": "job not found"}), 404
+    return jsonify(job)
+
 
-    return jsonify("ok"), 200
+# Both lists take optional query parameters:
+#   prefix: names starting with it (case-insensitive)
+#   limit: max items (1 to MAX_PAGE_SIZE), without it the whole list
+#   after: fullName of the last item of the previous page
+# They carry the catalog version as ETag, a client polling with
+# If-None-Match gets a 304 until a document changes.
+MAX_PAGE_SIZE = 1000
+
+
+def catalog_page():
+    """The paging arguments of a list request, None if limit isn't a number."""
+    limit = request.args.get("limit")
+    if limit:
+        try:
+            limit = min(max(int(limit), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            return None
+    return dict(prefix=request.args.get("prefix", ""),
+                after=request.args.get("after") or None,
+                limit=limit or None)
+
+
+def catalog_response(etag, build):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # the browser revalidates every time, usually for a 304
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 
 @app.route("/api/index-list", methods=["GET"])
 def get_index_files():
-    dir = f"{staticPath}/index"
-    files = os.listdir(dir)
-    return files
+    page = catalog_page()
+    if page is None:
+        return jsonify({"message": "limit must be an integer"}), 400
+    # one <name>.json metadata file per index, next to its vectors and texts
+    return catalog_response(catalog.etag(), lambda: [
+        f"{name}.json" for name in catalog.list_indexed(**page)])
 
 
 @app.route("/api/file-list", methods=["GET"])
 def get_html_files():
+    page = catalog_page()
+    if page is None:
+        return jsonify({"message": "limit must be an integer"}), 400
     dir = f"{staticPath}/file"
-    files = os.listdir(dir)
-    file_list = [
+    # the content hash in the path lets the browser cache the file for good
+    return catalog_response(catalog.etag(), lambda: [
         {
-            "path": f"/{dir}/{file}",
-            "name": os.path.splitext(file)[0],
-            "ext": os.path.splitext(file)[1],
-            "fullName": file,
+            "path": f"/{dir}/{row['full_name']}"
+                    + (f"?v={row['file_hash'][:16]}" if row["file_hash"] else ""),
+            "name": row["name"],
+            "ext": row["ext"],
+            "fullName": row["full_name"],
+            "size": row["size"],
+            "pages": row["pages"],
+            "status": row["status"],
+            "indexed": bool(row["indexed"]),
+            "hash": row["file_hash"],
         }
-        for file in files
-    ]
+        for row in catalog.list(**page)
+    ])
+
+# Uploaded documents, with byte ranges and the content hash as ETag. Through
+# nginx, the sending is handed over to it (see file_delivery.py and
+# nginx.conf).
+@app.route(f"/{staticPath}/file/<path:filename>", methods=["GET"])
+def get_document(filename):
+    name = os.path.basename(filename)
+    filepath = os.path.join(f"{staticPath}/file", name)
+    if not os.path.isfile(filepath):
+        return jsonify({"message": "file not found"}), 404
+    row = catalog.get(name)
+    file_hash = row["file_hash"] if row else None
+    if file_hash is None:
+        # not hashed yet (copied in by hand, or its ingest job hasn't run),
+        # hashing a large file here would hold up the request
+        stat = os.stat(filepath)
+        etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    else:
+        etag = file_hash
+    version = request.args.get("v")
+    immutable = bool(file_hash and version and file_hash.startswith(version))
+    return send_document(request, filepath, etag,
+                         cache_control=IMMUTABLE if immutable else REVALIDATE,
+                         accel_prefix=request.headers.get("X-Accel-Location"))
 
-    return sorted(file_list, key=lambda x: x["name"].lower())
 
 @app.route("/api/delete", methods=["GET"])
 def delete_file():
@@ -256,7 +306,41 @@ def delete_file():
         os.remove(filepath)
     else:
         print("The file does not exist")
+    catalog.remove(os.path.basename(filename))
+    name = os.path.splitext(os.path.basename(filename))[0]
+    session_cache.invalidate(lambda key: key[1] == name)
+    # the index goes with the file, so it's no longer found by /api/search
+    remove_index(name)
+    remove_lexical_index(name)
+    ann_index.remove(name)
+    retriever.forget(name)
+    manifest.remove_document(name)
     return "ok"
 
+
+# Search all the indexed documents, e.g. a semester of course PDFs.
+# nprobe trades recall for speed once the collection is clustered (see
+# ann_index.py), by default ANN_NPROBE.
+@app.route("/api/search", methods=["GET"])
+def search_documents():
+    query_text = request.args.get("query")
+    if not query_text:
+        return jsonify({"message": "query is required"}), 400
+    k = int(request.args.get("k", "10"))
+    nprobe = request.args.get("nprobe")
+    vector = embed_texts([query_text], api_key=request.args.get("openAiKey") or None)[0]
+    sources = ann_index.search_sources(vector, k=k, nprobe=int(nprobe) if nprobe else None)
+    return jsonify({"sources": sources})
+
+
+@app.route("/api/stats", methods=["GET"])
+def get_stats():
+    return jsonify({
+        "sessions": session_cache.stats(),
+        "responses": response_cache.stats(),
+        "semantic": semantic_cache.stats() if semantic_cache else None,
+        "ann": ann_index.stats(),
+    })
+
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,83 @@
+"""ASGI entry point.
+
+`/api/query` and `/api/summarize` are served natively with async generators,
+so many long-lived GPT streams can share one event loop instead of holding a
+sync worker each. Every other route (`/api/upload`, `/api/file-list`,
+`/api/delete`, `/api/index-list` and `/static`) is the flask app mounted
+through WSGIMiddleware, so the two apps can't drift apart.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+
+import json
+import logging
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from app import get_chatbot, summarizer, uploaded_path
+from streaming import END_JSON_MARKER, astream_answer
+
+logger = logging.getLogger("app")
+
+
+async def handle_error(request: Request, error: Exception):
+    """Same json shape as the flask error handler."""
+    status_code = getattr(error, "status_code", 500)
+    print("some error:", error)
+    logger.error(error, exc_info=True)
+    return JSONResponse({"message": str(error)}, status_code=status_code)
+
+
+async def summarize_index(request: Request):
+    file = request.query_params.get("file")
+    open_ai_key = request.query_params.get("openAiKey")
+    cost, summary_gen = await summarizer.asummarize(uploaded_path(file),
+                                                    api_key=open_ai_key or None)
+
+    async def response_generator():
+        yield json.dumps({"cost": cost, "sources": []})
+        yield END_JSON_MARKER
+        async for text in summary_gen:
+            yield text
+
+    return StreamingResponse(response_generator())
+
+
+async def query_index(request: Request):
+    query_text = request.query_params.get("query")
+    index_name = request.query_params.get("index")
+    open_ai_key = request.query_params.get("openAiKey")
+    major = request.query_params.get("userMajor")
+    session_id = request.query_params.get("sessionId")
+
+    # building a DialogManager reads its history from sqlite
+    chatbot = await run_in_threadpool(get_chatbot, index_name, major, session_id)
+    response, sources = await chatbot.aget_response(query=query_text,
+                                                    major=major,
+                                                    api_key=open_ai_key)
+    response_gen = astream_answer(response,
+                                  on_complete=chatbot.collect_response,
+                                  sources=sources)
+    return StreamingResponse(response_gen,
+                             headers={"X-Accel-Buffering": "no"})
+
+
+app = Starlette(
+    routes=[
+        Route("/api/summarize", summarize_index, methods=["GET"]),
+        Route("/api/query", query_index, methods=["GET"]),
+        Mount("/", WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"],
+                           allow_methods=["*"], allow_headers=["*"])],
+    exception_handlers={Exception: handle_error},
+)
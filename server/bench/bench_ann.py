@@ -0,0 +1,116 @@
+# encoding: utf-8
+"""Recall@10 and QPS of the cross-document IVF index (ann_index.py).
+
+Writes `--chunks` synthetic clustered embeddings split over `--docs`
+per-document indexes (vector_store format, as create_index writes them) in
+a temporary static/, trains the IVF index and runs `--queries` queries
+(chunks with some noise added) with several nprobe values. The exact search
+over all the documents is the reference for the recall and the baseline
+for the QPS.
+
+The default dim is 256: 1M ada-002 embeddings (1536 floats) are 6 GB, more
+than the memory of a small machine. The search cost per chunk scales with
+the dim, the recall depends on the clustering of the data.
+
+Run from server/:
+    python -m bench.bench_ann [--chunks 1000000] [--dim 256] [--nprobe 1,8,32,64]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+
+def make_collection(chunks, docs, dim, clusters, spread, seed=0):
+    """Write the per-document indexes, returns a sample of chunk vectors to
+    derive the queries from."""
+    from vector_store import VectorIndexWriter, index_prefix
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    sample = []
+    for d in range(docs):
+        count = chunks * (d + 1) // docs - chunks * d // docs
+        # a document covers a few topics
+        topics = rng.choice(clusters, 8, replace=False)
+        vectors = centers[rng.choice(topics, count)] \
+            + spread * rng.standard_normal((count, dim)).astype(np.float32) / np.sqrt(dim)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        with VectorIndexWriter(index_prefix(f"doc{d:04d}"), dim=dim) as writer:
+            for i, vector in enumerate(vectors):
+                writer.add(f"doc {d} chunk {i}", vector, {"page_no": 1})
+        sample.append(vectors[:4])
+    return np.concatenate(sample)
+
+
+def make_queries(sample, count, dim, spread, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = sample[rng.choice(len(sample), count, replace=False)] \
+        + spread / 2 * rng.standard_normal((count, dim)).astype(np.float32) / np.sqrt(dim)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run_queries(index, queries, k, nprobe=None, exact=False):
+    start = time.perf_counter()
+    if exact:
+        with index._lock:
+            results = [index._exact_search(q, k) for q in queries]
+    else:
+        results = [index._search(q, k, nprobe) for q in queries]
+    elapsed = time.perf_counter() - start
+    found = [{(name, row) for name, _, row, _ in result} for result in results]
+    return found, len(queries) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=2000, help="topics of the synthetic data")
+    parser.add_argument("--spread", type=float, default=1.5,
+                        help="noise around a topic, relative to its center")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", default="1,8,32,64")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-ann-")
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        from ann_index import AnnIndex
+
+        start = time.perf_counter()
+        sample = make_collection(args.chunks, args.docs, args.dim, args.clusters, args.spread)
+        print(f"{args.chunks} chunks in {args.docs} documents, dim {args.dim}:"
+              f" written in {time.perf_counter() - start:.1f}s")
+        queries = make_queries(sample, args.queries, args.dim, args.spread)
+
+        index = AnnIndex(nlist=args.nlist, refresh_interval=float("inf"))
+        index.refresh()
+        start = time.perf_counter()
+        index.train()
+        index._postings = index._build_postings()
+        print(f"nlist {args.nlist}: trained and assigned in {time.perf_counter() - start:.1f}s")
+
+        exact, exact_qps = run_queries(index, queries, args.k, exact=True)
+        print(f"{'nprobe':>8} {'recall@' + str(args.k):>10} {'QPS':>8}")
+        print(f"{'exact':>8} {1.0:>10.3f} {exact_qps:>8.1f}")
+        for nprobe in [int(n) for n in args.nprobe.split(",")]:
+            found, qps = run_queries(index, queries, args.k, nprobe=nprobe)
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+            print(f"{nprobe:>8} {recall:>10.3f} {qps:>8.1f}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
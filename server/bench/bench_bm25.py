@@ -0,0 +1,98 @@
+# encoding: utf-8
+"""Build cost and lookup latency of the BM25 index (lexical_index.py).
+
+Chunks are `--words` words drawn from a Zipf-distributed vocabulary of
+`--vocab` terms, like the text of a long PDF. For each chunk count:
+
+- build: LexicalIndexWriter, fed in batches of 64 chunks as create_index
+  does, with the peak Python memory of the writer (tracemalloc)
+- load: LexicalIndex from the .bm25.npz, as the first query of a document
+- query: LexicalIndex.scores of `--queries` queries of 2 to 4 terms, mixing
+  frequent and rare terms, p50 and p99
+
+Run from server/:
+    python -m bench.bench_bm25 [--chunks 1000,10000,30000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from lexical_index import LexicalIndex, LexicalIndexWriter
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+def make_chunks(count, vocab, words, seed=0):
+    rng = np.random.default_rng(seed)
+    terms = np.array([f"term{i}" for i in range(vocab)])
+    ids = np.minimum(rng.zipf(1.2, (count, words)), vocab) - 1
+    return [" ".join(terms[row]) for row in ids]
+
+
+def build(path, chunks, batch_size=64):
+    tracemalloc.start()
+    start = time.perf_counter()
+    writer = LexicalIndexWriter(path)
+    for i in range(0, len(chunks), batch_size):
+        writer.add_documents(Chunk(text) for text in chunks[i:i + batch_size])
+    writer.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def make_queries(count, vocab, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        # a few terms of the text's distribution and a rare one
+        common = np.minimum(rng.zipf(1.2, rng.integers(1, 4)), vocab) - 1
+        terms = [*common, rng.integers(0, vocab)]
+        queries.append(" ".join(f"term{i}" for i in terms))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", default="1000,10000,30000")
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=300, help="words per chunk")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries, args.vocab)
+    print(f"{'chunks':>7} {'build':>8} {'writer MB':>10} {'file MB':>8} {'load':>8}"
+          f" {'p50':>8} {'p99':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in [int(c) for c in args.chunks.split(",")]:
+            chunks = make_chunks(count, args.vocab, args.words)
+            path = os.path.join(tmp, f"doc{count}.bm25.npz")
+            elapsed, peak = build(path, chunks)
+            del chunks
+
+            start = time.perf_counter()
+            index = LexicalIndex(path)
+            load = time.perf_counter() - start
+            index.scores(queries[0])
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                index.scores(query)
+                latencies.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"{count:>7} {elapsed:>7.2f}s {peak / 2**20:>10.1f}"
+                  f" {os.path.getsize(path) / 2**20:>8.1f} {load * 1000:>6.1f}ms"
+                  f" {p50:>6.2f}ms {p99:>6.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# encoding: utf-8
+"""Chunking throughput and chunk sizes of CJKPDFReader.
+
+The page texts are generated (see synthetic_pdf.page_lines), so only the
+chunking is measured, not the extraction. Two decks:
+
+- slides: `--pages` pages of 1 to 8 sentences, like lecture slides
+- reader: `--pages` pages of 40 sentences, like a course reader
+
+and three ways to chunk them:
+
+- "per page": a new SentenceSplitter for every page, as before
+- "split": one splitter for the reader, each page on its own (default)
+- "merge": the page chunks packed up to chunk_size tokens (PDF_MERGE_PAGES=1)
+
+For each, pages/s and the size of the chunks in tokens of the splitter's
+encoding: count, chunks under `--small` tokens, median and max.
+
+Run from server/:
+    python -m bench.bench_chunking [--pages 300] [--repeat 3]
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from llama_index.langchain_helpers.text_splitter import SentenceSplitter
+
+from bench.synthetic_pdf import page_lines
+from pdf_loader import SPLITTER_ENCODING, CJKPDFReader
+from tokenizer import get_encoding
+
+
+def deck(pages, min_lines, max_lines, seed=0):
+    rng = random.Random(seed)
+    return [(page_no, " ".join(page_lines(page_no, rng.randint(min_lines, max_lines))))
+            for page_no in range(1, pages + 1)]
+
+
+class PerPageReader(CJKPDFReader):
+    """A new splitter for every page, like the reader did before."""
+    def _split_pages(self, pages):
+        for page_no, text in pages:
+            self.splitter = SentenceSplitter(chunk_size=self.chunk_size)
+            yield from super()._split_pages([(page_no, text)])
+
+
+def run(reader, pages, repeat):
+    reader.iter_page_texts = lambda filepath: iter(pages)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        documents = list(reader.lazy_load_data("deck.pdf"))
+        best = min(best, time.perf_counter() - start)
+    return documents, len(pages) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--small", type=int, default=50, help="tokens of a chunk counted as small")
+    args = parser.parse_args()
+    encoding = get_encoding(SPLITTER_ENCODING)
+
+    print(f"{'deck':>7} {'mode':>9} {'pages/s':>8} {'chunks':>7} {'small':>6}"
+          f" {'median':>7} {'max':>5}")
+    for name, (low, high) in [("slides", (1, 8)), ("reader", (40, 40))]:
+        pages = deck(args.pages, low, high)
+        for mode, reader in [
+            ("per page", PerPageReader(workers=1)),
+            ("split", CJKPDFReader(workers=1)),
+            ("merge", CJKPDFReader(workers=1, merge_pages=True)),
+        ]:
+            documents, rate = run(reader, pages, args.repeat)
+            sizes = np.array([len(encoding.encode(d.text, disallowed_special=())) for d in documents])
+            print(f"{name:>7} {mode:>9} {rate:>8.0f} {len(sizes):>7} {int((sizes < args.small).sum()):>6}"
+                  f" {int(np.median(sizes)):>7} {int(sizes.max()):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# encoding: utf-8
+"""Chunking time of markdown documents (custom_loader.CustomReader).
+
+"before" is the loader as it was: every block tokenized twice with a new
+encoder each time, and a block over the chunk size encoded again for every
+slice of it. "after" is CustomReader, one encode_batch call for all the
+blocks. Both get the same html, converted from a generated markdown
+document of `--sections` sections (headings, paragraphs, lists, code and a
+few long paragraphs), and their output must be identical.
+
+Run from server/:
+    python -m bench.bench_custom_loader [--sections 100,1000,4000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import markdown
+import tiktoken
+from bs4 import BeautifulSoup
+from llama_index.readers.schema.base import Document
+
+staticPath = "static"
+
+WORDS = ("the parser builds a tree of constituents for every sentence while the"
+         " tagger assigns each token its part of speech").split()
+
+
+def old_load_data(html, filename) -> list:
+    """CustomReader.load_data before the single tokenization pass."""
+    def encode_string(string, encoding_name="p50k_base"):
+        return tiktoken.get_encoding(encoding_name).encode(string)
+
+    def decode_string(token, encoding_name="p50k_base"):
+        return tiktoken.get_encoding(encoding_name).decode(token)
+
+    def num_tokens_from_string(string, encoding_name="p50k_base"):
+        return len(tiktoken.get_encoding(encoding_name).encode(string))
+
+    def split_text_to_doc(text, current_chunk_id, chunk_size=400):
+        chunks = []
+        token_len = num_tokens_from_string(text)
+        for i in range(0, token_len, chunk_size):
+            encode_text = encode_string(text)
+            decode_text = decode_string(encode_text[i : i + chunk_size]).strip()
+            chunks.append(Document(decode_text, extra_info={"chunk_id": f"chunk-{current_chunk_id}"}))
+        return chunks
+
+    soup = BeautifulSoup(html, "html.parser")
+    current_chunk_text = ""
+    current_chunk_id = 1
+    document_list = []
+    current_chunk_length = 0
+    chunk_size = 400
+    headings = ["h1", "h2", "h3"]
+    heading_doms = soup.find_all(headings)
+    if len(heading_doms) == 0:
+        heading_doms = [soup.find()]
+
+    for tag in heading_doms:
+        tag["data-chunk_id"] = f"chunk-{current_chunk_id}"
+        current_chunk_text = tag.text.strip()
+        next_tag = tag.find_next_sibling()
+        while next_tag and next_tag.name not in headings:
+            stripped_text = next_tag.text.strip()
+            if current_chunk_length + num_tokens_from_string(stripped_text) > chunk_size:
+                document_list.append(Document(current_chunk_text.strip(),
+                                              extra_info={"chunk_id": f"chunk-{current_chunk_id}"}))
+                current_chunk_text = ""
+                current_chunk_length = 0
+                current_chunk_id += 1
+                document_list += split_text_to_doc(stripped_text, current_chunk_id)
+            else:
+                current_chunk_text = f"{current_chunk_text} {stripped_text}"
+                current_chunk_length += num_tokens_from_string(stripped_text) + 1
+            next_tag["data-chunk_id"] = f"chunk-{current_chunk_id}"
+            next_tag = next_tag.find_next_sibling()
+
+        document_list.append(Document(current_chunk_text.strip(),
+                                      extra_info={"chunk_id": f"chunk-{current_chunk_id}"}))
+        current_chunk_text = ""
+        current_chunk_length = 0
+        current_chunk_id += 1
+
+    with open(f"{staticPath}/file/{filename}.html", "w", encoding="utf-8") as f:
+        f.write(str(soup))
+    return document_list
+
+
+def make_markdown(sections, seed=0):
+    rng = random.Random(seed)
+
+    def sentence(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+    parts = []
+    for i in range(sections):
+        parts.append(f"{'#' * rng.randint(1, 3)} Section {i}")
+        for _ in range(rng.randint(1, 6)):
+            kind = rng.random()
+            if kind < 0.1:
+                # longer than a chunk, it's sliced by token offset
+                parts.append(" ".join(sentence(20) for _ in range(rng.randint(30, 80))))
+            elif kind < 0.3:
+                parts.append("\n".join(f"- {sentence(8)}" for _ in range(rng.randint(2, 6))))
+            elif kind < 0.4:
+                parts.append("```python\nfor token in sentence:\n    tag(token)\n```")
+            else:
+                parts.append(" ".join(sentence(15) for _ in range(rng.randint(1, 8))))
+    return "\n\n".join(parts)
+
+
+def to_html(text):
+    # as create_index converts .md files
+    return markdown.markdown(text, extensions=["pymdownx.superfences", "tables", "pymdownx.details"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", default="100,1000,4000")
+    args = parser.parse_args()
+    from custom_loader import CustomReader
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs(f"{staticPath}/file")
+        try:
+            print(f"{'sections':>8} {'MB':>6} {'chunks':>7} {'before':>8} {'after':>8}")
+            for sections in [int(s) for s in args.sections.split(",")]:
+                html = to_html(make_markdown(sections))
+                start = time.perf_counter()
+                old = old_load_data(html, "before")
+                before = time.perf_counter() - start
+                start = time.perf_counter()
+                new = CustomReader().load_data(html=html, filename="after")
+                after = time.perf_counter() - start
+                assert [(d.text, d.extra_info) for d in old] == [(d.text, d.extra_info) for d in new]
+                print(f"{sections:>8} {len(html) / 2**20:>6.1f} {len(new):>7}"
+                      f" {before:>7.2f}s {after:>7.2f}s")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
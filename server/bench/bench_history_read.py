@@ -0,0 +1,95 @@
+# encoding: utf-8
+"""Cold load of a chat history as it grows.
+
+A DialogManager that isn't in memory reads the newest messages that fit
+within its token budget (7000):
+
+- "before": the old query, the last 500 rows by the unindexed timestamp,
+  then split() on every row to count tokens
+- "budget range": HistoryStore.read_messages, one range scan on the index
+  of where each row starts in the running token sum
+
+Histories are filled with messages of 20 to 200 words. Each read opens a
+fresh connection, like a cold start.
+
+Run from server/:
+    python -m bench.bench_history_read [--sizes 1000,10000,100000,200000]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from history_store import HistoryStore
+
+WORDS = "the grammar parses each sentence into a tree of constituents".split()
+
+
+def fill(path, rows):
+    store = HistoryStore()
+    rng = random.Random(rows)
+    batch = []
+    for i in range(rows):
+        words = rng.randint(20, 200)
+        content = " ".join(rng.choice(WORDS) for _ in range(words))
+        batch.append(("user" if i % 2 == 0 else "assistant", content, words))
+        if len(batch) == 10000 or i == rows - 1:
+            # the same insert as add_message, one transaction per batch
+            store._write_batch([(path, *row) for row in batch])
+            batch = []
+    store.close()
+
+
+def old_read(path, thresh=7000):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT role, content FROM history ORDER BY timestamp DESC LIMIT 500").fetchall()
+    conn.close()
+    messages = []
+    token_count = 0
+    for row in rows:
+        token_count += len(row[1].split())
+        if token_count > thresh:
+            break
+        messages.append({"role": row[0], "content": row[1]})
+    messages.reverse()
+    return messages
+
+
+def new_read(path, thresh=7000):
+    store = HistoryStore()
+    rows = store.read_messages(path, budget=thresh)
+    store.close()
+    return rows
+
+
+def best_of(func, path, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func(path)
+        times.append(time.perf_counter() - start)
+    return min(times), len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000,200000")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'before':>10} {'budget range':>13} {'messages':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in map(int, args.sizes.split(",")):
+            path = os.path.join(directory, f"history{rows}.db")
+            fill(path, rows)
+            old, _ = best_of(old_read, path, args.runs)
+            new, count = best_of(new_read, path, args.runs)
+            print(f"{rows:8d} {old * 1000:7.2f} ms {new * 1000:10.2f} ms {count:9d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# encoding: utf-8
+"""Messages per second written to the dialog history by many concurrent chats.
+
+Each thread plays a few chats and appends user/assistant messages to their
+databases, like concurrent /api/query requests do:
+
+- "connect per message": what DialogHistoryManager did before history_store,
+  a new connection, an insert and a commit per message
+- "pooled": HistoryStore, persistent WAL connections
+- "write-behind": HistoryStore(write_behind=True), flushed at the end
+
+Run from server/:
+    python -m bench.bench_history_store [--chats 200] [--threads 16] [--messages 50]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from history_store import HistoryStore
+
+OLD_CREATE_SQL = """
+    CREATE TABLE history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+MESSAGE = "explain the meaning of context-free grammar " * 4
+
+
+class ConnectPerMessage:
+    def add_message(self, path, role, content, tokens):
+        if not os.path.exists(path):
+            conn = sqlite3.connect(path)
+            conn.execute(OLD_CREATE_SQL)
+            conn.commit()
+            conn.close()
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO history (role, content) VALUES (?, ?)", (role, content))
+        conn.commit()
+        conn.close()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(store, directory, chats, threads, messages):
+    paths = [os.path.join(directory, f"chat{i}.db") for i in range(chats)]
+
+    def play(worker):
+        for turn in range(messages // 2):
+            for path in paths[worker::threads]:
+                store.add_message(path, "user", MESSAGE, 40)
+                store.add_message(path, "assistant", MESSAGE, 40)
+
+    workers = [threading.Thread(target=play, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    store.flush()
+    elapsed = time.perf_counter() - start
+    store.close()
+    return chats * (messages // 2) * 2 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=50, help="per chat")
+    args = parser.parse_args()
+
+    stores = [
+        ("connect per message", ConnectPerMessage),
+        ("pooled", lambda: HistoryStore(pool_size=4)),
+        ("write-behind", lambda: HistoryStore(pool_size=4, write_behind=True)),
+    ]
+    print(f"{args.chats} chats, {args.threads} threads, {args.messages} messages per chat")
+    for name, make_store in stores:
+        with tempfile.TemporaryDirectory() as directory:
+            rate = run(make_store(), directory, args.chats, args.threads, args.messages)
+        print(f"{name:22} {rate:9.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# encoding: utf-8
+"""Cost per turn of keeping the history window within the token budget,
+over long sessions.
+
+A turn adds the user message, builds the window sent to the api (trimming
+the oldest messages) and adds the answer:
+
+- "list + pop(0)": the DialogHistoryManager before, a list trimmed with
+  pop(0), split() counts and [sys] + messages per request
+- "deque": gpt4_wrapper.DialogHistoryManager, deques with cached token
+  counts (its tokenizer calls included)
+
+The store is a no-op, so only the in-memory work is timed. Short messages
+make for a long window (many messages within 7000 tokens), where the
+difference shows most.
+
+Run from server/:
+    python -m bench.bench_history_trim [--turns 1000,10000,50000] [--words 5]
+"""
+
+import argparse
+import time
+
+from gpt4_wrapper import DialogHistoryManager
+
+
+class NullStore:
+    def read_messages(self, path, budget):
+        return []
+
+    def add_message(self, path, role, content, tokens):
+        pass
+
+    def release(self, path):
+        pass
+
+
+class ListHistory:
+    """The history of DialogHistoryManager before deques."""
+    def __init__(self, prefix="", thresh=7000):
+        self.messages = []
+        self.sys_messages = {"role": "system", "content": prefix}
+        self.token_count = 0
+        self.thresh = thresh
+
+    def _add_message(self, role, message):
+        self.token_count += len(message.split())
+        self.messages.append({"role": role, "content": message})
+
+    def add_user_message(self, message):
+        self._add_message("user", message)
+
+    def add_assistant_message(self, message):
+        self._add_message("assistant", message)
+
+    def get_message_for_api(self):
+        while self.token_count > self.thresh:
+            first_message = self.messages.pop(0)
+            self.token_count -= len(first_message["content"].split())
+        return [self.sys_messages] + self.messages
+
+
+def session(history, turns, words):
+    question = " ".join(["what"] * words)
+    answer = " ".join(["answer"] * words)
+    start = time.perf_counter()
+    for _ in range(turns):
+        history.add_user_message(question)
+        history.get_message_for_api()
+        history.add_assistant_message(answer)
+    return (time.perf_counter() - start) / turns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", default="1000,10000,50000")
+    parser.add_argument("--words", type=int, default=5, help="per message")
+    args = parser.parse_args()
+
+    prefix = "You are a computational linguistics expert."
+    print(f"messages of {args.words} words, budget 7000 tokens")
+    # the windows differ: split() misses the tokens of punctuation and of the
+    # chat format, the deque counts them
+    print(f"{'turns':>7} {'list + pop(0)':>14} {'window':>7} {'deque':>10} {'window':>7}")
+    for turns in map(int, args.turns.split(",")):
+        old_history = ListHistory(prefix=prefix)
+        old = session(old_history, turns, args.words)
+        history = DialogHistoryManager(prefix=prefix, store=NullStore())
+        new = session(history, turns, args.words)
+        print(f"{turns:7d} {old * 1e6:11.1f} us {len(old_history.messages):7d}"
+              f" {new * 1e6:7.1f} us {len(history.messages):7d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# encoding: utf-8
+"""Page extraction throughput of CJKPDFReader by worker count.
+
+Extracts a synthetic multi-hundred-page PDF (see synthetic_pdf.py), or the
+given files, with 1, 2, 4, ... workers up to the number of cores and prints
+pages/sec. The pool start-up is part of the measured time, like in an
+upload. Each parallel run is checked against the serial text.
+
+Run from server/:
+    python -m bench.bench_pdf_extract [--pages 300] [--workers 1,2,4] [--pdf a.pdf ...]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from bench.synthetic_pdf import write_pdf
+from pdf_loader import CJKPDFReader, count_pages
+
+
+def default_workers():
+    cores = os.cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 <= cores:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != cores:
+        workers.append(cores)
+    return workers
+
+
+def extract(path, workers):
+    reader = CJKPDFReader(workers=workers, min_parallel_pages=0)
+    start = time.perf_counter()
+    pages = list(reader.iter_page_texts(path))
+    return time.perf_counter() - start, pages
+
+
+def is_pdf(path):
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+
+def run(path, workers_list):
+    num_pages = count_pages(path)
+    print(f"{os.path.basename(path)}: {num_pages} pages")
+    print(f"{'workers':>8} {'seconds':>8} {'pages/s':>8} {'speedup':>8}")
+    serial = None
+    for workers in workers_list:
+        elapsed, pages = extract(path, workers)
+        if serial is None:
+            serial = (elapsed, pages)
+        elif pages != serial[1]:
+            raise AssertionError(f"{workers} workers: pages differ from the serial run")
+        print(f"{workers:>8} {elapsed:>8.2f} {num_pages / elapsed:>8.1f} {serial[0] / elapsed:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", default=None, help="comma separated, default 1, 2, 4, ... cores")
+    parser.add_argument("--pdf", nargs="*", default=[], help="extract these files as well")
+    args = parser.parse_args()
+    workers_list = ([int(w) for w in args.workers.split(",")] if args.workers
+                    else default_workers())
+    print(f"cores: {os.cpu_count()}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.pdf")
+        write_pdf(path, args.pages)
+        run(path, workers_list)
+    for path in args.pdf:
+        if not is_pdf(path):
+            # e.g. server/2308.08708 is a sqlite file despite its name
+            print(f"{path}: not a PDF, skipped")
+            continue
+        run(path, workers_list)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# encoding: utf-8
+"""Peak RSS of indexing a PDF by page count.
+
+Runs create_index on synthetic PDFs (see synthetic_pdf.py) of growing size,
+each in a fresh process, with the embeddings served by the local mock api.
+Two modes:
+
+- "list": the chunks of the whole file are collected first, as
+  load_data did before, then indexed
+- "lazy": create_index as is, the chunks are indexed in batches while the
+  pages are extracted
+
+Peak RSS is the process' ru_maxrss, extraction runs serially (one worker)
+so it's all in the measured process.
+
+Run from server/:
+    python -m bench.bench_pdf_memory [--pages 100,400,1600]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+
+def child(path, mode, api_base):
+    os.chdir(os.path.dirname(path))
+    import create_index as ci
+    from llm_client import llm_client
+    from manifest import Manifest
+    from pdf_loader import CJKPDFReader
+
+    llm_client.api_base = api_base
+    os.environ["PDF_WORKERS"] = "1"
+
+    class Reader(CJKPDFReader):
+        def lazy_load_data(self, *args, **kwargs):
+            documents = super().lazy_load_data(*args, **kwargs)
+            return iter(list(documents)) if mode == "list" else documents
+
+    ci.CJKPDFReader = Reader
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tokens = ci.create_index(path, "synthetic.pdf", manifest=Manifest("manifest.db"),
+                             api_key="bench")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"base_mb": base / 1024, "peak_mb": peak / 1024, "tokens": tokens}))
+
+
+def measure(pages, mode, api_base):
+    from bench.synthetic_pdf import write_pdf
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.pdf")
+        write_pdf(path, pages)
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.bench_pdf_memory", "--child", path, mode, api_base],
+            check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", default="100,400,1600")
+    parser.add_argument("--modes", default="list,lazy")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    from bench.mock_openai import MockOpenAI
+
+    print(f"{'pages':>6} {'mode':>5} {'base MB':>8} {'peak MB':>8} {'growth MB':>10}")
+    with MockOpenAI() as mock:
+        for pages in [int(p) for p in args.pages.split(",")]:
+            for mode in args.modes.split(","):
+                result = measure(pages, mode, mock.url)
+                print(f"{pages:>6} {mode:>5} {result['base_mb']:>8.1f} {result['peak_mb']:>8.1f}"
+                      f" {result['peak_mb'] - result['base_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# encoding: utf-8
+"""Time to first byte and total time of a streamed /api/query answer.
+
+The answer comes from the local mock api (bench/mock_openai.py) through
+llm_client, and is streamed by streaming.stream_answer, with and without
+coalescing. "sleep + concat" is the generator /api/query had before: a
+10 ms sleep per delta and the answer built with +=.
+
+Run from server/:
+    python -m bench.bench_streaming [--tokens 1000] [--token-delay 0.001]
+"""
+
+import argparse
+import json
+import time
+
+from bench.mock_openai import MockOpenAI
+from llm_client import LLMClient
+from streaming import END_JSON_MARKER, coalesce, iter_openai_deltas, stream_answer
+
+
+def old_stream(events, on_complete):
+    # /api/query before streaming.py
+    yield json.dumps({"cost": 0, "sources": ""})
+    yield END_JSON_MARKER
+    full_text = ""
+    for event in events:
+        answer = event["choices"][0]["delta"].get("content", "")
+        time.sleep(0.01)
+        full_text += answer
+        yield answer
+    on_complete(full_text)
+
+
+def new_stream(events, on_complete, max_bytes=0, max_delay_ms=0):
+    chunks = coalesce(iter_openai_deltas(events), max_bytes, max_delay_ms)
+    return stream_answer(chunks, on_complete=on_complete)
+
+
+def measure(client, api_base, make_stream):
+    collected = []
+    start = time.perf_counter()
+    events = client.chat([{"role": "user", "content": "hi"}], api_key="bench",
+                         api_base=api_base, stream=True, model="gpt-4")
+    first = None
+    chunks = 0
+    # the header and the marker are sent before the first delta arrives
+    for i, chunk in enumerate(make_stream(events, collected.append)):
+        if i == 2:
+            first = time.perf_counter() - start
+        chunks += 1
+    total = time.perf_counter() - start
+    return first, total, chunks - 2, len(collected[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    variants = [
+        ("sleep + concat (before)", old_stream),
+        ("stream_answer", new_stream),
+        ("coalesce 256 bytes", lambda e, c: new_stream(e, c, max_bytes=256)),
+        ("coalesce 50 ms", lambda e, c: new_stream(e, c, max_delay_ms=50)),
+    ]
+    client = LLMClient()
+    with MockOpenAI(tokens=args.tokens, token_delay=args.token_delay,
+                    first_token_delay=args.first_token_delay) as mock:
+        print(f"{args.tokens} deltas, {args.first_token_delay * 1000:.0f} ms to the first,"
+              f" {args.token_delay * 1000:.1f} ms between deltas upstream")
+        print(f"{'':26} {'first delta':>12} {'total':>10} {'chunks':>8}")
+        for name, make_stream in variants:
+            results = [measure(client, mock.url, make_stream) for _ in range(args.runs)]
+            first = min(r[0] for r in results)
+            total = min(r[1] for r in results)
+            print(f"{name:26} {first * 1000:9.1f} ms {total:8.3f} s {results[0][2]:8d}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
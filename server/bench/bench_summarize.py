@@ -0,0 +1,96 @@
+# encoding: utf-8
+"""End-to-end latency of /api/summarize's summarizer, cold and warm.
+
+The chat api is the local mock (bench/mock_openai.py): every answer starts
+after `--first-token-delay` and has `--tokens` deltas `--token-delay` apart,
+so a map call takes first delay + tokens x delay and the streamed reduce
+step shows its first token after the first delay.
+
+The document is a synthetic PDF (see synthetic_pdf.py) of `--pages` pages,
+a few map chunks long. Each run gets a fresh manifest, so a cold summary
+includes the page extraction:
+
+- cold, sync with 1 and `--workers` workers (Summarizer.summarize)
+- cold, async (Summarizer.asummarize, as the ASGI app)
+- warm: the summary is in the manifest
+
+Run from server/:
+    python -m bench.bench_summarize [--pages 30] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from bench.mock_openai import MockOpenAI
+from bench.synthetic_pdf import write_pdf
+from llm_client import llm_client
+from manifest import Manifest
+from summarizer import Summarizer, load_texts, split_chunks
+
+
+def run_sync(summarizer, path):
+    start = time.perf_counter()
+    _, chunks = summarizer.summarize(path, api_key="bench")
+    first = None
+    for _ in chunks:
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run_async(summarizer, path):
+    async def run():
+        start = time.perf_counter()
+        _, chunks = await summarizer.asummarize(path, api_key="bench")
+        first = None
+        async for _ in chunks:
+            if first is None:
+                first = time.perf_counter() - start
+        return first, time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    args = parser.parse_args()
+    # the openai client logs every response once llama_index set up logging
+    logging.getLogger("openai").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockOpenAI(tokens=args.tokens, token_delay=args.token_delay,
+                       first_token_delay=args.first_token_delay) as mock:
+        llm_client.api_base = mock.url
+        path = os.path.join(tmp, "reader.pdf")
+        write_pdf(path, args.pages)
+        chunks = split_chunks(load_texts(path), Summarizer().chunk_tokens)
+        map_call = args.first_token_delay + args.token_delay * (args.tokens - 1)
+        print(f"{args.pages} pages, {len(chunks)} map chunks, map call {map_call:.2f}s")
+        print(f"{'run':>16} {'first token':>12} {'total':>8}")
+
+        runs = [
+            ("cold, 1 worker", 1, run_sync),
+            (f"cold, {args.workers} workers", args.workers, run_sync),
+            ("cold, async", args.workers, run_async),
+        ]
+        for i, (label, workers, run) in enumerate(runs):
+            summarizer = Summarizer(cache=Manifest(os.path.join(tmp, f"manifest{i}.db")),
+                                    workers=workers)
+            first, total = run(summarizer, path)
+            print(f"{label:>16} {first:>11.2f}s {total:>7.2f}s")
+        # the last manifest has the summary now
+        first, total = run_sync(summarizer, path)
+        print(f"{'warm':>16} {first * 1000:>10.1f}ms {total * 1000:>6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""Load time and memory of an index, llama_index json vs vector_store.
+
+For each chunk count, a synthetic index (random unit vectors, 200 word
+texts, page_no/chunk_id extra_info) is written both ways:
+
+- "json": the file GPTSimpleVectorIndex.save_to_disk wrote, loaded with
+  json.load (llama_index's load_from_disk parses it the same way and then
+  builds its objects, so this is a lower bound)
+- "f32" / "f16": VectorIndex, opened and scored against one query, i.e.
+  one matvec over all the rows, as the first question about a document
+
+Each load runs in a fresh process. RSS growth is the resident memory
+after the load minus before it (Linux); for the binary indexes it is the
+mapped pages, shared by all the worker processes through the OS page
+cache, and the float32 copy of a float16 matrix.
+
+Run from server/:
+    python -m bench.bench_vector_store [--chunks 500,3000,10000] [--dim 1536]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+WORDS = "the grammar parses each sentence into a tree of constituents".split()
+
+
+def legacy_json(rows):
+    """The dict GPTSimpleVectorIndex.save_to_disk wrote for rows of (text,
+    embedding, extra_info), in chunk order."""
+    nodes, docs, embeddings = {}, {}, {}
+    for text, embedding, extra_info in rows:
+        node_id = str(uuid.uuid4())
+        nodes[node_id] = node_id
+        docs[node_id] = {"text": text, "doc_id": node_id, "embedding": None,
+                         "extra_info": extra_info, "__type__": "1"}
+        embeddings[node_id] = [float(x) for x in embedding]
+    return {
+        "index_struct": {"__type__": "simple_dict", "__data__": {
+            "index_id": str(uuid.uuid4()), "summary": None, "nodes_dict": nodes,
+            "doc_id_dict": {}, "embeddings_dict": {}}},
+        "docstore": {"__type__": "simple", "__data__": {"docs": docs, "ref_doc_info": {}}},
+        "vector_store": {"__type__": "simple", "__data__": {"simple_vector_store_data_dict": {
+            "embedding_dict": embeddings, "text_id_to_doc_id": {}}}},
+    }
+
+
+def make_rows(count, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    words = np.array(WORDS)
+    for i, vector in enumerate(vectors):
+        text = " ".join(words[rng.integers(0, len(words), 200)])
+        yield text, vector, {"page_no": i // 3 + 1, "chunk_id": f"chunk-{i}"}
+
+
+def rss_mb():
+    """Current resident memory (Linux), the peak hides what an import freed."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def child(kind, path, dim):
+    from vector_store import VectorIndex
+
+    before = rss_mb()
+    start = time.perf_counter()
+    if kind == "json":
+        with open(path, encoding="utf-8") as f:
+            saved = json.load(f)
+    else:
+        index = VectorIndex(path)
+        query = np.ones(dim, dtype=np.float32) / np.sqrt(dim)
+        np.asarray(index.vectors, dtype=np.float32) @ query
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb() - before}))
+
+
+def measure(kind, path, dim):
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.bench_vector_store", "--child", kind, path, str(dim)],
+        check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", default="500,3000,10000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], args.child[1], int(args.child[2]))
+        return
+
+    from vector_store import VectorIndexWriter
+
+    print(f"{'chunks':>7} {'format':>6} {'MB':>7} {'load':>9} {'RSS MB':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in [int(c) for c in args.chunks.split(",")]:
+            json_path = os.path.join(tmp, f"legacy{count}.json")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(legacy_json(make_rows(count, args.dim)), f)
+            results = [("json", json_path, os.path.getsize(json_path))]
+            for dtype, ext in (("float32", "f32"), ("float16", "f16")):
+                prefix = os.path.join(tmp, f"{ext}{count}")
+                with VectorIndexWriter(prefix, dim=args.dim, dtype=dtype) as writer:
+                    for text, vector, extra_info in make_rows(count, args.dim):
+                        writer.add(text, vector, extra_info)
+                size = sum(os.path.getsize(f"{prefix}.{e}") for e in (ext, "txt", "json"))
+                results.append((ext, prefix, size))
+            for kind, path, size in results:
+                result = measure(kind, path, args.dim)
+                print(f"{count:>7} {kind:>6} {size / 2**20:>7.1f} {result['seconds'] * 1000:>7.1f}ms"
+                      f" {result['rss_mb']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# encoding: utf-8
+"""Listing time of /api/file-list and /api/index-list, directory scan vs
+the sqlite catalog (catalog.py).
+
+`--files` empty files (default 50000) are created in a temporary
+static/file, with an index <name>.json for every other one, and the
+catalog is filled by `sync`. Each listing is built and serialized to json,
+as the route answers it:
+
+- "scan": os.listdir and a sort by lowercased name, what the routes did
+  before the catalog (without size, pages or status)
+- "full": the whole catalog, no limit (what the side menu asks for today)
+- "first" / "middle" / "last": a page of `--limit` rows, by keyset from
+  the start, from the middle and from the end of the list
+- "prefix": a page of the names starting with a 2 letter prefix
+- "etag": the version lookup of a poll answered with a 304
+
+Run from server/:
+    python -m bench.catalog_list [--files 50000] [--limit 100] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+from catalog import Catalog
+
+
+def make_files(file_dir, index_dir, count, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        word = "".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(4, 16)))
+        names.add(f"{word} {rng.randint(1, 99)}")
+    names = sorted(names)
+    for i, name in enumerate(names):
+        open(os.path.join(file_dir, f"{name}.pdf"), "wb").close()
+        if i % 2 == 0:
+            open(os.path.join(index_dir, f"{name}.json"), "wb").close()
+    return names
+
+
+def scan(file_dir):
+    """/api/file-list before the catalog."""
+    files = os.listdir(file_dir)
+    file_list = [
+        {
+            "path": f"/{file_dir}/{file}",
+            "name": os.path.splitext(file)[0],
+            "ext": os.path.splitext(file)[1],
+            "fullName": file,
+        }
+        for file in files
+    ]
+    return sorted(file_list, key=lambda x: x["name"].lower())
+
+
+def listing(catalog, file_dir, **page):
+    """/api/file-list with the catalog, see app.get_html_files."""
+    return [
+        {
+            "path": f"/{file_dir}/{row['full_name']}"
+                    + (f"?v={row['file_hash'][:16]}" if row["file_hash"] else ""),
+            "name": row["name"],
+            "ext": row["ext"],
+            "fullName": row["full_name"],
+            "size": row["size"],
+            "pages": row["pages"],
+            "status": row["status"],
+            "indexed": bool(row["indexed"]),
+            "hash": row["file_hash"],
+        }
+        for row in catalog.list(**page)
+    ]
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_dir, index_dir = os.path.join(tmp, "file"), os.path.join(tmp, "index")
+        os.makedirs(file_dir)
+        os.makedirs(index_dir)
+        names = make_files(file_dir, index_dir, args.files)
+        catalog = Catalog(os.path.join(tmp, "catalog.db"))
+        start = time.perf_counter()
+        catalog.sync(file_dir, index_dir)
+        print(f"{args.files} files, first sync {time.perf_counter() - start:.2f}s,", end=" ")
+        start = time.perf_counter()
+        catalog.sync(file_dir, index_dir)
+        print(f"sync without changes {time.perf_counter() - start:.2f}s")
+
+        middle = f"{names[len(names) // 2]}.pdf"
+        last = f"{names[-args.limit - 1]}.pdf"
+        cases = [
+            ("scan", lambda: scan(file_dir)),
+            ("full", lambda: listing(catalog, file_dir)),
+            ("first", lambda: listing(catalog, file_dir, limit=args.limit)),
+            ("middle", lambda: listing(catalog, file_dir, after=middle, limit=args.limit)),
+            ("last", lambda: listing(catalog, file_dir, after=last, limit=args.limit)),
+            ("prefix", lambda: listing(catalog, file_dir, prefix=names[0][:2], limit=args.limit)),
+            ("index", lambda: [f"{name}.json" for name in catalog.list_indexed(limit=args.limit)]),
+        ]
+        print(f"{'listing':>8} {'rows':>6} {'time':>10} {'json KB':>8}")
+        for name, build in cases:
+            seconds, body = best(lambda: json.dumps(build()), args.repeat)
+            print(f"{name:>8} {len(json.loads(body)):>6} {seconds * 1000:>8.2f}ms"
+                  f" {len(body) / 1024:>8.0f}")
+        seconds, _ = best(catalog.etag, args.repeat)
+        print(f"{'etag':>8} {'':>6} {seconds * 1000:>8.3f}ms")
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
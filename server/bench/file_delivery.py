@@ -0,0 +1,191 @@
+# encoding: utf-8
+"""Throughput of the document downloads (file_delivery.py) under gunicorn.
+
+A `--mb` MB file is served by one sync gunicorn worker in four ways:
+
+- "sendfile": send_document, the whole file through gunicorn's
+  wsgi.file_wrapper, i.e. sendfile, the bytes don't go through Python
+- "python": send_document without a file_wrapper, the file read and
+  written block by block (what other servers and the byte ranges get)
+- "flask": flask's send_from_directory, what /static/file used before
+- "accel": send_document with X-Accel-Location, only the answer of the
+  app; nginx would send the file (not running here)
+
+For each: MB/s of whole file downloads, requests/s of random 64 KiB byte
+ranges and of revalidations answered with a 304, and the CPU time of the
+worker per GB sent. Client and server share the machine, so on few cores
+the client's reads weigh on the MB/s; the worker CPU shows the difference.
+
+Run from server/ (needs gunicorn):
+    python -m bench.file_delivery [--mb 200] [--downloads 5] [--ranges 300]
+"""
+
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+RANGE_SIZE = 64 * 1024
+ETAG = "bench"
+MODES = ("sendfile", "python", "flask", "accel")
+
+
+def make_app():
+    """The app run by the gunicorn worker, it serves FILE_DIR."""
+    from flask import Flask, request, send_from_directory
+
+    from file_delivery import send_document
+
+    file_dir = os.environ["FILE_DIR"]
+    app = Flask(__name__)
+
+    @app.route("/<mode>/<name>")
+    def download(mode, name):
+        path = os.path.join(file_dir, name)
+        if mode == "flask":
+            return send_from_directory(file_dir, name, conditional=True)
+        return send_document(request, path, ETAG,
+                             accel_prefix="/internal/file/" if mode == "accel" else None)
+
+    flask_app = app.wsgi_app
+
+    def wsgi_app(environ, start_response):
+        if environ["PATH_INFO"].startswith("/python/"):
+            # a copy, gunicorn looks the wrapper up again after the call
+            environ = {k: v for k, v in environ.items() if k != "wsgi.file_wrapper"}
+        return flask_app(environ, start_response)
+
+    app.wsgi_app = wsgi_app
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"nothing listens on port {port}")
+
+
+def cpu_seconds(pid):
+    """user + system CPU time of a process (Linux)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def worker_pid(master_pid, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            children = f.read().split()
+        if children:
+            return int(children[0])
+        time.sleep(0.1)
+    raise RuntimeError("no gunicorn worker")
+
+
+class Client:
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port)
+
+    def get(self, url, headers=None):
+        self.conn.request("GET", url, headers=headers or {})
+        response = self.conn.getresponse()
+        return response.status, response.getheaders(), response.read()
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return time.perf_counter() - start
+
+
+def run_mode(client, worker, mode, size, args, rng):
+    url = f"/{mode}/doc.pdf"
+    status, headers, body = client.get(url, {"Range": "bytes=100-199"})
+    if mode == "accel":
+        assert dict(headers)["X-Accel-Redirect"] == "/internal/file/doc.pdf", headers
+    else:
+        assert status == 206 and len(body) == 100, (mode, status, len(body))
+
+    cpu = cpu_seconds(worker)
+    seconds = timed(lambda i: client.get(url), args.downloads)
+    sent = args.downloads * size
+    cpu_per_gb = (cpu_seconds(worker) - cpu) / (sent / 2**30)
+
+    starts = [rng.randrange(0, size - RANGE_SIZE) for _ in range(args.ranges)]
+    range_seconds = timed(lambda i: client.get(
+        url, {"Range": f"bytes={starts[i]}-{starts[i] + RANGE_SIZE - 1}"}), args.ranges)
+
+    etag = ETAG
+    if mode == "flask":
+        etag = dict(client.get(url, {"Range": "bytes=0-0"})[1])["ETag"].strip('"')
+    not_modified_seconds = timed(
+        lambda i: client.get(url, {"If-None-Match": f'"{etag}"'}), args.ranges)
+    assert client.get(url, {"If-None-Match": f'"{etag}"'})[0] == 304
+    if mode == "accel":
+        # no body, only the headers of the redirect
+        return None, args.ranges / range_seconds, args.ranges / not_modified_seconds, None
+    return (sent / seconds / 2**20, args.ranges / range_seconds,
+            args.ranges / not_modified_seconds, cpu_per_gb)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=200)
+    parser.add_argument("--downloads", type=int, default=5)
+    parser.add_argument("--ranges", type=int, default=300)
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "doc.pdf")
+        with open(path, "wb") as f:
+            for _ in range(args.mb):
+                f.write(os.urandom(2**20))
+        size = os.path.getsize(path)
+        port = free_port()
+        env = dict(os.environ, FILE_DIR=tmp,
+                   PYTHONPATH=os.pathsep.join([server_dir, os.environ.get("PYTHONPATH", "")]))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--workers", "1", "--bind", f"127.0.0.1:{port}",
+             "bench.file_delivery:make_app()"],
+            # not server/, its gunicorn.conf.py would configure the worker
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port)
+            worker = worker_pid(server.pid)
+            client = Client(port)
+            rng = random.Random(0)
+            print(f"{args.mb} MB file, {args.downloads} downloads, {args.ranges} ranges of 64 KiB")
+            print(f"{'mode':>9} {'MB/s':>7} {'ranges/s':>9} {'304/s':>7} {'CPU s/GB':>9}")
+            for mode in args.modes.split(","):
+                mb_s, ranges_s, not_modified_s, cpu_per_gb = run_mode(
+                    client, worker, mode, size, args, rng)
+                mb_s = f"{mb_s:.0f}" if mb_s is not None else "-"
+                cpu_per_gb = f"{cpu_per_gb:.2f}" if cpu_per_gb is not None else "-"
+                print(f"{mode:>9} {mb_s:>7} {ranges_s:>9.0f} {not_modified_s:>7.0f} {cpu_per_gb:>9}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
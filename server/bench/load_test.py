@@ -0,0 +1,157 @@
+# encoding: utf-8
+"""Load test of /api/query: concurrent streams per worker and time to first
+token, sync (gunicorn) against async (uvicorn asgi:app).
+
+Each mode runs one worker in a temporary directory, with OPENAI_PROXY
+pointing at the mock api (bench/mock_openai.py, in its own process). For
+each concurrency level, that many clients ask an open question at once, each
+with its own session, and read the whole stream. Time to first token is
+measured up to the first byte after the ###endjson### marker.
+
+Levels go up until the p99 time to first token exceeds --slo; the last level
+within it is the number of streams one worker holds.
+
+Run from server/ (needs gunicorn, uvicorn and aiohttp):
+    python -m bench.load_test [--modes sync,gthread,async] [--levels 1,10,50,100,200,400]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+
+from streaming import END_JSON_MARKER
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    # the Procfile: one request per worker
+    "sync": ["gunicorn", "--workers", "1", "--timeout", "600", "app:app"],
+    "gthread": ["gunicorn", "--workers", "1", "--threads", "32", "--timeout", "600",
+                "app:app"],
+    "async": ["uvicorn", "asgi:app", "--no-access-log"],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"nothing listens on port {port}")
+
+
+def start_server(mode, port, env, cwd):
+    command = list(MODES[mode])
+    if command[0] == "gunicorn":
+        command += ["--bind", f"127.0.0.1:{port}"]
+    else:
+        command += ["--port", str(port)]
+    return subprocess.Popen([sys.executable, "-m", *command], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def one_stream(session, url, i, level):
+    params = {"query": "What is a morpheme?", "index": "bench", "openAiKey": "bench",
+              "userMajor": "Linguistics", "sessionId": f"s{level}-{i}"}
+    marker = END_JSON_MARKER.encode("utf-8")
+    start = time.perf_counter()
+    first = None
+    received = b""
+    async with session.get(url, params=params) as response:
+        async for data in response.content.iter_any():
+            received += data
+            if first is None and marker in received \
+                    and len(received) > received.index(marker) + len(marker):
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+async def run_level(url, level, timeout):
+    connector = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one_stream(session, url, i, level)
+                                         for i in range(level)), return_exceptions=True)
+        wall = time.perf_counter() - start
+    ok = [r for r in results if not isinstance(r, BaseException) and r[0] is not None]
+    return ok, len(results) - len(ok), wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", default="sync,gthread,async")
+    parser.add_argument("--levels", default="1,10,50,100,200,400")
+    parser.add_argument("--tokens", type=int, default=100)
+    # about the pace of gpt-4
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--slo", type=float, default=1.0,
+                        help="max p99 time to first token, seconds")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    mock_port = free_port()
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "bench.mock_openai", "--port", str(mock_port),
+         "--tokens", str(args.tokens), "--token-delay", str(args.token_delay),
+         "--first-token-delay", str(args.first_token_delay)],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL)
+    env = dict(os.environ, OPENAI_PROXY=f"http://127.0.0.1:{mock_port}",
+               PYTHONPATH=os.pathsep.join([SERVER_DIR, os.environ.get("PYTHONPATH", "")]),
+               GUNICORN_PRELOAD="0", SESSION_CACHE_SIZE="1000")
+    stream_time = args.first_token_delay + args.token_delay * (args.tokens - 1)
+    print(f"mock answer: {args.tokens} deltas, first after {args.first_token_delay * 1000:.0f} ms,"
+          f" {stream_time:.2f} s per stream, slo p99 ttft {args.slo} s")
+    print(f"{'mode':8} {'streams':>7} {'ok':>5} {'failed':>6} {'ttft p50':>9} {'ttft p99':>9}"
+          f" {'stream p99':>10} {'wall':>7}")
+    try:
+        wait_for(mock_port)
+        for mode in args.modes.split(","):
+            port = free_port()
+            with tempfile.TemporaryDirectory() as cwd:
+                server = start_server(mode, port, env, cwd)
+                try:
+                    wait_for(port)
+                    url = f"http://127.0.0.1:{port}/api/query"
+                    asyncio.run(run_level(url, 1, args.timeout))  # warm up
+                    held = 0
+                    for level in map(int, args.levels.split(",")):
+                        ok, failed, wall = asyncio.run(run_level(url, level, args.timeout))
+                        ttft = np.array([r[0] for r in ok]) if ok else np.array([np.inf])
+                        total = np.array([r[1] for r in ok]) if ok else np.array([np.inf])
+                        p99 = np.percentile(ttft, 99)
+                        print(f"{mode:8} {level:7d} {len(ok):5d} {failed:6d}"
+                              f" {np.percentile(ttft, 50):8.3f}s {p99:8.3f}s"
+                              f" {np.percentile(total, 99):9.3f}s {wall:6.2f}s", flush=True)
+                        if failed or p99 > args.slo:
+                            break
+                        held = level
+                    print(f"{mode:8} holds {held} streams within the slo")
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# encoding: utf-8
+"""A local stand-in for the OpenAI api, for the benchmarks and tests.
+
+Serves POST /chat/completions (streamed as server-sent events or not) and
+POST /embeddings on 127.0.0.1, with keep-alive connections. Answers are
+deterministic:
+
+- a chat answer is `tokens` deltas of "tok " (or the text of `answer`), the
+  first one after `first_token_delay` seconds and the next ones every
+  `token_delay` seconds. Non-streamed answers echo the key they were sent
+  with ("key:<key>"), so callers can check that keys don't get mixed up.
+- an embedding is a unit vector of `dim` floats derived from the text's hash.
+
+`fail` is a list of status codes answered, in order, before the normal ones
+(e.g. [503] for one retried error).
+
+Usage:
+    with MockOpenAI(tokens=200, token_delay=0.005) as mock:
+        llm_client.chat(messages, api_key="k", api_base=mock.url, ...)
+
+or standalone, for the load tests against a running server:
+    python -m bench.mock_openai --port 9000 --tokens 200 --token-delay 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections of a burst of streams
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.mock._connected()
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        mock = self.server.mock
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        api_key = self.headers.get("Authorization", "").replace("Bearer ", "")
+        mock._called(self.path, api_key)
+        status = mock._next_failure()
+        if status is not None:
+            self._send_json(status, {"error": {"message": f"mock error {status}"}})
+            return
+        if self.path.endswith("/embeddings"):
+            self._send_json(200, {
+                "data": [{"index": i, "embedding": mock.embed(text)}
+                         for i, text in enumerate(payload["input"])],
+                "usage": {"total_tokens": sum(len(text.split()) for text in payload["input"])},
+            })
+        elif self.path.endswith("/chat/completions"):
+            time.sleep(mock.first_token_delay)
+            deltas = mock.deltas()
+            if not payload.get("stream"):
+                time.sleep(mock.token_delay * max(len(deltas) - 1, 0))
+                self._send_json(200, {"choices": [{"message": {
+                    "role": "assistant", "content": f"key:{api_key}"}}]})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, delta in enumerate(deltas):
+                if i:
+                    time.sleep(mock.token_delay)
+                event = {"choices": [{"index": 0, "delta": {"content": delta}}]}
+                self._chunk(b"data: " + json.dumps(event).encode("utf-8") + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+
+class MockOpenAI:
+    """
+    Args:
+        tokens: deltas of a streamed chat answer
+        token_delay: seconds between two deltas
+        first_token_delay: seconds before the first delta
+        answer: text of the chat answer, split into words, instead of tokens
+        dim: size of the embeddings
+        fail: status codes answered before the normal answers
+        port: 0 for any free port
+    """
+    def __init__(self, tokens=50, token_delay=0.0, first_token_delay=0.0, answer=None,
+                 dim=1536, fail=(), port=0):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.answer = answer
+        self.dim = dim
+        self._fail = list(fail)
+        self._lock = threading.Lock()
+        self.calls = []
+        self.connections = 0
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def deltas(self):
+        if self.answer is not None:
+            return [word + " " for word in self.answer.split()]
+        return ["tok "] * self.tokens
+
+    def embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _called(self, path, api_key):
+        with self._lock:
+            self.calls.append((path, api_key))
+
+    def _next_failure(self):
+        with self._lock:
+            return self._fail.pop(0) if self._fail else None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    mock = MockOpenAI(tokens=args.tokens, token_delay=args.token_delay,
+                      first_token_delay=args.first_token_delay, port=args.port)
+    print(f"mock openai api on {mock.url}")
+    mock._server.serve_forever()
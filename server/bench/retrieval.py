@@ -0,0 +1,93 @@
+# encoding: utf-8
+"""Latency and recall of the top-k chunk retrieval (retrieval.py).
+
+A memory-mapped index of `--chunks` random unit vectors is written with
+VectorIndexWriter, in float32 and float16, and `--queries` queries (chunks
+with some noise added) are run against it:
+
+- "argsort": brute force, every score sorted, the reference for the recall
+- "top_k": retrieval.top_k, one matvec and argpartition of the k best
+- "select": best_of alone, on scores already computed
+
+The scan reads the whole matrix (chunks x dim x 4 bytes in float32), so
+for large indexes the latency is bound by memory bandwidth, not by the
+selection.
+
+Run from server/:
+    python -m bench.retrieval [--chunks 5000,100000] [--dim 1536] [-k 10]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from retrieval import best_of, scores_of, top_k
+from vector_store import VectorIndex, VectorIndexWriter
+
+
+def write_index(prefix, chunks, dim, dtype, seed=0, block=4096):
+    rng = np.random.default_rng(seed)
+    with VectorIndexWriter(prefix, dim=dim, dtype=dtype) as writer:
+        for start in range(0, chunks, block):
+            vectors = rng.standard_normal((min(block, chunks - start), dim)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            for vector in vectors:
+                writer.add("", vector)
+    return VectorIndex(prefix)
+
+
+def make_queries(index, count, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), count, replace=False)
+    queries = np.asarray(index.vectors[np.sort(rows)], dtype=np.float32)
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def timed(fn, queries):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(fn(query))
+        latencies.append(time.perf_counter() - start)
+    return results, np.median(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", default="5000,100000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--dtypes", default="float32,float16")
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    k = args.k
+
+    print(f"{'chunks':>7} {'dtype':>8} {'argsort':>9} {'top_k':>9} {'select':>9} {'recall@' + str(k):>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for chunks in [int(c) for c in args.chunks.split(",")]:
+            for dtype in args.dtypes.split(","):
+                index = write_index(os.path.join(tmp, f"{dtype}{chunks}"), chunks, args.dim, dtype)
+                queries = make_queries(index, args.queries)
+                # a first scan maps the pages in
+                scores_of(index.vectors, queries[0])
+
+                def brute_force(query):
+                    return np.argsort(-scores_of(index.vectors, query))[:k]
+
+                exact, argsort_ms = timed(brute_force, queries)
+                found, top_k_ms = timed(lambda q: top_k(index.vectors, q, k)[0], queries)
+                scores = [scores_of(index.vectors, query) for query in queries]
+                _, select_ms = timed(lambda s: best_of(s, k), scores)
+                recall = np.mean([len(set(f.tolist()) & set(e.tolist())) / k
+                                  for f, e in zip(found, exact)])
+                print(f"{chunks:>7} {dtype:>8} {argsort_ms:>7.2f}ms {top_k_ms:>7.2f}ms"
+                      f" {select_ms:>7.3f}ms {recall:>10.3f}")
+                del index, scores
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# encoding: utf-8
+"""Resident memory over many distinct sessions and documents.
+
+Plays one short chat (a question and a ~300 word answer, written to its own
+history database) in each of --sessions distinct (session, document) pairs
+and prints the RSS every --every sessions:
+
+- "dict": every DialogManager kept forever, like the id2chatbot dict of
+  app.py before SessionCache (their sqlite connections are released, the
+  old code had none open)
+- "SessionCache": app.py's bounded cache, --max-entries live sessions
+
+Run from server/ (Linux, reads /proc/self/statm):
+    python -m bench.soak_sessions [--sessions 10000] [--max-entries 100]
+"""
+
+import argparse
+import gc
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from gpt4_wrapper import DialogManager
+from session_cache import SessionCache
+
+ANSWER = " ".join(["A morpheme is the smallest meaningful unit of a language."] * 30)
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def play(get_chatbot, sessions, every, after_turn=None):
+    start = time.perf_counter()
+    samples = []
+    for i in range(sessions):
+        chatbot = get_chatbot((f"session{i}", f"doc{i}"))
+        chatbot.history.add_user_message("explain the meaning of morpheme")
+        chatbot.history.get_message_for_api()
+        chatbot.collect_response(ANSWER)
+        if after_turn is not None:
+            after_turn(chatbot)
+        if (i + 1) % every == 0:
+            gc.collect()
+            samples.append((i + 1, rss_mb()))
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--max-entries", type=int, default=100)
+    parser.add_argument("--every", type=int, default=2000)
+    parser.add_argument("--mode", choices=["dict", "cache"], default=None,
+                        help="one mode only, by default both in their own process"
+                             " (RSS never shrinks within a process)")
+    args = parser.parse_args()
+    if args.mode is None:
+        for mode in ("dict", "cache"):
+            subprocess.run([sys.executable, "-m", "bench.soak_sessions", *sys.argv[1:],
+                            "--mode", mode], check=True)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        def create_chatbot(key):
+            session_id, name = key
+            return DialogManager(file_path=f"{directory}/{session_id}/{name}.db",
+                                 major="Linguistics", index_name=name)
+
+        if args.mode == "dict":
+            chatbots = {}
+
+            def from_dict(key):
+                if key not in chatbots:
+                    chatbots[key] = create_chatbot(key)
+                return chatbots[key]
+
+            samples, elapsed = play(from_dict, args.sessions, args.every,
+                                    after_turn=lambda chatbot: chatbot.close())
+            print(f"dict          ({elapsed:5.1f} s): "
+                  + "  ".join(f"{n}: {mb:.0f} MB" for n, mb in samples))
+        if args.mode == "cache":
+            cache = SessionCache(create_chatbot, max_entries=args.max_entries,
+                                 on_evict=lambda chatbot: chatbot.close())
+            samples, elapsed = play(cache.get, args.sessions, args.every)
+            print(f"SessionCache  ({elapsed:5.1f} s): "
+                  + "  ".join(f"{n}: {mb:.0f} MB" for n, mb in samples))
+            print(f"  {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
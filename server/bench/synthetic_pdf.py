@@ -0,0 +1,81 @@
+# encoding: utf-8
+"""Synthetic lecture-reader PDFs for the extraction benchmarks.
+
+Writes a plain PDF by hand (no extra dependency): every page is a column of
+`lines` sentences of random words in Helvetica, so pdfminer does the same
+layout analysis as on a text-only course reader. The words depend on the
+seed and the page number only, so a file can be regenerated identically.
+
+Lines are sentences on purpose: llama_index's splitter joins the words of
+unpunctuated text over the chunk size without spaces.
+
+Run from server/:
+    python -m bench.synthetic_pdf out.pdf --pages 300
+"""
+
+import argparse
+import random
+
+WORDS = ("the grammar parses each sentence into a tree of constituents while "
+         "the tagger assigns every token its part of speech and the model "
+         "estimates the probability of a sequence from counts of ngrams").split()
+
+
+def page_lines(page_no, lines=40, words=12, seed=0):
+    rng = random.Random(seed * 1000003 + page_no)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+            for _ in range(lines)]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages, lines=40, words=12, seed=0):
+    """Write a PDF of `pages` pages to path."""
+    # 1: catalog, 2: page tree, 3: font, then a page and its content per page
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    for page_no in range(pages):
+        page_id, content_id = 4 + 2 * page_no, 5 + 2 * page_no
+        kids.append(f"{page_id} 0 R")
+        text = ["BT /F1 10 Tf 12 TL 50 780 Td"]
+        text += [f"({_escape(line)}) Tj T*" for line in page_lines(page_no, lines, words, seed)]
+        text.append("ET")
+        stream = "\n".join(text).encode("latin-1")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792]"
+            f" /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for obj_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_pdf(args.path, args.pages, lines=args.lines, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
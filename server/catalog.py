@@ -0,0 +1,195 @@
+# encoding: utf-8
+"""Catalog of the uploaded documents, for /api/file-list and /api/index-list.
+
+One sqlite row per file of static/file: size, page count, ingestion status,
+content hash and whether its index is built. /api/upload, /api/delete and
+the ingest jobs update it, so listing is one indexed query instead of a
+directory scan. Rows are sorted by lowercased name; pages are fetched by
+keyset (the last fullName of the previous page), so a page costs the same
+wherever it is in the list.
+
+Every change bumps a version number that is the ETag of the lists, a client
+polling an unchanged catalog gets a 304 without any query.
+
+Files copied into static/file by hand are picked up by `sync`, which the app
+runs at startup.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+staticPath = "static"
+
+CREATE_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        full_name TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        ext TEXT NOT NULL,
+        sort_key TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        pages INTEGER,
+        status TEXT,
+        indexed INTEGER NOT NULL DEFAULT 0,
+        file_hash TEXT,
+        updated_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS documents_order ON documents (sort_key, full_name)",
+    "CREATE INDEX IF NOT EXISTS documents_indexed ON documents (indexed, sort_key, full_name)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)",
+)
+FIELDS = ("full_name", "name", "ext", "size", "pages", "status", "indexed", "file_hash")
+# columns that can be changed by `update`
+UPDATABLE = ("size", "pages", "status", "indexed", "file_hash")
+
+# greater than any character of a name, for prefix ranges
+MAX_CHAR = "\U0010ffff"
+
+
+def sort_key(full_name):
+    return os.path.splitext(full_name)[0].lower()
+
+
+class Catalog:
+    """
+    Args:
+        path: sqlite file of the catalog
+    """
+    def __init__(self, path=f"{staticPath}/catalog.db"):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for sql in CREATE_SQL:
+                self._conn.execute(sql)
+
+    def _bump(self):
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def version(self):
+        """Changes with every change of the catalog, by any process."""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def etag(self):
+        return f"catalog-{self.version()}"
+
+    def put(self, full_name, size, file_hash=None, status=None):
+        """Add or replace a file, e.g. after an upload. Whether its index
+        exists is kept, and its page count if the content is the same. An
+        upload doesn't know the hash yet: the page count is kept until the
+        ingest job sets file_hash and pages."""
+        name, ext = os.path.splitext(full_name)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO documents (full_name, name, ext, sort_key, size, file_hash, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (full_name) DO UPDATE SET size = excluded.size,"
+                " pages = CASE WHEN excluded.file_hash IS NULL OR file_hash = excluded.file_hash"
+                " THEN pages END,"
+                " file_hash = excluded.file_hash, status = excluded.status,"
+                " updated_at = excluded.updated_at",
+                (full_name, name, ext, sort_key(full_name), size, file_hash, status, time.time()))
+            self._bump()
+
+    def update(self, full_name, **fields):
+        """Change some of the UPDATABLE columns of a file."""
+        for field in fields:
+            if field not in UPDATABLE:
+                raise ValueError(f"unknown catalog field {field}")
+        columns = ", ".join(f"{field} = ?" for field in fields)
+        with self._lock, self._conn:
+            changed = self._conn.execute(
+                f"UPDATE documents SET {columns}, updated_at = ? WHERE full_name = ?",
+                (*fields.values(), time.time(), full_name)).rowcount
+            if changed:
+                self._bump()
+        return bool(changed)
+
+    def remove(self, full_name):
+        with self._lock, self._conn:
+            if self._conn.execute("DELETE FROM documents WHERE full_name = ?",
+                                  (full_name,)).rowcount:
+                self._bump()
+
+    def get(self, full_name):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM documents WHERE full_name = ?",
+                (full_name,)).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    def _page(self, columns, where, args, prefix, after, limit):
+        prefix = prefix.lower()
+        # the range of sort_key is what the index is searched by, the names
+        # of the page before share at most its lower bound
+        start = max(prefix, sort_key(after)) if after else prefix
+        sql = f"SELECT {columns} FROM documents WHERE {where} sort_key >= ? AND sort_key < ?"
+        args = [*args, start, prefix + MAX_CHAR]
+        if after:
+            sql += " AND (sort_key > ? OR full_name > ?)"
+            args += [sort_key(after), after]
+        sql += " ORDER BY sort_key, full_name"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def list(self, prefix="", after=None, limit=None):
+        """Files whose name starts with prefix (case-insensitive), sorted by
+        name, the ones after the fullName `after`, at most limit."""
+        rows = self._page(", ".join(FIELDS), "", [], prefix, after, limit)
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+    def list_indexed(self, prefix="", after=None, limit=None):
+        """Index names of the files whose index is built, like `list`."""
+        rows = self._page("name", "indexed = 1 AND", [], prefix, after, limit)
+        return [row[0] for row in rows]
+
+    def sync(self, file_dir=f"{staticPath}/file", index_dir=f"{staticPath}/index"):
+        """Add the files that aren't in the catalog yet, drop the rows of
+        files that are gone and fix the indexed flags. Returns the number of
+        changed rows."""
+        files = {}
+        with os.scandir(file_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name] = entry.stat().st_size
+        indexes = set()
+        if os.path.isdir(index_dir):
+            indexes = {os.path.splitext(file)[0] for file in os.listdir(index_dir)
+                       if file.endswith(".json")}
+        now = time.time()
+        with self._lock, self._conn:
+            known = dict(self._conn.execute("SELECT full_name, indexed FROM documents"))
+            added, flags = [], []
+            for full_name, size in files.items():
+                name, ext = os.path.splitext(full_name)
+                indexed = int(name in indexes)
+                if full_name not in known:
+                    added.append((full_name, name, ext, sort_key(full_name), size, indexed, now))
+                elif known[full_name] != indexed:
+                    flags.append((indexed, full_name))
+            removed = [(full_name,) for full_name in known if full_name not in files]
+            self._conn.executemany(
+                "INSERT INTO documents (full_name, name, ext, sort_key, size, indexed, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", added)
+            self._conn.executemany("DELETE FROM documents WHERE full_name = ?", removed)
+            self._conn.executemany("UPDATE documents SET indexed = ? WHERE full_name = ?", flags)
+            changed = len(added) + len(removed) + len(flags)
+            if changed:
+                self._bump()
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
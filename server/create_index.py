@@ -1,19 +1,70 @@
 import os
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 import markdown
 from custom_loader import CustomReader
-from llama_index import GPTSimpleVectorIndex, MockEmbedding, ServiceContext
+from embedding import EmbeddingStage
+from lexical_index import LexicalIndexWriter, lexical_path
+from manifest import Manifest, hash_file
 from pdf_loader import CJKPDFReader
+from vector_store import VectorIndexWriter, index_prefix
 
 staticPath = "static"
 
 
-def create_index(filepath, filename) -> int:
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """Lists of up to size items. Pulling the next batch is what drives the
+    producer, so a slow consumer holds back the extraction."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_index(filepath, filename, progress=None, batch_size=64, manifest=None,
+                 dry_run=False, api_key=None) -> int:
+    """Build and save the index of a file (see vector_store), returns the
+    embedding token usage.
+    progress, if given, is called with keyword counts (pages, chunks, ...) as
+    the work goes on, and first with the file_hash of the file. Chunks are indexed batch_size at a time. With dry_run,
+    the file is only chunked and the tokens that would be sent to the
+    embedding api are returned, as a cost estimate.
+
+    Work is looked up by content hash in the manifest: an unchanged file is
+    skipped, unchanged pages are not extracted and unchanged chunks are not
+    embedded again. The skipped work is reported as pages_reused and
+    chunks_reused. api_key is the embedding key, None for the server's (if
+    LLM_ALLOW_SERVER_KEY=1)."""
     name, ext = os.path.splitext(filename)
+    report = progress or (lambda **counts: None)
+    manifest = manifest or Manifest()
+    index_path = f"{index_prefix(name)}.json"
+
+    file_hash = hash_file(filepath)
+    if not dry_run:
+        report(file_hash=file_hash)
+    if manifest.file_hash(name) == file_hash and os.path.exists(index_path):
+        if not dry_run:
+            report(skipped=1)
+        return 0
 
+    loader = None
     if ext == ".pdf":
-        loader = CJKPDFReader()
-        documents = loader.load_data(filepath=filepath, filename=filename)
+        loader = CJKPDFReader(
+            # INGEST_WORKERS jobs run at once, each with its own extraction pool
+            workers=int(os.environ.get("PDF_WORKERS", "1")),
+            page_cache=manifest,
+            merge_pages=os.environ.get("PDF_MERGE_PAGES", "") == "1",
+        )
+        # chunks are produced page by page and indexed in batches, so the
+        # whole document is never held in memory
+        documents = loader.lazy_load_data(
+            filepath=filepath,
+            on_page=lambda page_no, chunks: report(pages=page_no, chunks=chunks),
+        )
     elif ext == ".md":
         with open(filepath, "r", encoding="utf-8") as f:
             file_text = f.read()
@@ -22,22 +73,45 @@ def create_index(filepath, filename) -> int:
         )
         # TODO: 利用 langchain splitter重写 https://python.langchain.com/en/latest/modules/indexes/text_splitters/examples/markdown.html
         # 直接将markdown分段再分别转化成html，最后将所有html拼接起来并加上chunk_id
-        loader = CustomReader()
-        documents = loader.load_data(html=html, filename=name)
+        documents = CustomReader().load_data(html=html, filename=name)
+        report(chunks=len(documents))
     elif ext == ".html":
         # TODO:
-        pass
+        documents = []
 
-    # predictor cost
-    embed_model = MockEmbedding(embed_dim=1536)
-    service_context = ServiceContext.from_defaults(embed_model=embed_model)
-    index = GPTSimpleVectorIndex.from_documents(
-        documents, service_context=service_context
+    stage = EmbeddingStage(
+        cache=manifest, batch_size=int(os.environ.get("EMBED_BATCH_SIZE", "64")),
+        api_key=api_key,
     )
 
-    index = GPTSimpleVectorIndex.from_documents(documents)
+    writer = lexical = None
+    if not dry_run:
+        writer = VectorIndexWriter(
+            index_prefix(name), dtype=os.environ.get("INDEX_DTYPE", "float32")
+        )
+        lexical = LexicalIndexWriter(lexical_path(name))
+    try:
+        for batch in batched(documents, batch_size):
+            stage.embed_documents(batch, dry_run=dry_run)
+            if writer is not None:
+                writer.add_documents(batch)
+                lexical.add_documents(batch)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+            lexical.abort()
+        raise
+    if dry_run:
+        return stage.tokens
 
-    # save to disk
-    index.save_to_disk(f"{staticPath}/index/{name}.json")
+    # the vector index metadata goes last, it marks the index as complete
+    lexical.close()
+    writer.close()
+    manifest.set_file_hash(name, file_hash)
+    report(
+        tokens=stage.tokens,
+        pages_reused=loader.pages_reused if loader is not None else 0,
+        chunks_reused=stage.reused,
+    )
 
-    return embed_model.last_token_usage
+    return stage.tokens
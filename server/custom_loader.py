@@ -1,40 +1,41 @@
-from typing import Any, List
+from typing import Any, List, Optional
 
-import tiktoken
 from bs4 import BeautifulSoup
 from llama_index.readers.base import BaseReader
 from llama_index.readers.schema.base import Document
+from tokenizer import get_encoding
 
 staticPath = "static"
 
+# encoding the chunk sizes are measured in
+CHUNK_ENCODING = "p50k_base"
 
-def encode_string(string: str, encoding_name: str = "p50k_base"):
-    encoding = tiktoken.get_encoding(encoding_name)
-    return encoding.encode(string)
 
+def encode_string(string: str, encoding_name: str = CHUNK_ENCODING):
+    return get_encoding(encoding_name).encode(string)
 
-def decode_string(token: str, encoding_name: str = "p50k_base"):
-    encoding = tiktoken.get_encoding(encoding_name)
-    return encoding.decode(token)
 
+def decode_string(token: str, encoding_name: str = CHUNK_ENCODING):
+    return get_encoding(encoding_name).decode(token)
 
-def num_tokens_from_string(string: str, encoding_name: str = "p50k_base") -> int:
+
+def num_tokens_from_string(string: str, encoding_name: str = CHUNK_ENCODING) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return len(encode_string(string, encoding_name))
 
 
 def split_text_to_doc(
-    text: str, current_chunk_id, chunk_size: int = 400
+    text: str, current_chunk_id, chunk_size: int = 400, tokens: Optional[List[int]] = None
 ) -> List[Document]:
-    """Split text into chunks of a given size."""
+    """Split text into chunks of a given size. tokens, if given, is the
+    already encoded text."""
     chunks = []
-    token_len = num_tokens_from_string(text)
+    # encode once and slice by token offset
+    if tokens is None:
+        tokens = encode_string(text)
 
-    for i in range(0, token_len, chunk_size):
-        encode_text = encode_string(text)
-        decode_text = decode_string(encode_text[i : i + chunk_size]).strip()
+    for i in range(0, len(tokens), chunk_size):
+        decode_text = decode_string(tokens[i : i + chunk_size]).strip()
         chunks.append(
             Document(
                 decode_text,
@@ -66,19 +67,30 @@ class CustomReader(BaseReader):
         if len(heading_doms) == 0:
             heading_doms = [soup.find()]
 
+        # 遍历所有兄弟节点，不递归遍历子节点
+        sections = []
         for tag in heading_doms:
+            siblings = []
+            next_tag = tag.find_next_sibling()
+            while next_tag and next_tag.name not in headings:
+                siblings.append(next_tag)
+                next_tag = next_tag.find_next_sibling()
+            sections.append((tag, siblings))
+
+        # tokenize all the blocks in one batch, each block only once
+        texts = [next_tag.text.strip() for _, siblings in sections for next_tag in siblings]
+        all_tokens = iter(get_encoding(CHUNK_ENCODING).encode_batch(texts))
+        texts = iter(texts)
+
+        for tag, siblings in sections:
             tag["data-chunk_id"] = f"chunk-{current_chunk_id}"
             current_chunk_text = tag.text.strip()
 
-            # 遍历所有兄弟节点，不递归遍历子节点
-            next_tag = tag.find_next_sibling()
-            while next_tag and next_tag.name not in headings:
-                stripped_text = next_tag.text.strip()
+            for next_tag in siblings:
+                stripped_text = next(texts)
+                tokens = next(all_tokens)
 
-                if (
-                    current_chunk_length + num_tokens_from_string(stripped_text)
-                    > chunk_size
-                ):
+                if current_chunk_length + len(tokens) > chunk_size:
                     document_list.append(
                         Document(
                             current_chunk_text.strip(),
@@ -89,14 +101,15 @@ class CustomReader(BaseReader):
                     current_chunk_length = 0
                     current_chunk_id += 1
 
-                    document_list += split_text_to_doc(stripped_text, current_chunk_id)
+                    document_list += split_text_to_doc(
+                        stripped_text, current_chunk_id, tokens=tokens
+                    )
 
                 else:
                     current_chunk_text = f"{current_chunk_text} {stripped_text}"
-                    current_chunk_length += num_tokens_from_string(stripped_text) + 1
+                    current_chunk_length += len(tokens) + 1
 
                 next_tag["data-chunk_id"] = f"chunk-{current_chunk_id}"
-                next_tag = next_tag.find_next_sibling()
 
             document_list.append(
                 Document(
@@ -0,0 +1,213 @@
+# encoding: utf-8
+"""Local cache of Wiktionary definitions used by ::explain:: queries.
+
+Definitions are kept in memory (LRU) and on disk in sqlite, so common terms
+are only fetched from Wiktionary once per TTL. Terms without an entry are
+cached as well (negative caching, shorter TTL). Terms are cached by a
+lowercased, lemma-normalized key, so "Weights" and "weight" share one entry;
+Wiktionary itself is asked for the term as selected first.
+
+The cache can be warmed offline from a wiktextract JSONL dump:
+    python definition_cache.py --dump en-wiktionary.jsonl --terms terms.txt
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+staticPath = "static"
+
+DAY = 24 * 3600
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS definitions (
+        term TEXT PRIMARY KEY,
+        entries TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    )
+"""
+SELECT_SQL = "SELECT entries, fetched_at FROM definitions WHERE term = ?"
+UPSERT_SQL = "INSERT OR REPLACE INTO definitions (term, entries, fetched_at) VALUES (?, ?, ?)"
+
+# words whose trailing s is not a plural
+_KEEP_S = ("ss", "us", "is", "ics", "ness", "sis", "ews")
+
+
+def lemmatize(word):
+    """Very small rule based plural -> singular, good enough for cache keys."""
+    if len(word) <= 3 or word.endswith(_KEEP_S):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def strip_term(term):
+    """Collapse whitespace and strip punctuation around a selected term."""
+    term = re.sub(r"\s+", " ", term.strip())
+    return term.strip(" .,;:!?\"'()[]{}")
+
+
+def normalize(term):
+    """The cache key of a term: lowercase, collapse whitespace, strip
+    punctuation around the term and lemmatize its last word
+    ("The Eigenvalues." -> "the eigenvalue")."""
+    term = strip_term(term.lower())
+    if not term:
+        return term
+    words = term.split(" ")
+    words[-1] = lemmatize(words[-1])
+    return " ".join(words)
+
+
+class DefinitionCache:
+    """
+    Args:
+        fetch: the upstream lookup, e.g. WiktionaryParser().fetch
+        path: sqlite file of the on-disk cache
+        ttl: seconds a found definition stays valid
+        negative_ttl: seconds a term without entry stays cached
+        memory_entries: max number of terms kept in memory
+    """
+    def __init__(self,
+                 fetch=None,
+                 path=f"{staticPath}/cache/definitions.db",
+                 ttl=30 * DAY,
+                 negative_ttl=DAY,
+                 memory_entries=4096):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_entries = memory_entries
+        # key -> (entries, fetched_at)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(CREATE_SQL)
+        self._conn.commit()
+
+    def _fresh(self, entries, fetched_at, now):
+        ttl = self.ttl if entries else self.negative_ttl
+        return now - fetched_at <= ttl
+
+    def _remember(self, key, entries, fetched_at):
+        self._memory[key] = (entries, fetched_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, term):
+        """Return the cached entries of a term, or None on a miss. An empty
+        list means the term is known to have no entry."""
+        key = normalize(term)
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is None:
+                row = self._conn.execute(SELECT_SQL, (key,)).fetchone()
+                if row is not None:
+                    hit = (json.loads(row[0]), row[1])
+                    self._remember(key, *hit)
+            else:
+                self._memory.move_to_end(key)
+        if hit is not None and self._fresh(hit[0], hit[1], now):
+            return hit[0]
+        return None
+
+    def put(self, term, entries, fetched_at=None):
+        self.put_many([(term, entries)], fetched_at)
+
+    def put_many(self, items, fetched_at=None):
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        rows = []
+        with self._lock:
+            for term, entries in items:
+                key = normalize(term)
+                self._remember(key, entries, fetched_at)
+                rows.append((key, json.dumps(entries), fetched_at))
+            self._conn.executemany(UPSERT_SQL, rows)
+            self._conn.commit()
+
+    def get(self, term):
+        """Cached definitions of a term, fetched on a miss. Wiktionary titles
+        are case-sensitive ("BERT", "Markov"), so the term is fetched as it
+        was selected first and by its normalized key only if that fails."""
+        entries = self.lookup(term)
+        if entries is not None:
+            return entries
+        key = normalize(term)
+        surface = strip_term(term)
+        entries = self._fetch(surface)
+        if not entries and key != surface:
+            entries = self._fetch(key)
+        self.put(term, entries)
+        return entries
+
+    def _fetch(self, term):
+        """Entries of a term, [] if none of them has a definition (the
+        parser also answers missing pages with empty entries)."""
+        if not term:
+            return []
+        entries = self.fetch(term)
+        if not any(entry.get("definitions") for entry in entries or []):
+            return []
+        return entries
+
+    def warm_up(self, dump_path, terms=None):
+        """Preload definitions from a wiktextract JSONL dump (one word sense
+        group per line, with "word", "pos" and "senses"). Only the given
+        terms are loaded if a list is passed, terms missing from the dump are
+        cached as negatives. Returns the number of terms stored."""
+        wanted = None if terms is None else {normalize(t) for t in terms}
+        found = {}
+        with open(dump_path, "r", encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                key = normalize(item.get("word", ""))
+                if not key or (wanted is not None and key not in wanted):
+                    continue
+                # skip "plural of ..." style senses, the lemma has its own line
+                glosses = [g for sense in item.get("senses", [])
+                           if "form_of" not in sense
+                           for g in sense.get("glosses", [])]
+                if not glosses:
+                    continue
+                # same shape as WiktionaryParser.fetch
+                entry = found.setdefault(key, [{"definitions": []}])[0]
+                entry["definitions"].append({
+                    "partOfSpeech": item.get("pos", ""),
+                    "text": [item["word"]] + glosses,
+                })
+        if wanted is not None:
+            for key in wanted - found.keys():
+                found[key] = []
+        self.put_many(found.items())
+        return len(found)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm up the definition cache")
+    parser.add_argument("--dump", required=True, help="wiktextract JSONL dump")
+    parser.add_argument("--terms", help="file with one term per line, default: all")
+    parser.add_argument("--db", default=f"{staticPath}/cache/definitions.db")
+    args = parser.parse_args()
+
+    terms = None
+    if args.terms:
+        with open(args.terms, "r", encoding="utf-8") as f:
+            terms = [line.strip() for line in f if line.strip()]
+    cache = DefinitionCache(path=args.db)
+    print(f"cached {cache.warm_up(args.dump, terms)} terms")
@@ -0,0 +1,84 @@
+"""OpenAI embeddings for the server side caches and indexes."""
+
+from typing import List, Optional
+
+from llm_client import llm_client
+from manifest import hash_text
+from tokenizer import count_tokens
+
+EMBED_MODEL = "text-embedding-ada-002"
+EMBED_DIM = 1536
+# tokenizer of the ada-002 embeddings, for cost estimates
+EMBED_ENCODING = "cl100k_base"
+
+
+def embed_texts(texts: List[str], api_key: Optional[str] = None,
+                model: str = EMBED_MODEL) -> List[List[float]]:
+    """Embed a batch of texts with one api call."""
+    # newlines hurt the quality of ada embeddings, see the openai docs
+    texts = [t.replace("\n", " ") for t in texts]
+    response = llm_client.embed(texts, model=model, api_key=api_key)
+    return [item["embedding"] for item in sorted(response["data"], key=lambda x: x["index"])]
+
+
+async def aembed_texts(texts: List[str], api_key: Optional[str] = None,
+                       model: str = EMBED_MODEL) -> List[List[float]]:
+    """Async version of `embed_texts`."""
+    texts = [t.replace("\n", " ") for t in texts]
+    response = await llm_client.aembed(texts, model=model, api_key=api_key)
+    return [item["embedding"] for item in sorted(response["data"], key=lambda x: x["index"])]
+
+
+class EmbeddingStage:
+    """Embeds the chunks of a document before they are indexed. Identical
+    chunks are embedded once: embeddings are looked up in the cache by
+    (model, chunk text hash) and only the missing ones are sent, in batches.
+
+    Args:
+        embed: maps a list of texts to a list of vectors, defaults to the
+            openai embeddings of `model`
+        api_key: key of the default embed, None for the server's (if
+            LLM_ALLOW_SERVER_KEY=1)
+        cache: store of embeddings by (model, chunk hash), e.g.
+            manifest.Manifest, None disables the cache
+        model: embedding model, part of the cache key
+        batch_size: max texts per embedding request
+    """
+    def __init__(self, embed=None, cache=None, model=EMBED_MODEL, batch_size=64,
+                 api_key=None):
+        self.embed = embed or (lambda texts: embed_texts(texts, api_key=api_key, model=model))
+        self.cache = cache
+        self.model = model
+        self.batch_size = batch_size
+        # tokens sent (or, in a dry run, that would be sent) to the embedder
+        self.tokens = 0
+        self.embedded = 0
+        self.reused = 0
+
+    def embed_documents(self, documents, dry_run=False):
+        """Set the embedding of each document. With dry_run nothing is
+        embedded, only the token count of the missing chunks is added up."""
+        hashes = [hash_text(document.text) for document in documents]
+        known = self.cache.get_embeddings(self.model, hashes) if self.cache is not None else {}
+        missing = {}
+        for chunk_hash, document in zip(hashes, documents):
+            if chunk_hash not in known and chunk_hash not in missing:
+                missing[chunk_hash] = document.text
+        self.reused += len(documents) - len(missing)
+        # same text as embed_texts sends
+        self.tokens += sum(count_tokens(text.replace("\n", " "), EMBED_ENCODING)
+                           for text in missing.values())
+        if dry_run:
+            return
+
+        items = list(missing.items())
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            vectors = self.embed([text for _, text in batch])
+            embedded = [(chunk_hash, vector) for (chunk_hash, _), vector in zip(batch, vectors)]
+            if self.cache is not None:
+                self.cache.put_embeddings(self.model, embedded)
+            known.update(embedded)
+            self.embedded += len(batch)
+        for chunk_hash, document in zip(hashes, documents):
+            document.embedding = known[chunk_hash]
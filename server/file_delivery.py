@@ -0,0 +1,105 @@
+# encoding: utf-8
+"""Delivery of the uploaded documents (static/file).
+
+Requests proxied by nginx carry an X-Accel-Location header, the prefix of
+an internal nginx location that aliases static/file (see nginx.conf). The
+app then only answers the conditional request and an X-Accel-Redirect
+header, nginx sends the file itself with sendfile and handles the byte
+ranges. Requests that don't come through nginx never get the redirect.
+
+Otherwise `send_document` sends the file from here. Whole files go through
+the wsgi.file_wrapper of the server, gunicorn sends them with sendfile, so
+they don't go through Python either (zero-copy). Ranges are read block by
+block: gunicorn's sendfile always starts at offset 0, whatever the file
+position, and other servers' wrappers send the file to its end.
+
+The ETag is the content hash of the file. URLs carrying the hash (?v=...,
+see /api/file-list) never change content and are cached for a year, the
+others are revalidated by the browser every time (304 when unchanged).
+"""
+
+import mimetypes
+import os
+from urllib.parse import quote
+
+from werkzeug.wrappers import Response
+
+BLOCK_SIZE = 64 * 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def _read_range(f, length, block_size=BLOCK_SIZE):
+    try:
+        while length > 0:
+            block = f.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def _if_range_matches(request, etag):
+    """A range request with If-Range only gets the range if the file didn't
+    change. Dates aren't compared, there is no Last-Modified."""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    return if_range.etag == etag
+
+
+def _response(status, etag, cache_control, **kwargs):
+    response = Response(status=status, **kwargs)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+
+def send_document(request, path, etag, cache_control=REVALIDATE, accel_prefix=None):
+    """Answer a GET of the file at path: 304 if the client has this version,
+    206 for a single satisfiable byte range, 416 for an unsatisfiable one,
+    else 200 (several ranges are answered with the whole file).
+
+    Args:
+        request: the werkzeug (flask) request
+        etag: strong ETag of the file, its content hash
+        cache_control: IMMUTABLE or REVALIDATE
+        accel_prefix: internal nginx location to redirect to, None to send
+            the file from here
+    """
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if request.if_none_match.contains(etag):
+        return _response(304, etag, cache_control)
+    if accel_prefix:
+        response = _response(200, etag, cache_control, mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = accel_prefix + quote(os.path.basename(path))
+        return response
+
+    size = os.path.getsize(path)
+    start, stop, status = 0, size, 200
+    if request.range is not None and len(request.range.ranges) == 1 \
+            and _if_range_matches(request, etag):
+        bounds = request.range.range_for_length(size)
+        if bounds is None:
+            response = _response(416, etag, cache_control)
+            response.headers["Content-Range"] = f"bytes */{size}"
+            return response
+        start, stop = bounds
+        status = 206
+
+    f = open(path, "rb")
+    f.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and (start, stop) == (0, size):
+        body = file_wrapper(f, BLOCK_SIZE)
+    else:
+        body = _read_range(f, stop - start)
+    response = _response(status, etag, cache_control, response=body, mimetype=mimetype,
+                         direct_passthrough=True)
+    response.content_length = stop - start
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    return response
@@ -2,14 +2,31 @@
 # Author: Yixuan
 # 
 
-import sqlite3
+import asyncio
 import os
 import time
+from collections import deque
+from functools import partial
 #from prompt_toolkit import prompt
-import openai
 import requests
 import json
-from wiktionaryparser import WiktionaryParser
+from functools import lru_cache
+
+from definition_cache import DefinitionCache
+from embedding import aembed_texts, embed_texts
+from history_store import history_store
+from llm_client import llm_client
+from response_cache import ResponseCache, make_key
+from retrieval import Retriever
+from semantic_cache import SemanticCache
+from streaming import aiter_chunks, aiter_openai_deltas, iter_openai_deltas
+from tokenizer import count_tokens
+
+# every chat message costs a few tokens on top of its content
+# (<|im_start|>role ... <|im_end|>) and the reply is primed with 3 more, see
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
 
 class DialogHistoryManager:
     """
@@ -27,65 +44,46 @@ class DialogHistoryManager:
     def __init__(self, 
                  file_path="", 
                  prefix="",
-                 thresh=7000):
-        self.messages= []
+                 thresh=7000,
+                 store=None):
+        # deques so trimming the oldest message is O(1)
+        self.messages = deque()
+        # token count of each message in self.messages, including the
+        # per-message overhead of the chat format
+        self.message_tokens = deque()
         self.sys_messages = {"role": "system", "content": prefix}
-        self.token_count = 0
+        self.sys_tokens = count_tokens(prefix) + MESSAGE_OVERHEAD
+        # tokens of the whole window sent to the api, system message included
+        self.token_count = self.sys_tokens + REPLY_OVERHEAD
         self.thresh = thresh
         self.file_path = file_path 
- 
-        # if file does not exist, create a sqlite database 
-        if not os.path.exists(self.file_path):
-            self._create_db()
+        # the store creates the database on first use
+        self.store = store or history_store
         self._read_dialog()
     
-    def _create_db(self):
-        """Create a sqlite database 
-        Create a table called "history" with four columns: role, content, int id(autoincrement), timestamp
-        """
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
-    
     def _read_dialog(self):
         """Read dialog history from the sqlite database
-        each row has two columns: role and content
-        each row should be represented as a dictionary
-        load rows into self.messages
+        Each row stores its token count and the running sum of tokens, so the
+        newest messages within the threshold come from one indexed query,
+        already in chronological order.
         """
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute("SELECT role, content FROM history ORDER BY timestamp DESC LIMIT 500")
-        # search in reverse order
-        rows = c.fetchall()
-        for row in rows:
-            self.token_count += len(row[1].split())
-            # print(self.token_count, row[1])
-            if self.token_count > self.thresh:
-                break
-            self.messages.append({"role": row[0], "content": row[1]})
-        self.messages.reverse()
+        rows = self.store.read_messages(self.file_path, budget=self.thresh)
+        for role, content, tokens in rows:
+            self._append(role, content, tokens)
+
+    def _append(self, role, content, tokens):
+        tokens += MESSAGE_OVERHEAD
+        self.messages.append({"role": role, "content": content})
+        self.message_tokens.append(tokens)
+        self.token_count += tokens
 
     def form_user_msg(self, query):
         return {"role": "user", "content": query}
 
     def _add_message(self, role, message):
-        self.token_count += len(message.split())
-        self.messages.append({"role": role, "content": message})
-        conn = sqlite3.connect(self.file_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO history (role, content) VALUES (?, ?)", (role, message))
-        conn.commit()
-        conn.close()
+        tokens = count_tokens(message)
+        self._append(role, message, tokens)
+        self.store.add_message(self.file_path, role, message, tokens)
     
     def add_assistant_message(self, message):
         self._add_message("assistant", message)
@@ -93,17 +91,65 @@ class DialogHistoryManager:
     def add_user_message(self, message):
         self._add_message("user", message)
 
-    def get_message_for_api(self):
-        # TODO: need another final check, in case the token count is still larger than the threshold
-        # first clear the history if the current token count is larger than the threshold
-        while self.token_count > self.thresh:
-            first_message = self.messages.pop(0)
-            self.token_count -= len(first_message["content"].split())
-        messages = [self.sys_messages] + self.messages
+    def close(self):
+        self.store.release(self.file_path)
+
+    def get_message_for_api(self, reserve=0):
+        # token_count is the exact size of the window in the chat format, so
+        # after dropping the oldest messages the request fits the threshold.
+        # The latest message (the current query) is always kept.
+        # reserve: tokens of extra messages that go along with the history
+        while self.token_count + reserve > self.thresh and len(self.messages) > 1:
+            self.messages.popleft()
+            self.token_count -= self.message_tokens.popleft()
+        messages = [self.sys_messages, *self.messages]
         return messages
 
-# TODO: global
-wikiparser = WiktionaryParser()
+CHAT_PARAMS = dict(
+    model="gpt-4",
+    temperature=0.4,
+    max_tokens=1000,
+    frequency_penalty=0.0,
+)
+
+# bump when the prompt templates change, it invalidates the cached answers
+PROMPT_VERSION = 1
+
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024))))
+
+# optional near-duplicate cache for explain/simplify, costs one embedding call
+# per cache miss of the exact response cache
+semantic_cache = None
+if os.environ.get("SEMANTIC_CACHE", "") == "1":
+    semantic_cache = SemanticCache(
+        embed=embed_texts,
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        model=CHAT_PARAMS["model"],
+        prompt_version=PROMPT_VERSION)
+
+# chunks of the current document sent along with open questions
+retriever = Retriever(k=int(os.environ.get("RETRIEVAL_TOP_K", "4")),
+                      min_score=float(os.environ.get("RETRIEVAL_MIN_SCORE", "0")),
+                      hybrid=os.environ.get("RETRIEVAL_HYBRID", "1") == "1")
+
+@lru_cache(maxsize=None)
+def get_wikiparser():
+    """Built on the first definition fetch, wiktionaryparser is slow to
+    import (see preload.py)."""
+    from wiktionaryparser import WiktionaryParser
+    return WiktionaryParser()
+
+
+definition_cache = DefinitionCache(fetch=lambda term: get_wikiparser().fetch(term))
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run func in the default executor. The async path uses it for sqlite,
+    the numpy scans and the wiktionary fetch, which would otherwise hold up
+    every stream on the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
 
 class DialogManager:
     """ 
@@ -114,7 +160,8 @@ class DialogManager:
     def __init__(self, 
                 file_path="", 
                 major="",
-                thresh=7000) -> None:
+                thresh=7000,
+                index_name="") -> None:
         prefix=f"""
             You are a computational linguistics expert and native English speaker. 
             Assist Master's students majored in {major}, 
@@ -126,9 +173,11 @@ class DialogManager:
         self.history = DialogHistoryManager(file_path=file_path, 
                                             prefix=prefix, 
                                             thresh=thresh)
+        # the document index open questions are answered from
+        self.index_name = index_name
         
     def get_definition_via_wiktionary(self, query):
-        word = wikiparser.fetch(query)
+        word = definition_cache.get(query)
         print(type(word), word)
         if len(word) == 0:
             return ""
@@ -267,24 +316,36 @@ class DialogManager:
         help_info acts as the fake query.
         """
         type, query = self.get_query_type(query)
-        help_info = ""
+        help_info = self.get_help_info(type, query)
+        query = self.get_prompt(type, query, major)
+        return type, help_info, query
+
+    def get_help_info(self, type, query):
         if type == "explain":
-            help_info = f"explain the meaning of {query}"
-            query = self.type_explain(query)
+            return f"explain the meaning of {query}"
         elif type == "exemplify":
-            help_info = f"provide an example to {query}"
-            query = self.type_exemplify(query, major)
+            return f"provide an example to {query}"
         elif type == "detect":
-            help_info = f"detect ambiguious and confusing text for my major in {query}"
-            query = self.type_detect(query, major)
+            return f"detect ambiguious and confusing text for my major in {query}"
         elif type == "simplify":
-            help_info = f"simplify {query}"
-            query = self.type_simplify(query)
-        else:
-            help_info = query
-        return type, help_info, query
+            return f"simplify {query}"
+        return query
+
+    def get_prompt(self, type, query, major):
+        if type == "explain":
+            return self.type_explain(query)
+        elif type == "exemplify":
+            return self.type_exemplify(query, major)
+        elif type == "detect":
+            return self.type_detect(query, major)
+        elif type == "simplify":
+            return self.type_simplify(query)
+        return query
     
-    def get_response(self, query, major):
+    def get_messages(self, query, major, sources=()):
+        """Preprocess the query, add it to the history and return the list of
+        messages to send to the api. sources are the retrieved chunks of the
+        document, they are put right before an open question."""
         type, help_info, query = self.preprocess_query(query, major)
         # help_info acts as the query that needs to be added to the history
         # cuz some functions could contain long few-shot examples
@@ -294,18 +355,160 @@ class DialogManager:
         if type != "open":
             user_msg = self.history.form_user_msg(query)
             messages = [self.history.sys_messages, user_msg]
+        elif sources:
+            context = self.form_context_msg(sources)
+            reserve = count_tokens(context["content"]) + MESSAGE_OVERHEAD
+            messages = self.history.get_message_for_api(reserve=reserve)
+            messages.insert(-1, context)
         else: 
             messages = self.history.get_message_for_api()
         #print("debug, messages: ", messages)
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-            temperature=0.4,
-            max_tokens=1000,
-            frequency_penalty=0.0,
-            stream=True,
-        )
-        return response
+        return messages
+
+    def form_context_msg(self, sources):
+        excerpts = "\n\n".join(
+            f"[page {source['page_no']}] {source['text']}" if "page_no" in source
+            else source["text"]
+            for source in sources)
+        return {"role": "system",
+                "content": "Excerpts of the course document that may help to "
+                           f"answer the next question:\n\n{excerpts}"}
+
+    def _has_index(self):
+        # no embedding call for documents that aren't indexed (yet)
+        return bool(self.index_name) and retriever.get_index(self.index_name) is not None
+
+    def retrieve(self, query, api_key=None):
+        """Best chunks of the document for an open question."""
+        if not self._has_index():
+            return []
+        return retriever.search(self.index_name, embed_texts([query], api_key=api_key)[0],
+                                query=query)
+
+    async def aretrieve(self, query, api_key=None):
+        if not await run_blocking(self._has_index):
+            return []
+        embedding = await aembed_texts([query], api_key=api_key)
+        return await run_blocking(retriever.search, self.index_name, embedding[0], query=query)
+
+    def _cache_key(self, query, major):
+        """Response cache key of a non-open query, None if it can't be cached."""
+        type, query = self.get_query_type(query)
+        if type == "open":
+            return type, query, None
+        key = make_key(type, query, major, CHAT_PARAMS["model"], PROMPT_VERSION)
+        return type, query, key
+
+    def _cached_messages(self, type, query, major):
+        """The messages of a non-open query. Only built on a cache miss, for
+        cached answers we don't need the prompt (nor the wiktionary lookup)."""
+        return [self.history.sys_messages,
+                self.history.form_user_msg(self.get_prompt(type, query, major))]
+
+    def _use_semantic_cache(self, type, key):
+        return (semantic_cache is not None and type in semantic_cache.types
+                and response_cache.get(key) is None)
+
+    def get_response(self, query, major, api_key=None):
+        """Returns an iterator of the answer text chunks and the sources, the
+        document chunks the answer is grounded on (open questions only).
+        The key is passed per call, None for the server's (if
+        LLM_ALLOW_SERVER_KEY=1)."""
+        type, raw_query, key = self._cache_key(query, major)
+        if key is None:
+            sources = self.retrieve(raw_query, api_key=api_key)
+            messages = self.get_messages(query, major, sources)
+            return iter_openai_deltas(llm_client.chat(
+                messages,
+                api_key=api_key,
+                stream=True,
+                **CHAT_PARAMS,
+            )), sources
+
+        vector = None
+        if self._use_semantic_cache(type, key):
+            vector = semantic_cache.vectorize_embedding(
+                embed_texts([raw_query], api_key=api_key)[0])
+            answer = semantic_cache.lookup(type, major, vector)
+            if answer is not None:
+                self.history.add_user_message(self.get_help_info(type, raw_query))
+                return response_cache.replay(answer), []
+
+        def produce():
+            return iter_openai_deltas(llm_client.chat(
+                self._cached_messages(type, raw_query, major),
+                api_key=api_key,
+                stream=True,
+                **CHAT_PARAMS,
+            ))
+        # the upstream call is opened here, so its errors reach the client
+        # before the stream starts, and the question is only added to the
+        # history once its answer is on its way
+        chunks = response_cache.open(key, produce)
+        self.history.add_user_message(self.get_help_info(type, raw_query))
+        if vector is not None:
+            chunks = self._add_to_semantic_cache(chunks, type, major, vector)
+        return chunks, []
+
+    def _add_to_semantic_cache(self, chunks, type, major, vector):
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        semantic_cache.add(type, major, vector, "".join(parts))
+
+    async def aget_response(self, query, major, api_key=None):
+        """Async version of get_response used by the ASGI app, it returns an
+        async iterator of the answer text chunks and the sources. The key is
+        passed per call instead of through the global openai.api_key.
+        Everything blocking (history, retrieval, semantic cache, prompt)
+        runs in the executor."""
+        type, raw_query, key = self._cache_key(query, major)
+        if key is None:
+            sources = await self.aretrieve(raw_query, api_key=api_key)
+            messages = await run_blocking(self.get_messages, query, major, sources)
+            response = await llm_client.achat(
+                messages=messages,
+                stream=True,
+                api_key=api_key,
+                **CHAT_PARAMS,
+            )
+            return aiter_openai_deltas(response), sources
+
+        vector = None
+        if self._use_semantic_cache(type, key):
+            embedding = await aembed_texts([raw_query], api_key=api_key)
+            vector = semantic_cache.vectorize_embedding(embedding[0])
+            answer = await run_blocking(semantic_cache.lookup, type, major, vector)
+            if answer is not None:
+                await run_blocking(self.history.add_user_message,
+                                   self.get_help_info(type, raw_query))
+                return aiter_chunks(response_cache.replay(answer)), []
+
+        async def aproduce():
+            response = await llm_client.achat(
+                # the wiktionary lookup of explain queries
+                messages=await run_blocking(self._cached_messages, type, raw_query, major),
+                stream=True,
+                api_key=api_key,
+                **CHAT_PARAMS,
+            )
+            return aiter_openai_deltas(response)
+        chunks = await response_cache.aopen(key, aproduce)
+        await run_blocking(self.history.add_user_message, self.get_help_info(type, raw_query))
+        if vector is not None:
+            chunks = self._aadd_to_semantic_cache(chunks, type, major, vector)
+        return chunks, []
+
+    async def _aadd_to_semantic_cache(self, chunks, type, major, vector):
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        await run_blocking(semantic_cache.add, type, major, vector, "".join(parts))
     
     def collect_response(self, response:str):
-        self.history.add_assistant_message(response)
\ No newline at end of file
+        self.history.add_assistant_message(response)
+
+    def close(self):
+        self.history.close()
\ No newline at end of file
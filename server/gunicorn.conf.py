@@ -0,0 +1,19 @@
+# gunicorn settings, read from the working directory by `gunicorn app:app`
+# (see Procfile).
+import os
+
+from preload import preload
+
+# bind and workers: gunicorn's defaults, $PORT and $WEB_CONCURRENCY
+# answers are streamed for a long time
+timeout = 120
+
+# Not preload_app: the app opens sqlite connections and starts threads at
+# import, which must not be shared by forked workers. The master preloads the
+# heavy stateless modules instead, each worker imports the app on top of them.
+preload_app = False
+
+
+def on_starting(server):
+    if os.environ.get("GUNICORN_PRELOAD", "1") == "1":
+        preload(verbose=True)
@@ -0,0 +1,203 @@
+# encoding: utf-8
+"""Pooled sqlite storage for the dialog history.
+
+Every chat has its own database file (static/db/<index>.db). Instead of
+opening a new connection per message, HistoryStore keeps a small pool of
+persistent connections per file, runs them in WAL mode and reuses the same
+SQL strings so sqlite's statement cache serves them prepared.
+
+With write_behind=True inserts are queued and written by a background thread
+in one transaction per database, batching across turns and chats. Call
+flush() to wait until everything queued so far is on disk.
+"""
+
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from tokenizer import count_tokens
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        cum_tokens INTEGER NOT NULL DEFAULT 0,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+# cum_tokens is the running sum of tokens over all rows up to this one, so
+# cum_tokens - tokens is where a row starts
+INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS history_start_tokens ON history (cum_tokens - tokens)
+"""
+INSERT_SQL = """
+    INSERT INTO history (role, content, tokens, cum_tokens)
+    VALUES (?, ?, ?, ? + COALESCE(
+        (SELECT cum_tokens FROM history ORDER BY id DESC LIMIT 1), 0))
+"""
+# the newest rows whose tokens add up to at most the budget, oldest first,
+# answered by one range scan on the start_tokens index
+SELECT_SQL = """
+    SELECT role, content, tokens FROM history
+    WHERE cum_tokens - tokens >= COALESCE(
+        (SELECT cum_tokens FROM history ORDER BY id DESC LIMIT 1), 0) - ?
+    ORDER BY cum_tokens - tokens
+"""
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # with WAL, NORMAL only syncs at checkpoints and is still corruption safe
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class HistoryStore:
+    """
+    Args:
+        pool_size: max number of idle connections kept per database file
+        write_behind: queue inserts and write them from a background thread
+        batch_size: max number of queued messages written in one go
+    """
+    def __init__(self, pool_size=4, write_behind=False, batch_size=256):
+        self.pool_size = pool_size
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        if write_behind:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+
+    def _connect(self, path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False,
+                               cached_statements=64)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(CREATE_SQL)
+        self._migrate(conn)
+        conn.execute(INDEX_SQL)
+        conn.commit()
+        return conn
+
+    def _migrate(self, conn):
+        """Add and backfill the token columns of databases created before
+        they existed."""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(history)")]
+        if "cum_tokens" in columns:
+            return
+        conn.execute("ALTER TABLE history ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0")
+        conn.execute("ALTER TABLE history ADD COLUMN cum_tokens INTEGER NOT NULL DEFAULT 0")
+        cum_tokens = 0
+        updates = []
+        for row_id, content in conn.execute("SELECT id, content FROM history ORDER BY id"):
+            tokens = count_tokens(content)
+            cum_tokens += tokens
+            updates.append((tokens, cum_tokens, row_id))
+        conn.executemany("UPDATE history SET tokens = ?, cum_tokens = ? WHERE id = ?", updates)
+
+    def _pool(self, path):
+        with self._lock:
+            pool = self._pools.get(path)
+            if pool is None:
+                pool = self._pools[path] = queue.LifoQueue(self.pool_size)
+            return pool
+
+    @contextmanager
+    def connection(self, path):
+        """Check a connection out of the pool for `path`."""
+        pool = self._pool(path)
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect(path)
+        try:
+            yield conn
+        finally:
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def add_message(self, path, role, content, tokens):
+        if self.write_behind:
+            self._queue.put((path, role, content, tokens))
+            return
+        with self.connection(path) as conn:
+            conn.execute(INSERT_SQL, (role, content, tokens, tokens))
+            conn.commit()
+
+    def read_messages(self, path, budget):
+        """Return the newest (role, content, tokens) rows that fit within
+        `budget` tokens, oldest first."""
+        self.flush()
+        with self.connection(path) as conn:
+            return conn.execute(SELECT_SQL, (budget,)).fetchall()
+
+    def _write_batch(self, batch):
+        by_path = defaultdict(list)
+        for path, role, content, tokens in batch:
+            by_path[path].append((role, content, tokens, tokens))
+        for path, rows in by_path.items():
+            with self.connection(path) as conn:
+                conn.executemany(INSERT_SQL, rows)
+                conn.commit()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print("history write error:", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued message has been written."""
+        if self.write_behind:
+            self._queue.join()
+
+    def release(self, path):
+        """Close the idle connections of one database, e.g. when its chat is
+        evicted from memory. The pool is rebuilt on the next use."""
+        self.flush()
+        with self._lock:
+            pool = self._pools.pop(path, None)
+        while pool is not None and not pool.empty():
+            pool.get_nowait().close()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+
+
+# shared by every DialogHistoryManager of the process
+history_store = HistoryStore(
+    pool_size=int(os.environ.get("HISTORY_POOL_SIZE", "4")),
+    write_behind=os.environ.get("HISTORY_WRITE_BEHIND", "") == "1",
+)
+atexit.register(history_store.close)
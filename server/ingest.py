@@ -0,0 +1,257 @@
+# encoding: utf-8
+"""Background ingestion of uploaded documents.
+
+/api/upload only saves the file and enqueues a job; text extraction, chunking
+and the index build (create_index) run on a process pool. Jobs and their
+progress live in a sqlite table, so /api/jobs/<id> can be answered by any
+worker and unfinished jobs are picked up again after a restart.
+
+A running job holds a lease: the pool process records its host and pid as
+the owner and renews a heartbeat while the index is built. Every web worker
+calls resume() at import, so only jobs whose lease expired (the owner died)
+are re-queued, never one that is still being built by another worker.
+"""
+
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+staticPath = "static"
+
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        filepath TEXT NOT NULL,
+        status TEXT NOT NULL,
+        pages INTEGER NOT NULL DEFAULT 0,
+        chunks INTEGER NOT NULL DEFAULT 0,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        pages_reused INTEGER NOT NULL DEFAULT 0,
+        chunks_reused INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        heartbeat REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+JOB_FIELDS = ("id", "filename", "status", "pages", "chunks", "tokens",
+              "pages_reused", "chunks_reused", "skipped",
+              "error", "created_at", "updated_at")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# a running job whose heartbeat is older than this is taken as abandoned
+LEASE_SECONDS = float(os.environ.get("INGEST_LEASE_SECONDS", "60"))
+HEARTBEAT_SECONDS = LEASE_SECONDS / 4
+
+# columns added after the first release
+MIGRATIONS = {
+    "pages_reused": "INTEGER NOT NULL DEFAULT 0",
+    "chunks_reused": "INTEGER NOT NULL DEFAULT 0",
+    "skipped": "INTEGER NOT NULL DEFAULT 0",
+    "owner": "TEXT",
+    "heartbeat": "REAL NOT NULL DEFAULT 0",
+}
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(CREATE_SQL)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+    for column, definition in MIGRATIONS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+    return conn
+
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _heartbeat(db_path, job_id, owner, stop):
+    """Renews the lease of a running job until stop is set."""
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            conn = _connect(db_path)
+            with conn:
+                renewed = conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = ?",
+                    (time.time(), job_id, owner, RUNNING)).rowcount
+            conn.close()
+        except sqlite3.Error as e:
+            print(e, "heartbeat error")
+            continue
+        if not renewed:
+            print(f"job {job_id} lost its lease")
+            return
+
+
+def _update(db_path, job_id, **fields):
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    conn = _connect(db_path)
+    with conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?",
+                     (*fields.values(), job_id))
+    conn.close()
+
+
+def _update_catalog(catalog_path, filename, **fields):
+    """The status shown in the file list, best effort."""
+    if catalog_path is None:
+        return
+    try:
+        from catalog import Catalog
+        catalog = Catalog(catalog_path)
+        catalog.update(filename, **fields)
+        catalog.close()
+    except Exception as e:
+        print(e, "catalog error")
+
+
+def run_job(db_path, job_id, filepath, filename, api_key=None, catalog_path=None):
+    """Runs in a pool process. Claims the job, builds the index and records
+    the progress on the way."""
+    owner = _owner()
+    now = time.time()
+    conn = _connect(db_path)
+    with conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, updated_at = ?"
+            " WHERE id = ? AND status = ?",
+            (RUNNING, owner, now, now, job_id, QUEUED)).rowcount
+    conn.close()
+    if not claimed:
+        # another worker got it first
+        return
+
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(db_path, job_id, owner, stop),
+                     daemon=True).start()
+    try:
+        _run_claimed(db_path, job_id, filepath, filename, api_key, catalog_path)
+    finally:
+        stop.set()
+
+
+def _run_claimed(db_path, job_id, filepath, filename, api_key, catalog_path):
+
+    _update_catalog(catalog_path, filename, status=RUNNING)
+    from create_index import create_index
+
+    pages = {}
+    def progress(**counts):
+        # the upload doesn't hash the file, the catalog gets it from here
+        if "file_hash" in counts:
+            _update_catalog(catalog_path, filename, file_hash=counts.pop("file_hash"))
+            if not counts:
+                return
+        if "pages" in counts:
+            pages["pages"] = counts["pages"]
+        _update(db_path, job_id, **counts)
+
+    try:
+        tokens = create_index(filepath, filename, progress=progress, api_key=api_key)
+        _update(db_path, job_id, status=DONE, tokens=tokens or 0)
+    except Exception as e:
+        _update(db_path, job_id, status=FAILED, error=str(e))
+        _update_catalog(catalog_path, filename, status=FAILED)
+        raise
+    _update_catalog(catalog_path, filename, status=DONE, indexed=1, **pages)
+
+    # the document is searchable on its own already, the cross-document
+    # index is best effort
+    try:
+        from ann_index import ann_index
+        ann_index.add(os.path.splitext(filename)[0])
+    except Exception as e:
+        print(e, "ann index error")
+
+
+class IngestQueue:
+    """
+    Args:
+        db_path: sqlite file of the job table
+        workers: size of the process pool
+        catalog_path: sqlite file of the document catalog the jobs report
+            their status to (see catalog.py), None for none
+    """
+    def __init__(self, db_path=f"{staticPath}/jobs.db", workers=2, catalog_path=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.catalog_path = catalog_path
+        self._executor = None
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        _connect(db_path).close()
+
+    @property
+    def executor(self):
+        # created on first use: spawned children re-import the main module,
+        # which must not start a pool of its own
+        if self._executor is None:
+            # spawn: the server process has threads (history writer, flask)
+            # that must not be forked mid-flight
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, filepath, filename, api_key=None):
+        """Enqueue a job and return its id. The api key is only kept in
+        memory, jobs resumed after a restart use the server's key, which needs
+        LLM_ALLOW_SERVER_KEY=1."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = _connect(self.db_path)
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, filepath, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, filename, filepath, QUEUED, now, now))
+        conn.close()
+        self.executor.submit(run_job, self.db_path, job_id, filepath, filename, api_key,
+                             self.catalog_path)
+        return job_id
+
+    def resume(self):
+        """Re-enqueue the jobs a dead process didn't finish. Safe to call
+        from every worker: running jobs with a live lease are left alone and
+        a queued job is only run by the worker that claims it."""
+        if multiprocessing.parent_process() is not None:
+            return 0
+        conn = _connect(self.db_path)
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL WHERE status = ? AND heartbeat < ?",
+                (QUEUED, RUNNING, time.time() - LEASE_SECONDS))
+            rows = conn.execute(
+                "SELECT id, filepath, filename FROM jobs WHERE status = ? ORDER BY created_at",
+                (QUEUED,)).fetchall()
+        conn.close()
+        for job_id, filepath, filename in rows:
+            self.executor.submit(run_job, self.db_path, job_id, filepath, filename,
+                                 None, self.catalog_path)
+        return len(rows)
+
+    def get(self, job_id):
+        conn = _connect(self.db_path)
+        row = conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?",
+                           (job_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return dict(zip(JOB_FIELDS, row))
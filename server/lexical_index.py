@@ -0,0 +1,224 @@
+# encoding: utf-8
+"""BM25 inverted index over the chunks of a document.
+
+Embeddings are unreliable for exact jargon ("gated fusion network"), so the
+chunks are also indexed by term and the two rankings are fused (see
+retrieval.Retriever).
+
+Tokens are lowercased latin words and numbers (plural s stripped), and for
+CJK text, which has no spaces, overlapping character bigrams.
+
+The index of `static/index/<name>` is `<name>.bm25.npz`, the chunk ids are
+the rows of the vector index. Postings are arrays: for each term the chunk
+ids are stored as gaps (delta encoded, in the smallest unsigned int type
+that fits) with their term frequencies, all terms back to back. The sorted
+vocabulary is stored the same way, as its UTF-8 bytes back to back with the
+offset of each term (a numpy str array would pad every term to the longest).
+
+An index can be built from the texts of an existing vector index with
+    python lexical_index.py <name> ...
+"""
+
+import argparse
+import array
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from definition_cache import lemmatize
+from vector_store import VectorIndex, index_prefix
+
+# kana, CJK ideographs (+ extension A and compatibility), hangul
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_RE = re.compile(f"[{CJK}]+|[^\\W_{CJK}]+")
+CJK_RE = re.compile(f"[{CJK}]")
+
+
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if CJK_RE.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(lemmatize(token))
+    return tokens
+
+
+def lexical_path(name):
+    return f"{index_prefix(name)}.bm25.npz"
+
+
+def remove_lexical_index(name):
+    if os.path.exists(lexical_path(name)):
+        os.remove(lexical_path(name))
+
+
+def _smallest_uint(values):
+    top = int(values.max()) if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.uint64)
+
+
+class LexicalIndexWriter:
+    """Collects the postings of a document's chunks, in chunk order. The
+    postings of each batch of chunks (add_documents) are packed into numpy
+    arrays of term ids, rows and term frequencies, a few bytes each.
+
+    Args:
+        path: the .bm25.npz file
+    """
+    def __init__(self, path):
+        self.path = path
+        # term -> id, in the order the terms were first seen
+        self.terms = {}
+        self.lengths = array.array("I")
+        self._term_ids, self._rows, self._tfs = [], [], []
+        self._batches = []
+
+    def add(self, text):
+        row = len(self.lengths)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._term_ids.append(self.terms.setdefault(term, len(self.terms)))
+            self._rows.append(row)
+            self._tfs.append(min(tf, 65535))
+        self.lengths.append(sum(counts.values()))
+
+    def add_documents(self, documents):
+        for document in documents:
+            self.add(document.text)
+        self._flush()
+
+    def _flush(self):
+        if self._term_ids:
+            self._batches.append((np.array(self._term_ids, dtype=np.uint32),
+                                  np.array(self._rows, dtype=np.uint32),
+                                  np.array(self._tfs, dtype=np.uint16)))
+            self._term_ids, self._rows, self._tfs = [], [], []
+
+    def close(self):
+        self._flush()
+        vocab = sorted(self.terms)
+        # id of each term in the sorted vocabulary, by first seen id
+        rank = np.zeros(len(vocab), dtype=np.uint32)
+        rank[[self.terms[term] for term in vocab]] = np.arange(len(vocab))
+        if self._batches:
+            term_ids, rows, tfs = (np.concatenate(arrays) for arrays in zip(*self._batches))
+        else:
+            term_ids, rows, tfs = (np.zeros(0, np.uint32) for _ in range(3))
+        self._batches = []
+        # the sort is stable: the rows of a term stay in increasing order
+        keys = rank[term_ids]
+        del term_ids
+        order = np.argsort(keys, kind="stable")
+        rows, tfs = rows[order], tfs[order]
+        del order
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=len(vocab)), out=offsets[1:])
+        del keys
+        # the gaps wrap around where a term starts, its first gap is its row
+        gaps = np.diff(rows, prepend=np.uint32(0))
+        gaps[offsets[:-1]] = rows[offsets[:-1]]
+        encoded = [term.encode("utf-8") for term in vocab]
+        vocab_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=vocab_offsets[1:])
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(tmp,
+                 vocab_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                 vocab_offsets=vocab_offsets,
+                 offsets=offsets,
+                 gaps=_smallest_uint(gaps),
+                 tfs=_smallest_uint(tfs),
+                 lengths=np.array(self.lengths, dtype=np.uint32))
+        os.replace(tmp, self.path)
+
+    def abort(self):
+        """Drop the postings, e.g. when indexing failed. Nothing is written
+        before close, except a temporary file if close failed."""
+        self._batches = []
+        self._term_ids, self._rows, self._tfs = [], [], []
+        if os.path.exists(f"{self.path}.tmp.npz"):
+            os.remove(f"{self.path}.tmp.npz")
+
+
+class LexicalIndex:
+    """
+    Args:
+        path: the .bm25.npz file
+        k1, b: the BM25 parameters
+    """
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        with np.load(path) as saved:
+            if "vocab_bytes" in saved.files:
+                data = saved["vocab_bytes"].tobytes()
+                bounds = saved["vocab_offsets"].tolist()
+                vocab = [data[start:stop].decode("utf-8")
+                         for start, stop in zip(bounds[:-1], bounds[1:])]
+            else:
+                # indexes written before, with a fixed width str array
+                vocab = saved["vocab"].tolist()
+            self.offsets = saved["offsets"]
+            self.gaps = saved["gaps"]
+            self.tfs = saved["tfs"]
+            self.lengths = saved["lengths"].astype(np.float32)
+        self.terms = {term: i for i, term in enumerate(vocab)}
+        avg = float(self.lengths.mean()) if len(self.lengths) else 1.0
+        # the length part of the BM25 denominator, per chunk
+        self.norms = (self.k1 * (1 - self.b + self.b * self.lengths / max(avg, 1e-6))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def load(cls, name):
+        return cls(lexical_path(name))
+
+    def postings(self, term):
+        """(chunk ids, term frequencies) of a term."""
+        i = self.terms.get(term)
+        if i is None:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        rows = np.cumsum(self.gaps[start:stop], dtype=np.int64)
+        return rows, self.tfs[start:stop].astype(np.float32)
+
+    def scores(self, query):
+        """BM25 score of every chunk for the query."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        n = len(self)
+        for term, count in Counter(tokenize(query)).items():
+            rows, tfs = self.postings(term)
+            if not len(rows):
+                continue
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            # each row appears once per term, so the fancy += is safe
+            scores[rows] += count * idf * tfs * (self.k1 + 1) / (tfs + self.norms[rows])
+        return scores
+
+
+def build(name):
+    """Build the lexical index of an existing vector index."""
+    index = VectorIndex.load(name)
+    writer = LexicalIndexWriter(lexical_path(name))
+    for i in range(len(index)):
+        writer.add(index.text(i))
+    writer.close()
+    return len(index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BM25 index of indexed documents")
+    parser.add_argument("names", nargs="+", help="index names, e.g. nn_semantics")
+    args = parser.parse_args()
+    for name in args.names:
+        print(f"{name}: {build(name)} chunks")
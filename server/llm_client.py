@@ -0,0 +1,279 @@
+# encoding: utf-8
+"""HTTP client of the OpenAI api, for the sync and the async code paths.
+
+The openai package takes its key from the global openai.api_key, which
+concurrent requests with different keys race on. Here the key is an
+argument of every call and only goes into the headers of that request.
+
+Connections are kept alive in one pooled requests.Session per upstream (api
+base), and one aiohttp session per upstream and event loop for the async
+calls, so repeated calls skip the TCP and TLS handshakes. Failed connections
+and 429/5xx answers are retried with exponential backoff. Read errors are
+not, the request may have been processed (and billed) already.
+
+Answers have the same shape as the openai package's, so e.g.
+streaming.iter_openai_deltas works on both.
+
+A call without a key of the user fails with a 401, unless the server allows
+its own OPENAI_API_KEY as the fallback (LLM_ALLOW_SERVER_KEY=1), see
+resolve_api_key.
+"""
+
+import asyncio
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE = "https://api.openai.com/v1"
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """An error answer of the api, status_code is picked up by the error
+    handlers of the apps."""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def resolve_api_key(api_key=None):
+    """The key of a call: the user's, else the server's OPENAI_API_KEY if
+    LLM_ALLOW_SERVER_KEY=1, else an LLMError (401)."""
+    if api_key:
+        return api_key
+    if os.environ.get("LLM_ALLOW_SERVER_KEY", "") == "1":
+        api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMError("No OpenAI api key", status_code=401)
+    return api_key
+
+
+class LLMClient:
+    """
+    Args:
+        api_base: default upstream, e.g. a proxy of the openai api
+        timeout: (connect, read) seconds, read is the max wait for the next
+            bytes of the answer, not for the whole answer
+        retries: max retries of a failed connection or a 429/5xx answer
+        backoff: the n-th retry waits backoff * 2 ** (n - 1) seconds, or
+            what the Retry-After header says
+        pool_size: connections kept alive per upstream
+    """
+    def __init__(self, api_base=API_BASE, timeout=(5, 60), retries=2, backoff=0.5,
+                 pool_size=32):
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._asessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, api_base):
+        """The shared session of an upstream. requests.Session is safe to
+        use from several threads as long as its settings don't change."""
+        with self._lock:
+            session = self._sessions.get(api_base)
+            if session is None:
+                retry = Retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=0,
+                    status=self.retries,
+                    other=0,
+                    allowed_methods=frozenset({"POST"}),
+                    status_forcelist=RETRY_STATUS,
+                    backoff_factor=self.backoff,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[api_base] = session
+            return session
+
+    def _post(self, path, payload, api_key=None, api_base=None, stream=False):
+        api_key = resolve_api_key(api_key)
+        api_base = (api_base or self.api_base).rstrip("/")
+        try:
+            response = self.session(api_base).post(
+                f"{api_base}/{path}",
+                json=payload,
+                headers={"Authorization": f"Bearer {api_key}"},
+                timeout=self.timeout,
+                stream=stream,
+            )
+        except requests.Timeout as e:
+            raise LLMError(f"OpenAI api timeout: {e}", status_code=504) from e
+        except requests.ConnectionError as e:
+            raise LLMError(f"OpenAI api unreachable: {e}", status_code=502) from e
+        if response.status_code != 200:
+            try:
+                message = response.json()["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            response.close()
+            raise LLMError(message, status_code=response.status_code)
+        return response
+
+    @staticmethod
+    def _events(response):
+        """The events of a streamed answer (server-sent events)."""
+        try:
+            # read to the end, so the connection goes back to the pool
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data != b"[DONE]":
+                    yield json.loads(data)
+        finally:
+            response.close()
+
+    def chat(self, messages, api_key=None, api_base=None, stream=False, **params):
+        """Like openai.ChatCompletion.create. The request is sent right
+        away, errors are raised before the first event of a stream."""
+        response = self._post("chat/completions",
+                              {"messages": messages, "stream": stream, **params},
+                              api_key=api_key, api_base=api_base, stream=stream)
+        if stream:
+            return self._events(response)
+        with response:
+            return response.json()
+
+    def embed(self, texts, model, api_key=None, api_base=None):
+        """Like openai.Embedding.create."""
+        with self._post("embeddings", {"input": texts, "model": model},
+                        api_key=api_key, api_base=api_base) as response:
+            return response.json()
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+    # -- async, for the ASGI app
+
+    def asession(self, api_base):
+        """The aiohttp session of an upstream on the running event loop. A
+        session can't be shared between loops, so each loop gets its own."""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._asessions.get((loop, api_base))
+            if session is None or session.closed:
+                # forget the sessions of finished loops (e.g. of asyncio.run)
+                for key in [key for key in self._asessions if key[0].is_closed()]:
+                    del self._asessions[key]
+                # sock_read is the max wait for the next bytes, like requests'
+                connector = aiohttp.TCPConnector(limit_per_host=self.pool_size)
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0],
+                                                sock_read=self.timeout[1])
+                session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+                self._asessions[(loop, api_base)] = session
+            return session
+
+    def _retry_delay(self, retry, response):
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+        return self.backoff * 2 ** (retry - 1)
+
+    async def _apost(self, path, payload, api_key=None, api_base=None):
+        """Async version of `_post` with the retries of the sync session:
+        failed connections and 429/5xx answers, not read errors."""
+        import aiohttp
+
+        api_key = resolve_api_key(api_key)
+        api_base = (api_base or self.api_base).rstrip("/")
+        session = self.asession(api_base)
+        retry = 0
+        while True:
+            retry += 1
+            try:
+                response = await session.post(
+                    f"{api_base}/{path}",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {api_key}"},
+                )
+            except aiohttp.ClientConnectorError as e:
+                # nothing was sent yet
+                if retry > self.retries:
+                    raise LLMError(f"OpenAI api unreachable: {e}", status_code=502) from e
+                await asyncio.sleep(self.backoff * 2 ** (retry - 1))
+                continue
+            except asyncio.TimeoutError as e:
+                raise LLMError(f"OpenAI api timeout: {e}", status_code=504) from e
+            except aiohttp.ClientError as e:
+                raise LLMError(f"OpenAI api unreachable: {e}", status_code=502) from e
+            if response.status == 200:
+                return response
+            if response.status in RETRY_STATUS and retry <= self.retries:
+                response.release()
+                await asyncio.sleep(self._retry_delay(retry, response))
+                continue
+            try:
+                message = (await response.json(content_type=None))["error"]["message"]
+            except (ValueError, KeyError, TypeError):
+                message = await response.text()
+            response.release()
+            raise LLMError(message, status_code=response.status)
+
+    @staticmethod
+    async def _aevents(response):
+        """Async version of `_events`."""
+        try:
+            async for line in response.content:
+                line = line.rstrip(b"\r\n")
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data != b"[DONE]":
+                    yield json.loads(data)
+        finally:
+            response.release()
+
+    async def achat(self, messages, api_key=None, api_base=None, stream=False, **params):
+        """Async version of `chat`, a stream is an async iterator of the
+        events."""
+        response = await self._apost("chat/completions",
+                                     {"messages": messages, "stream": stream, **params},
+                                     api_key=api_key, api_base=api_base)
+        if stream:
+            return self._aevents(response)
+        async with response:
+            return await response.json()
+
+    async def aembed(self, texts, model, api_key=None, api_base=None):
+        """Async version of `embed`."""
+        response = await self._apost("embeddings", {"input": texts, "model": model},
+                                     api_key=api_key, api_base=api_base)
+        async with response:
+            return await response.json()
+
+    async def aclose(self):
+        """Close the async sessions of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            keys = [key for key in self._asessions if key[0] is loop]
+            sessions = [self._asessions.pop(key) for key in keys]
+        for session in sessions:
+            await session.close()
+
+
+# shared by the whole process, OPENAI_PROXY replaces the openai api
+llm_client = LLMClient(
+    api_base=os.environ.get("OPENAI_PROXY") or API_BASE,
+    timeout=(float(os.environ.get("LLM_CONNECT_TIMEOUT", "5")),
+             float(os.environ.get("LLM_READ_TIMEOUT", "60"))),
+    retries=int(os.environ.get("LLM_RETRIES", "2")),
+)
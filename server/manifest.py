@@ -0,0 +1,146 @@
+# encoding: utf-8
+"""Content-addressed record of the ingestion work already done.
+
+- documents: the content hash of the file each index was built from, so an
+  identical re-upload is skipped entirely
+- pages: extracted text by page content hash, so unchanged pages of a
+  modified file (or the same slides in another file) are not extracted again
+- chunks: embeddings by (model, chunk text hash), so unchanged chunks are
+  not embedded again
+- summaries: document summaries by (file hash, prompt version)
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+staticPath = "static"
+
+CREATE_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS documents (
+        name TEXT PRIMARY KEY,
+        file_hash TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pages (
+        page_hash TEXT PRIMARY KEY,
+        text TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chunks (
+        model TEXT NOT NULL,
+        chunk_hash TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        PRIMARY KEY (model, chunk_hash)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        file_hash TEXT NOT NULL,
+        version TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (file_hash, version)
+    )
+    """,
+)
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text: str) -> str:
+    return hash_bytes(text.encode("utf-8"))
+
+
+def hash_file(filepath, block_size=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path=f"{staticPath}/manifest.db"):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in CREATE_SQL:
+            self._conn.execute(sql)
+        self._conn.commit()
+
+    def file_hash(self, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM documents WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_file_hash(self, name, file_hash):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (name, file_hash, updated_at) VALUES (?, ?, ?)",
+                (name, file_hash, time.time()))
+
+    def remove_document(self, name):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM documents WHERE name = ?", (name,))
+
+    def get_page(self, page_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE page_hash = ?", (page_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put_page(self, page_hash, text):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (page_hash, text) VALUES (?, ?)",
+                (page_hash, text))
+
+    def get_embeddings(self, model, chunk_hashes):
+        """Return {chunk_hash: embedding} for the hashes that are known."""
+        found = {}
+        with self._lock:
+            for chunk_hash in chunk_hashes:
+                row = self._conn.execute(
+                    "SELECT embedding FROM chunks WHERE model = ? AND chunk_hash = ?",
+                    (model, chunk_hash)).fetchone()
+                if row is not None:
+                    found[chunk_hash] = np.frombuffer(row[0], dtype=np.float32).tolist()
+        return found
+
+    def put_embeddings(self, model, items):
+        """Store (chunk_hash, embedding) pairs."""
+        rows = [(model, chunk_hash, np.asarray(embedding, dtype=np.float32).tobytes())
+                for chunk_hash, embedding in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (model, chunk_hash, embedding) VALUES (?, ?, ?)",
+                rows)
+
+    def get_summary(self, file_hash, version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE file_hash = ? AND version = ?",
+                (file_hash, str(version))).fetchone()
+        return row[0] if row else None
+
+    def put_summary(self, file_hash, version, summary):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (file_hash, version, summary, created_at) VALUES (?, ?, ?, ?)",
+                (file_hash, str(version), summary, time.time()))
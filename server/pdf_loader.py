@@ -1,74 +1,308 @@
 """Read PDF files."""
 
-import shutil
+import hashlib
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, List
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
 
 from llama_index.langchain_helpers.text_splitter import SentenceSplitter
 from llama_index.readers.base import BaseReader
 from llama_index.readers.schema.base import Document
+from tokenizer import get_encoding
 
 # https://github.com/emptycrown/llama-hub/blob/main/loader_hub/file/cjk_pdf/base.py
 
 staticPath = "static"
 
+# encoding the llama_index splitter counts chunk sizes with
+SPLITTER_ENCODING = "gpt2"
 
-class CJKPDFReader(BaseReader):
-    """CJK PDF reader.
 
-    Extract text from PDF including CJK (Chinese, Japanese and Korean) languages using pdfminer.six.
+def count_pages(filepath) -> int:
+    """Number of pages, read from the page tree without parsing the pages."""
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    with open(filepath, "rb") as fp:
+        document = PDFDocument(PDFParser(fp))
+        return resolve1(document.catalog["Pages"])["Count"]
+
+
+# keys that don't change the extracted text: the stream encoding (the data is
+# hashed decoded) and back references up the page tree
+SKIPPED_KEYS = {"Length", "Filter", "DecodeParms", "Parent", "P"}
+
+
+def _hash_object(digest, obj, memo):
+    """Feed a canonical form of a pdf object to digest. References are
+    resolved and hashed by content, once per object (memo: objid -> digest),
+    so a font or image shared by all pages is read once per file."""
+    from pdfminer.pdftypes import PDFObjRef, PDFStream
+
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in memo:
+            # a reference cycle hashes as a marker
+            memo[obj.objid] = b"cycle"
+            sub = hashlib.sha256()
+            _hash_object(sub, obj.resolve(), memo)
+            memo[obj.objid] = sub.digest()
+        digest.update(b"R" + memo[obj.objid])
+    elif isinstance(obj, PDFStream):
+        digest.update(b"S")
+        _hash_object(digest, obj.attrs, memo)
+        data = obj.get_data()
+        digest.update(b"%d:" % len(data) + data)
+    elif isinstance(obj, dict):
+        digest.update(b"D%d" % len(obj))
+        for key in sorted(obj, key=str):
+            if key in SKIPPED_KEYS:
+                continue
+            digest.update(repr(key).encode() + b"=")
+            _hash_object(digest, obj[key], memo)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"L%d" % len(obj))
+        for item in obj:
+            _hash_object(digest, item, memo)
+    else:
+        digest.update(b"V" + repr(obj).encode() + b";")
+
+
+def page_hashes(filepath) -> List[str]:
+    """Content hash of each page: its media box, rotation, decoded content
+    streams and resolved resources, i.e. everything the text extraction
+    reads. Resources include Form XObjects (recursively) and fonts with their
+    encodings and ToUnicode maps, so pages that draw the same content stream
+    with different resources get different hashes.
+
+    Much cheaper than the layout analysis, and object numbers are not part of
+    it, so the same page in an edited or another file gets the same hash.
     """
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdftypes import resolve1
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        """Init params."""
-        super().__init__(*args, **kwargs)
+    hashes = []
+    memo = {}
+    with open(filepath, "rb") as fp:
+        for page in PDFPage.get_pages(fp):
+            digest = hashlib.sha256(repr((page.mediabox, page.rotate)).encode())
+            for stream in page.contents:
+                data = resolve1(stream).get_data()
+                digest.update(b"%d:" % len(data) + data)
+            _hash_object(digest, page.resources, memo)
+            hashes.append(digest.hexdigest())
+    return hashes
+
+
+def extract_pages(filepath, pagenos: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_no, text) for the given 0-based page numbers (default: all
+    pages), page_no is 1-based."""
+    # Import pdfminer
+    from io import StringIO
 
-    def load_data(self, filepath: Path, filename) -> List[Document]:
-        """Parse file."""
-
-        # Import pdfminer
-        from io import StringIO
-
-        from pdfminer.converter import TextConverter
-        from pdfminer.layout import LAParams
-        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
-        from pdfminer.pdfpage import PDFPage
-
-        # Create a resource manager
-        rsrcmgr = PDFResourceManager()
-        # Create an object to store the text
-        retstr = StringIO()
-        # Create a text converter
-        codec = "utf-8"
-        laparams = LAParams()
-        device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
-        # Create a PDF interpreter
-        interpreter = PDFPageInterpreter(rsrcmgr, device)
-        # Open the PDF file
-        fp = open(filepath, "rb")
-        # Create a list to store the text of each page
-        document_list = []
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    # Create a resource manager
+    rsrcmgr = PDFResourceManager()
+    # Create an object to store the text
+    retstr = StringIO()
+    # Create a text converter
+    codec = "utf-8"
+    laparams = LAParams()
+    device = TextConverter(rsrcmgr, retstr, codec=codec, laparams=laparams)
+    # Create a PDF interpreter
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    wanted = None if pagenos is None else sorted(pagenos)
+    # Open the PDF file
+    with open(filepath, "rb") as fp:
         # Extract text from each page
-        for i, page in enumerate(PDFPage.get_pages(fp)):
+        pages = PDFPage.get_pages(fp, pagenos=None if wanted is None else set(wanted))
+        for i, page in enumerate(pages):
             interpreter.process_page(page)
 
             # Get the text
-            text = retstr.getvalue()
-
-            sentence_splitter = SentenceSplitter(chunk_size=400)
-            text_chunks = sentence_splitter.split_text(text)
+            yield (i if wanted is None else wanted[i]) + 1, retstr.getvalue()
 
-            document_list += [
-                Document(t, extra_info={"page_no": i + 1}) for t in text_chunks
-            ]
             # Clear the text
             retstr.truncate(0)
             retstr.seek(0)
-        # Close the file
-        fp.close()
-        # Close the device
-        device.close()
+    # Close the device
+    device.close()
+
+
+def _extract_range(filepath, pagenos: List[int]) -> List[Tuple[int, str]]:
+    """Pool task, each worker opens the file itself."""
+    return list(extract_pages(filepath, pagenos))
+
+
+class CJKPDFReader(BaseReader):
+    """CJK PDF reader.
+
+    Extract text from PDF including CJK (Chinese, Japanese and Korean) languages using pdfminer.six.
+
+    Args:
+        workers: processes used to extract pages in parallel, defaults to the
+            number of cores, 1 disables the parallel mode
+        min_parallel_pages: files with fewer pages are extracted serially,
+            starting the pool isn't worth it for them
+        page_cache: optional store of extracted text by page content hash
+            (see manifest.Manifest), only pages missing from it are extracted
+        chunk_size: max tokens of a chunk
+        merge_pages: merge consecutive chunks across page boundaries while
+            they fit in chunk_size, so short pages (slides) don't end up as
+            many tiny chunks. The chunks then carry start_page/end_page.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        workers: Optional[int] = None,
+        min_parallel_pages: int = 64,
+        page_cache: Any = None,
+        chunk_size: int = 400,
+        merge_pages: bool = False,
+        **kwargs: Any,
+    ) -> None:
+        """Init params."""
+        super().__init__(*args, **kwargs)
+        self.chunk_size = chunk_size
+        self.merge_pages = merge_pages
+        # one splitter for all pages, building it sets up the tokenizer
+        self.splitter = SentenceSplitter(chunk_size=chunk_size)
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_pages = min_parallel_pages
+        self.page_cache = page_cache
+        # pages taken from the page cache / extracted by the last run
+        self.pages_reused = 0
+        self.pages_extracted = 0
+
+    def _extract(self, filepath, pagenos: Optional[List[int]], num_pages: int) -> Iterator[Tuple[int, str]]:
+        """Yield (page_no, text) in page order, in parallel for large files."""
+        todo = num_pages if pagenos is None else len(pagenos)
+        if self.workers <= 1 or todo < max(self.min_parallel_pages, 2):
+            yield from extract_pages(filepath, pagenos)
+            return
+
+        pagenos = list(range(num_pages)) if pagenos is None else pagenos
+        # a few ranges per worker so a slow range doesn't stall the others
+        num_ranges = min(todo, self.workers * 4)
+        bounds = [todo * i // num_ranges for i in range(num_ranges + 1)]
+        workers = min(self.workers, num_ranges)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            # at most two ranges per worker in flight, so a slow consumer
+            # doesn't pile up the text of the whole file in memory. Results
+            # are collected in submission order, i.e. page order.
+            pending = deque()
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(_extract_range, filepath, pagenos[start:stop]))
+            while pending:
+                yield from pending.popleft().result()
+
+    def iter_page_texts(self, filepath) -> Iterator[Tuple[int, str]]:
+        """Yield (page_no, text) in page order. With a page cache, unchanged
+        pages are taken from it and only the others are extracted."""
+        self.pages_reused = self.pages_extracted = 0
+        if self.page_cache is None:
+            num_pages = count_pages(filepath) if self.workers > 1 else 0
+            for page in self._extract(filepath, None, num_pages):
+                self.pages_extracted += 1
+                yield page
+            return
+
+        hashes = page_hashes(filepath)
+        cached = [self.page_cache.get_page(page_hash) for page_hash in hashes]
+        missing = [i for i, text in enumerate(cached) if text is None]
+        extracted = self._extract(filepath, missing, len(hashes))
+        for i, text in enumerate(cached):
+            if text is None:
+                page_no, text = next(extracted)
+                self.page_cache.put_page(hashes[i], text)
+                self.pages_extracted += 1
+            else:
+                page_no = i + 1
+                self.pages_reused += 1
+            yield page_no, text
+
+    def lazy_load_data(
+        self,
+        filepath: Path,
+        on_page: Optional[Callable[[int, int], None]] = None,
+    ) -> Iterator[Document]:
+        """Yield the chunks page by page instead of building the whole list.
+
+        on_page, if given, is called after each page with the number of pages
+        and chunks processed so far.
+        """
+        num_chunks = 0
+        pages = self.iter_page_texts(filepath)
+        split = self._merge_pages if self.merge_pages else self._split_pages
+        for document, page_no in split(pages):
+            if document is not None:
+                num_chunks += 1
+                yield document
+            elif on_page is not None:
+                on_page(page_no, num_chunks)
+
+    def _split_pages(self, pages: Iterator[Tuple[int, str]]) -> Iterator[Tuple[Optional[Document], int]]:
+        """Split each page on its own. Yields (document, page_no), with a None
+        document after each page."""
+        for page_no, text in pages:
+            for t in self.splitter.split_text(text):
+                yield Document(t, extra_info={"page_no": page_no}), page_no
+            yield None, page_no
+
+    def _merge_pages(self, pages: Iterator[Tuple[int, str]]) -> Iterator[Tuple[Optional[Document], int]]:
+        """Pack the page chunks greedily into chunks of up to chunk_size
+        tokens. Yields (document, page_no), with a None document after
+        each page."""
+        encoding = get_encoding(SPLITTER_ENCODING)
+        parts, tokens, start_page = [], 0, 0
+
+        def flush(end_page):
+            return Document(
+                "\n".join(parts),
+                extra_info={"page_no": start_page, "start_page": start_page, "end_page": end_page},
+            )
+
+        last_page = 0
+        for page_no, text in pages:
+            for chunk in self.splitter.split_text(text):
+                # +1 for the joining newline
+                num_tokens = len(encoding.encode(chunk, disallowed_special=())) + 1
+                if parts and tokens + num_tokens > self.chunk_size:
+                    yield flush(last_page), page_no
+                    parts, tokens = [], 0
+                if not parts:
+                    start_page = page_no
+                parts.append(chunk)
+                tokens += num_tokens
+                last_page = page_no
+            yield None, page_no
+        if parts:
+            yield flush(last_page), last_page
+            yield None, last_page
+
+    def load_data(
+        self,
+        filepath: Path,
+        filename,
+        on_page: Optional[Callable[[int, int], None]] = None,
+    ) -> List[Document]:
+        """Parse file.
 
-        shutil.copy2(filepath, f"{staticPath}/file/{filename}")
+        on_page, if given, is called after each page with the number of pages
+        and chunks processed so far.
+        """
+        document_list = list(self.lazy_load_data(filepath, on_page=on_page))
 
         return document_list
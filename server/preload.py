@@ -0,0 +1,79 @@
+# encoding: utf-8
+"""Heavy imports of the server, loaded ahead of the first request.
+
+The app only imports what every route needs. llama_index, the pdf loader,
+wiktionaryparser and the UnstructuredReader of the llama hub are loaded by
+the first request that needs them. `preload()` loads all of them at once:
+gunicorn.conf.py runs it in the master before the workers are forked, so
+they share these read-only pages instead of importing them again each.
+
+Only modules without state are loaded here. The app itself (sqlite
+connections, background threads, the ingest queue) is still imported in
+each worker after the fork.
+
+Startup time, per step and up to the first request:
+    python preload.py
+    python preload.py --lazy
+    python -X importtime -c "import app" 2> importtime.log
+"""
+
+import argparse
+import importlib
+import time
+
+# stateless modules that are slow to import
+MODULES = (
+    "numpy",
+    "aiohttp",
+    "llama_index",
+    "pdf_loader",
+    "wiktionaryparser",
+    "summarizer",
+)
+
+
+def preload(verbose=False):
+    """Import MODULES, resolve the UnstructuredReader and build the chat
+    tokenizer. Failures are only printed, the routes load them again."""
+    def step(name, load):
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            print(f"preload {name} failed:", e)
+            return
+        if verbose:
+            print(f"preload {name}: {time.perf_counter() - start:.3f}s")
+
+    for module in MODULES:
+        step(module, lambda: importlib.import_module(module))
+
+    def unstructured_reader():
+        from summarizer import get_unstructured_reader
+        get_unstructured_reader()
+
+    def chat_tokenizer():
+        from tokenizer import CHAT_ENCODING, get_encoding
+        get_encoding(CHAT_ENCODING)
+
+    step("UnstructuredReader", unstructured_reader)
+    step("tokenizer", chat_tokenizer)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the server startup")
+    parser.add_argument("--lazy", action="store_true", help="don't preload, like flask run / uvicorn")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if not args.lazy:
+        preload(verbose=True)
+    loaded = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    response = app.app.test_client().get("/api/file-list")
+    done = time.perf_counter()
+    print(f"preload: {loaded - start:.3f}s")
+    print(f"import app: {imported - loaded:.3f}s")
+    print(f"first request: {done - imported:.3f}s (status {response.status_code})")
+    print(f"total: {done - start:.3f}s")
@@ -0,0 +1,241 @@
+# encoding: utf-8
+"""Cache of GPT answers for the non-open query types.
+
+Explain, exemplify, detect and simplify only send the system message and the
+filled prompt template, so the answer only depends on the query type, the
+query, the major, the model and the template. Answers are cached by a hash of
+those, in memory with a size bound (LRU by bytes).
+
+Concurrent identical requests are de-duplicated (single-flight): the first
+one streams from the api while the others wait for it and replay its answer.
+The upstream call is opened before the answer is returned, so an api error
+still reaches the client as the error json rather than as an empty stream.
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from streaming import aiter_chunks
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def make_key(type, query, major, model, version):
+    raw = "\x1f".join([type, normalize_query(query), major or "", model, str(version)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One upstream call that other requests can wait for."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+
+
+class _Recording:
+    """The leader's answer, passed through while it is collected. The flight
+    lands when the answer ends, fails, is closed or is dropped unread, so
+    the identical requests waiting for it never hang."""
+    def __init__(self, cache, key, flight, chunks):
+        self._cache = cache
+        self._key = key
+        self._flight = flight
+        self._chunks = iter(chunks)
+        self._parts = []
+        self._landed = False
+
+    def _finish(self, complete):
+        if not self._landed:
+            self._landed = True
+            self._cache._land(self._key, self._flight, self._parts, complete)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._finish(True)
+            raise
+        except BaseException:
+            self._finish(False)
+            raise
+        self._parts.append(chunk)
+        return chunk
+
+    def close(self):
+        self._finish(False)
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self):
+        self._finish(False)
+
+
+class _ARecording(_Recording):
+    """Async version of `_Recording`."""
+    def __init__(self, cache, key, flight, chunks):
+        super().__init__(cache, key, flight, ())
+        self._chunks = chunks.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._finish(True)
+            raise
+        except BaseException:
+            self._finish(False)
+            raise
+        self._parts.append(chunk)
+        return chunk
+
+    async def aclose(self):
+        self._finish(False)
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+class ResponseCache:
+    """
+    Args:
+        max_bytes: max total size of the cached answers
+        replay_chunk_size: size of the chunks a cached answer is streamed in
+        wait_timeout: seconds a request waits for an identical one in flight
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, replay_chunk_size=64,
+                 wait_timeout=120):
+        self.max_bytes = max_bytes
+        self.replay_chunk_size = replay_chunk_size
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._size = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.encode("utf-8"))
+            self._entries[key] = text
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.encode("utf-8"))
+
+    def replay(self, text):
+        size = self.replay_chunk_size
+        for i in range(0, len(text), size):
+            yield text[i:i + size]
+
+    def _join(self, key):
+        """Return (flight, is_leader) for key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _land(self, key, flight, parts, complete):
+        if complete:
+            flight.text = "".join(parts)
+            self.put(key, flight.text)
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.done.set()
+
+    def _lookup(self, key):
+        text = self.get(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def open(self, key, produce):
+        """Return an iterator of the answer for key: from the cache, from an
+        identical request in flight, or from `produce()` (which opens the
+        upstream call and returns an iterator of text chunks). The upstream
+        call is made, or the identical request waited for, before this
+        returns, so its errors are raised here and not in the middle of a
+        stream that already started."""
+        text = self._lookup(key)
+        if text is not None:
+            return self.replay(text)
+
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait(self.wait_timeout)
+            if flight.text is not None:
+                self.shared += 1
+                return self.replay(flight.text)
+            # the other request failed or was cancelled, ask ourselves
+            return produce()
+
+        try:
+            chunks = produce()
+        except BaseException:
+            self._land(key, flight, [], False)
+            raise
+        return _Recording(self, key, flight, chunks)
+
+    async def aopen(self, key, aproduce):
+        """Async version of `open`, returns an async iterator. `aproduce()`
+        is awaited and returns an async iterator of text chunks."""
+        text = self._lookup(key)
+        if text is not None:
+            return aiter_chunks(self.replay(text))
+
+        flight, leader = self._join(key)
+        if not leader:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, flight.done.wait, self.wait_timeout)
+            if flight.text is not None:
+                self.shared += 1
+                return aiter_chunks(self.replay(flight.text))
+            return await aproduce()
+
+        try:
+            chunks = await aproduce()
+        except BaseException:
+            self._land(key, flight, [], False)
+            raise
+        return _ARecording(self, key, flight, chunks)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+            }
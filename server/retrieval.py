@@ -0,0 +1,139 @@
+# encoding: utf-8
+"""Top-k retrieval of document chunks for open questions.
+
+The chunk embeddings of an index are a memory-mapped matrix (see
+vector_store), a query is scored against all of them with one matvec and
+the best k are picked with argpartition, which is linear in the number of
+chunks instead of sorting them all. That ranking can be fused with the BM25
+ranking of the query text (see lexical_index).
+"""
+
+import os
+import threading
+
+import numpy as np
+from lexical_index import LexicalIndex, lexical_path
+from vector_store import VectorIndex, index_prefix
+
+
+def scores_of(matrix, vector, block_rows=4096):
+    """Dot product of every row with vector, in float32."""
+    vector = vector.astype(np.float32, copy=False)
+    if matrix.dtype == np.float32:
+        return matrix @ vector
+    # numpy has no BLAS for float16, upcasting block by block is ~3x faster
+    # than the float16 matvec and bounds the extra memory
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        block = matrix[start:start + block_rows]
+        scores[start:start + len(block)] = block.astype(np.float32) @ vector
+    return scores
+
+
+def top_k(matrix, vector, k):
+    """Return (rows, scores) of the k rows of matrix with the highest dot
+    product with vector, best first."""
+    return best_of(scores_of(matrix, vector), k)
+
+
+def best_of(scores, k):
+    """Return (positions, scores) of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+    if k < len(scores):
+        rows = np.argpartition(scores, len(scores) - k)[-k:]
+    else:
+        rows = np.arange(len(scores))
+    # only the k winners are sorted
+    rows = rows[np.argsort(scores[rows])[::-1]]
+    return rows, scores[rows]
+
+
+def fuse(rankings, k, c=60):
+    """Reciprocal rank fusion: rows ranked by the sum of 1 / (c + rank) over
+    the rankings (arrays of rows, best first). Ranks, unlike the cosine and
+    BM25 scores, are comparable."""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (c + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:k]
+
+
+class Retriever:
+    """
+    Args:
+        k: number of chunks returned per query
+        min_score: chunks with a lower cosine similarity are left out of
+            the vector ranking
+        hybrid: fuse the vector ranking with the BM25 ranking of the query
+            text when the document has a lexical index
+        fanout: candidates taken from each ranking before fusing, per chunk
+            returned
+    """
+    def __init__(self, k=4, min_score=0.0, hybrid=True, fanout=4):
+        self.k = k
+        self.min_score = min_score
+        self.hybrid = hybrid
+        self.fanout = fanout
+        # name -> (mtime of the metadata, VectorIndex, LexicalIndex or None),
+        # reopened when the document is indexed again
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name):
+        meta_path = f"{index_prefix(name)}.json"
+        try:
+            mtime = os.path.getmtime(meta_path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._indexes.get(name)
+            if cached is not None and cached[0] == mtime:
+                return cached
+        try:
+            index = VectorIndex.load(name)
+        except ValueError as e:
+            # a json index from before the binary format
+            print(e)
+            return None
+        lexical = None
+        if os.path.exists(lexical_path(name)):
+            lexical = LexicalIndex.load(name)
+            if len(lexical) != len(index):
+                # left from an earlier build
+                lexical = None
+        cached = (mtime, index, lexical)
+        with self._lock:
+            self._indexes[name] = cached
+        return cached
+
+    def get_index(self, name):
+        """The index of a document, None if it isn't built (yet)."""
+        cached = self._get(name)
+        return cached[1] if cached is not None else None
+
+    def search(self, name, vector, k=None, query=None):
+        """Return the best chunks of the document for a query embedding (and
+        the query text, for the hybrid ranking), as dicts with the text, the
+        cosine similarity as score and the extra_info (page_no, ...)."""
+        cached = self._get(name) if name else None
+        if cached is None or len(cached[1]) == 0:
+            return []
+        _, index, lexical = cached
+        k = k or self.k
+        hybrid = self.hybrid and lexical is not None and query
+        scores = scores_of(index.vectors, np.asarray(vector, dtype=np.float32))
+        rows, _ = best_of(scores, k * self.fanout if hybrid else k)
+        rows = rows[scores[rows] >= self.min_score]
+        if hybrid:
+            lexical_rows, lexical_scores = best_of(lexical.scores(query), k * self.fanout)
+            rows = fuse([rows, lexical_rows[lexical_scores > 0]], k)
+        return [{**index.extra_info[row], "text": index.text(row),
+                 "score": round(float(scores[row]), 4)}
+                for row in rows]
+
+    def forget(self, name):
+        with self._lock:
+            self._indexes.pop(name, None)
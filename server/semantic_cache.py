@@ -0,0 +1,174 @@
+# encoding: utf-8
+"""Near-duplicate answer cache based on query embeddings.
+
+Students select slightly different spans for the same thing ("eigenvalue",
+"eigenvalues", "the eigenvalue of"), which the exact response cache misses.
+This cache embeds the query and looks for a stored query of the same type and
+major with a cosine similarity above the threshold.
+
+Storage is append-only: the normalized float32 query vectors go to a raw
+`.f32` file that is memory-mapped for search, and the answers go to a JSONL
+sidecar, each line with the row of its vector. After a restart only the
+sidecar is parsed, the vectors are paged in by the OS when searched.
+
+Every worker process appends to the same files. Appends hold an exclusive
+flock on the sidecar, so a vector and its line are written together, and
+each process reads the lines the others appended when the sidecar grows.
+Answers are scoped by model and prompt version too, so a template change
+doesn't replay the answers of the old one.
+"""
+
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+staticPath = "static"
+
+
+class SemanticCache:
+    """
+    Args:
+        embed: maps a list of texts to a list of vectors
+        path: prefix of the .f32 and .jsonl files
+        dim: embedding size
+        threshold: min cosine similarity for a hit
+        types: query types served by the cache
+        model: model the answers come from, part of the scope
+        prompt_version: version of the prompt templates, part of the scope
+    """
+    def __init__(self,
+                 embed=None,
+                 path=f"{staticPath}/cache/semantic",
+                 dim=1536,
+                 threshold=0.95,
+                 types=("explain", "simplify"),
+                 model="",
+                 prompt_version=0):
+        self.embed = embed
+        self.dim = dim
+        self.threshold = threshold
+        self.types = set(types)
+        self.model = model
+        self.prompt_version = prompt_version
+        self.vectors_path = f"{path}.f32"
+        self.meta_path = f"{path}.jsonl"
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        # row of the vectors file -> answer
+        self._answers = {}
+        # scope -> rows
+        self._scopes = {}
+        # bytes and lines of the sidecar read so far
+        self._meta_offset = 0
+        self._meta_lines = 0
+        self._matrix = None
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._refresh()
+
+    @property
+    def _row_bytes(self):
+        return 4 * self.dim
+
+    def _refresh(self):
+        """Read the lines appended to the sidecar since the last call, by
+        this process or another one. A line that is still being written
+        (no newline yet) is read next time."""
+        try:
+            if os.path.getsize(self.meta_path) <= self._meta_offset:
+                return
+        except FileNotFoundError:
+            return
+        with open(self.meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            item = json.loads(line)
+            # lines written before rows were recorded are in row order
+            row = item.get("row", self._meta_lines)
+            self._meta_lines += 1
+            self._scopes.setdefault(item["scope"], []).append(row)
+            self._answers[row] = item["answer"]
+        self._meta_offset += end
+
+    def _rows(self):
+        """The memory-mapped vectors, remapped when rows were appended."""
+        if not self._answers:
+            return None
+        n = os.path.getsize(self.vectors_path) // self._row_bytes
+        if self._matrix is None or self._matrix.shape[0] != n:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32,
+                                     mode="r", shape=(n, self.dim))
+        return self._matrix
+
+    def scope(self, type, major):
+        return f"{self.model}|{self.prompt_version}|{type}|{major or ''}"
+
+    def vectorize(self, query):
+        return self.vectorize_embedding(self.embed([query])[0])
+
+    @staticmethod
+    def vectorize_embedding(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, type, major, vector):
+        """Cached answer of the most similar query, None below the threshold."""
+        with self._lock:
+            self._refresh()
+            rows = self._scopes.get(self.scope(type, major))
+            matrix = self._rows()
+            if not rows or matrix is None:
+                self.misses += 1
+                return None
+            # a copy: the list grows under the lock
+            rows = np.array(rows)
+        # only the rows of the scope, outside the lock so lookups run in
+        # parallel (the mapping is read-only, rows are only appended)
+        scores = matrix[rows] @ vector
+        best = int(np.argmax(scores))
+        hit = scores[best] >= self.threshold
+        with self._lock:
+            if hit:
+                self.hits += 1
+                return self._answers[int(rows[best])]
+            self.misses += 1
+            return None
+
+    def add(self, type, major, vector, answer):
+        scope = self.scope(type, major)
+        with self._lock:
+            with open(self.meta_path, "a", encoding="utf-8") as meta:
+                # one writer at a time across processes, the vector's row is
+                # only known under the lock
+                fcntl.flock(meta, fcntl.LOCK_EX)
+                try:
+                    with open(self.vectors_path, "ab") as f:
+                        size = os.fstat(f.fileno()).st_size
+                        # drop a partial row left by a crash
+                        if size % self._row_bytes:
+                            size -= size % self._row_bytes
+                            f.truncate(size)
+                        f.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    meta.write(json.dumps({"row": size // self._row_bytes, "scope": scope,
+                                           "answer": answer}) + "\n")
+                    meta.flush()
+                finally:
+                    fcntl.flock(meta, fcntl.LOCK_UN)
+            self._refresh()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._answers),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,106 @@
+"""Bounded cache of live DialogManager instances.
+
+Sessions are keyed by (session id, document). The history of every session
+lives in sqlite, so an evicted DialogManager is simply rebuilt by the factory
+the next time the session is used.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionCache:
+    """
+    Thread-safe LRU cache with an idle TTL.
+    Args:
+        factory: called with the key (and the extra arguments of get) to
+            build a missing value
+        max_entries: max number of live sessions, least recently used go first
+        ttl: seconds a session may stay unused before it is dropped, 0 = never
+        on_evict: called with each value dropped from the cache
+    """
+    def __init__(self, factory, max_entries=256, ttl=3600, on_evict=None):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (value, last used)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, now):
+        """Pop the idle entries, returns their values."""
+        expired = []
+        if not self.ttl:
+            return expired
+        # the oldest entries come first, stop at the first fresh one
+        while self._entries:
+            key, (value, last_used) = next(iter(self._entries.items()))
+            if now - last_used <= self.ttl:
+                break
+            del self._entries[key]
+            expired.append(value)
+            self.expirations += 1
+        return expired
+
+    def _dropped(self, values):
+        # outside the lock, closing may touch sqlite
+        if self.on_evict is not None:
+            for value in values:
+                self.on_evict(value)
+
+    def get(self, key, **kwargs):
+        now = time.monotonic()
+        with self._lock:
+            dropped = self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+        self._dropped(dropped)
+        if entry is not None:
+            return entry[0]
+
+        # build outside the lock, it reads the history from sqlite
+        value = self.factory(key, **kwargs)
+        dropped = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # another request built it first, use theirs
+                dropped.append(value)
+                value = entry[0]
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, (old_value, _) = self._entries.popitem(last=False)
+                dropped.append(old_value)
+                self.evictions += 1
+        self._dropped(dropped)
+        return value
+
+    def invalidate(self, match):
+        """Drop every entry whose key satisfies `match(key)`."""
+        with self._lock:
+            dropped = [self._entries.pop(key)[0]
+                       for key in [key for key in self._entries if match(key)]]
+        self._dropped(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
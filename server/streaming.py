@@ -0,0 +1,153 @@
+"""Helpers for streaming GPT answers back to the client.
+
+The client expects a JSON header, the ``###endjson###`` marker and then the
+answer text in as many chunks as we like (see chatWindow/index.tsx).
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+END_JSON_MARKER = "\n ###endjson### \n\n"
+
+# Server-side coalescing of upstream deltas. With both set to 0 (the default)
+# every delta is flushed as soon as it arrives. Otherwise deltas are buffered
+# until either COALESCE_BYTES are pending or COALESCE_MS have passed since the
+# first pending delta, so we don't send one tiny HTTP chunk per token.
+COALESCE_BYTES = int(os.environ.get("STREAM_COALESCE_BYTES", "0"))
+COALESCE_MS = float(os.environ.get("STREAM_COALESCE_MS", "0"))
+
+
+def iter_openai_deltas(events: Iterable) -> Iterator[str]:
+    """Yield the text content of each `ChatCompletion.create(stream=True)` event."""
+    for event in events:
+        delta = event["choices"][0]["delta"]
+        answer = delta.get("content", "")
+        if answer:
+            yield answer
+
+
+async def aiter_openai_deltas(events: AsyncIterable) -> AsyncIterator[str]:
+    """Async version of `iter_openai_deltas` for `LLMClient.achat`."""
+    async for event in events:
+        delta = event["choices"][0]["delta"]
+        answer = delta.get("content", "")
+        if answer:
+            yield answer
+
+
+async def aiter_chunks(chunks: Iterable[str]) -> AsyncIterator[str]:
+    """Turn an in-memory iterator of chunks into an async one."""
+    for chunk in chunks:
+        yield chunk
+
+
+def coalesce(
+    chunks: Iterable[str],
+    max_bytes: int = COALESCE_BYTES,
+    max_delay_ms: float = COALESCE_MS,
+) -> Iterator[str]:
+    """Group small text chunks by byte size or time window.
+
+    The time window is only checked when a new chunk arrives, so a slow
+    upstream never makes us hold text back longer than one delta.
+    """
+    if max_bytes <= 0 and max_delay_ms <= 0:
+        yield from chunks
+        return
+
+    pending = []
+    pending_bytes = 0
+    first_at = 0.0
+    for chunk in chunks:
+        if not pending:
+            first_at = time.monotonic()
+        pending.append(chunk)
+        pending_bytes += len(chunk.encode("utf-8"))
+        if (max_bytes > 0 and pending_bytes >= max_bytes) or (
+            max_delay_ms > 0 and (time.monotonic() - first_at) * 1000 >= max_delay_ms
+        ):
+            yield "".join(pending)
+            pending = []
+            pending_bytes = 0
+    if pending:
+        yield "".join(pending)
+
+
+def stream_answer(
+    chunks: Iterable[str],
+    on_complete: Optional[Callable[[str], None]] = None,
+    cost=0,
+    sources="",
+) -> Iterator[str]:
+    """Yield the header, the marker and the answer chunks.
+
+    The full answer is collected with a list and joined once at the end, then
+    handed to `on_complete` (e.g. `DialogManager.collect_response`).
+    """
+    yield json.dumps({"cost": cost, "sources": sources})
+    yield END_JSON_MARKER
+    parts = []
+    for text in coalesce(chunks):
+        parts.append(text)
+        yield text
+    if on_complete is not None:
+        on_complete("".join(parts))
+
+
+async def acoalesce(
+    chunks: AsyncIterable[str],
+    max_bytes: int = COALESCE_BYTES,
+    max_delay_ms: float = COALESCE_MS,
+) -> AsyncIterator[str]:
+    """Async version of `coalesce`."""
+    pending = []
+    pending_bytes = 0
+    first_at = 0.0
+    async for chunk in chunks:
+        if max_bytes <= 0 and max_delay_ms <= 0:
+            yield chunk
+            continue
+        if not pending:
+            first_at = time.monotonic()
+        pending.append(chunk)
+        pending_bytes += len(chunk.encode("utf-8"))
+        if (max_bytes > 0 and pending_bytes >= max_bytes) or (
+            max_delay_ms > 0 and (time.monotonic() - first_at) * 1000 >= max_delay_ms
+        ):
+            yield "".join(pending)
+            pending = []
+            pending_bytes = 0
+    if pending:
+        yield "".join(pending)
+
+
+async def astream_answer(
+    chunks: AsyncIterable[str],
+    on_complete: Optional[Callable[[str], None]] = None,
+    cost=0,
+    sources="",
+) -> AsyncIterator[str]:
+    """Async version of `stream_answer`.
+
+    `on_complete` usually writes to sqlite, so it runs in the default executor
+    to keep the event loop free for the other streams.
+    """
+    yield json.dumps({"cost": cost, "sources": sources})
+    yield END_JSON_MARKER
+    parts = []
+    async for text in acoalesce(chunks):
+        parts.append(text)
+        yield text
+    if on_complete is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, on_complete, "".join(parts))
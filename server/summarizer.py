@@ -0,0 +1,248 @@
+# encoding: utf-8
+"""Document summaries for /api/summarize.
+
+A summary only depends on the file content and the prompts, so it is cached
+in the manifest by (file hash, prompt version) and a cached one costs
+nothing. Otherwise the summary is a map-reduce over the document:
+- map: the text is cut into chunks of at most chunk_tokens and every chunk
+  is summarized on its own, concurrently in a bounded pool of workers
+- reduce: the partial summaries are summarized with the final prompt, and
+  that answer is streamed to the client (if they don't fit in one request
+  they are mapped again first)
+A document that fits in one chunk goes straight to the reduce step.
+
+The cost is estimated from the token counts of these requests, nothing is
+sent to the api for it.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
+from llm_client import llm_client
+from manifest import hash_file
+from streaming import aiter_chunks, aiter_openai_deltas, iter_openai_deltas
+from tokenizer import CHAT_ENCODING, count_tokens, get_encoding
+
+# bump when the prompts change, it invalidates the cached summaries
+SUMMARY_VERSION = 1
+
+SYSTEM_PROMPT = "You summarize documents for students."
+
+MAP_PROMPT = """
+    Summarize this part of a document in a few sentences. Keep the key terms, names and numbers.
+
+    {text}
+    """
+
+# TODO: Format everything as markdown
+SUMMARY_PROMPT = """
+    Summarize this document and provide three questions related to the summary. Try to use your own words when possible. Keep your answer under 5 sentences.
+
+    Use the following format:
+    <summary text>
+
+
+    Questions you may want to ask 🤔
+    1. <question text>
+    2. <question text>
+    3. <question text>
+
+    {text}
+    """
+
+
+@lru_cache(maxsize=None)
+def get_unstructured_reader():
+    """The UnstructuredReader of the llama hub. download_loader reads the
+    loader library and checks its requirements on every call (and downloads
+    it the first time), so it is resolved once per process, or once in the
+    gunicorn master (see preload.py)."""
+    from llama_index import download_loader
+
+    return download_loader("UnstructuredReader")()
+
+
+def load_texts(filepath, page_cache=None) -> List[str]:
+    """Text of a file, one string per page for PDFs. The pages of an indexed
+    PDF are usually all in the page cache already."""
+    if str(filepath).lower().endswith(".pdf"):
+        # imports llama_index, only when a summary isn't cached
+        from pdf_loader import CJKPDFReader
+
+        # in the server process, no extraction pool
+        reader = CJKPDFReader(workers=1, page_cache=page_cache)
+        return [text for _, text in reader.iter_page_texts(filepath)]
+    return [document.text for document in get_unstructured_reader().load_data(file=Path(filepath))]
+
+
+def split_chunks(texts, max_tokens) -> List[str]:
+    """Pack consecutive texts into chunks of at most max_tokens, texts that
+    are too long on their own are cut."""
+    encoding = get_encoding(CHAT_ENCODING)
+    chunks, current, size = [], [], 0
+    for text in texts:
+        tokens = encoding.encode(text, disallowed_special=())
+        if not tokens:
+            continue
+        if len(tokens) > max_tokens:
+            pieces = [(encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens]))
+                      for i in range(0, len(tokens), max_tokens)]
+        else:
+            pieces = [(text, len(tokens))]
+        for piece, piece_size in pieces:
+            if current and size + piece_size > max_tokens:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += piece_size
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _messages(prompt, text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt.format(text=text)},
+    ]
+
+
+class Summarizer:
+    """
+    Args:
+        cache: store of summaries by (file hash, version), e.g.
+            manifest.Manifest, None disables the cache
+        workers: max chunks summarized at the same time, shared by all the
+            requests
+        chunk_tokens: max tokens of document text per request
+        map_tokens: max tokens of each partial summary
+        summary_tokens: max tokens of the final summary
+        model: chat model of both steps
+    """
+    def __init__(self, cache=None, workers=4, chunk_tokens=3000, map_tokens=256,
+                 summary_tokens=512, model="gpt-3.5-turbo"):
+        self.cache = cache
+        self.workers = workers
+        self.chunk_tokens = chunk_tokens
+        self.map_tokens = map_tokens
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.version = f"{SUMMARY_VERSION}:{model}"
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarize")
+        # created on first use, it belongs to the running event loop
+        self._semaphore = None
+
+    def estimate_cost(self, chunks):
+        """Tokens sent and received to summarize the chunks."""
+        cost = 0
+        while len(chunks) > 1:
+            cost += sum(count_tokens(MAP_PROMPT.format(text=chunk)) + self.map_tokens
+                        for chunk in chunks)
+            # the partial summaries, assuming they use all their tokens
+            chunks = [" ".join(["token"] * self.map_tokens)] * len(chunks)
+            chunks = split_chunks(chunks, self.chunk_tokens)
+        text = chunks[0] if chunks else ""
+        return cost + count_tokens(SUMMARY_PROMPT.format(text=text)) + self.summary_tokens
+
+    def _prepare(self, filepath):
+        """(file hash, cached summary or None, chunks, cost)"""
+        file_hash = hash_file(filepath)
+        if self.cache is not None:
+            summary = self.cache.get_summary(file_hash, self.version)
+            if summary is not None:
+                return file_hash, summary, [], 0
+        chunks = split_chunks(load_texts(filepath, page_cache=self.cache), self.chunk_tokens)
+        return file_hash, None, chunks, self.estimate_cost(chunks)
+
+    def _save(self, file_hash, parts):
+        if self.cache is not None and parts:
+            self.cache.put_summary(file_hash, self.version, "".join(parts))
+
+    # -- sync
+
+    def _summarize_chunk(self, chunk, api_key):
+        response = llm_client.chat(
+            _messages(MAP_PROMPT, chunk),
+            model=self.model,
+            temperature=0.2,
+            max_tokens=self.map_tokens,
+            api_key=api_key,
+        )
+        return response["choices"][0]["message"]["content"]
+
+    def summarize(self, filepath, api_key=None):
+        """Returns the estimated cost and an iterator of the summary text
+        chunks. The map step runs when the iterator is first read, so the
+        cost can be sent to the client before."""
+        file_hash, summary, chunks, cost = self._prepare(filepath)
+        if summary is not None:
+            return cost, iter([summary])
+
+        def generate():
+            nonlocal chunks
+            while len(chunks) > 1:
+                partials = list(self._pool.map(
+                    lambda chunk: self._summarize_chunk(chunk, api_key), chunks))
+                chunks = split_chunks(partials, self.chunk_tokens)
+            parts = []
+            for text in iter_openai_deltas(llm_client.chat(
+                    _messages(SUMMARY_PROMPT, chunks[0] if chunks else ""),
+                    model=self.model,
+                    temperature=0.2,
+                    max_tokens=self.summary_tokens,
+                    stream=True,
+                    api_key=api_key)):
+                parts.append(text)
+                yield text
+            self._save(file_hash, parts)
+
+        return cost, generate()
+
+    # -- async
+
+    async def _asummarize_chunk(self, chunk, api_key):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            response = await llm_client.achat(
+                model=self.model,
+                messages=_messages(MAP_PROMPT, chunk),
+                temperature=0.2,
+                max_tokens=self.map_tokens,
+                api_key=api_key,
+            )
+        return response["choices"][0]["message"]["content"]
+
+    async def asummarize(self, filepath, api_key=None):
+        """Async version of `summarize` for the ASGI app, the summary is an
+        async iterator. Reading and hashing the file runs in a thread."""
+        loop = asyncio.get_running_loop()
+        file_hash, summary, chunks, cost = await loop.run_in_executor(
+            None, self._prepare, filepath)
+        if summary is not None:
+            return cost, aiter_chunks([summary])
+
+        async def generate():
+            nonlocal chunks
+
+            while len(chunks) > 1:
+                partials = await asyncio.gather(
+                    *(self._asummarize_chunk(chunk, api_key) for chunk in chunks))
+                chunks = split_chunks(partials, self.chunk_tokens)
+            response = await llm_client.achat(
+                model=self.model,
+                messages=_messages(SUMMARY_PROMPT, chunks[0] if chunks else ""),
+                temperature=0.2,
+                max_tokens=self.summary_tokens,
+                stream=True,
+                api_key=api_key)
+            parts = []
+            async for text in aiter_openai_deltas(response):
+                parts.append(text)
+                yield text
+            await loop.run_in_executor(None, self._save, file_hash, parts)
+
+        return cost, generate()
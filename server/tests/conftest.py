@@ -0,0 +1,15 @@
+# the server modules are flat, importable from server/
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# modules create their databases under static/ of the working directory at
+# import, keep them out of the tree
+_workdir = tempfile.mkdtemp(prefix="cl-pdfviewer-tests-")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.chdir(_workdir)
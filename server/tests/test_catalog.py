@@ -0,0 +1,162 @@
+import os
+
+import pytest
+
+from catalog import Catalog
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    yield catalog
+    catalog.close()
+
+
+def names(rows):
+    return [row["full_name"] for row in rows]
+
+
+def pages(catalog, limit, **kwargs):
+    """Every page of a listing, by keyset."""
+    result, after = [], None
+    while True:
+        page = catalog.list(after=after, limit=limit, **kwargs)
+        if not page:
+            return result
+        result.append(names(page))
+        after = page[-1]["full_name"]
+
+
+def test_keyset_pages_across_equal_sort_keys(catalog):
+    # same sort_key "syntax", told apart by full_name
+    for full_name in ["Syntax.pdf", "syntax.docx", "syntax.pdf", "SYNTAX.md", "morphology.pdf",
+                      "phonology.pdf", "syntax 2.pdf"]:
+        catalog.put(full_name, size=1)
+    expected = names(catalog.list())
+    assert expected == ["morphology.pdf", "phonology.pdf", "SYNTAX.md", "Syntax.pdf",
+                        "syntax.docx", "syntax.pdf", "syntax 2.pdf"]
+    for limit in (1, 2, 3):
+        result = pages(catalog, limit)
+        assert [name for page in result for name in page] == expected
+        assert all(len(page) <= limit for page in result)
+    # a page that starts in the middle of the equal keys
+    assert names(catalog.list(after="Syntax.pdf", limit=2)) == ["syntax.docx", "syntax.pdf"]
+
+
+def test_prefix_ranges(catalog):
+    for full_name in ["Morpheme.pdf", "morphology.pdf", "mora.pdf", "phoneme.pdf", "形態素.pdf",
+                      "形態論.pdf"]:
+        catalog.put(full_name, size=1)
+    assert names(catalog.list(prefix="MORPH")) == ["Morpheme.pdf", "morphology.pdf"]
+    assert names(catalog.list(prefix="mor", after="Morpheme.pdf")) == ["morphology.pdf"]
+    assert names(catalog.list(prefix="形態")) == ["形態素.pdf", "形態論.pdf"]
+    assert catalog.list(prefix="x") == []
+    # after a name outside the prefix
+    assert names(catalog.list(prefix="mor", after="a.pdf")) == \
+        ["mora.pdf", "Morpheme.pdf", "morphology.pdf"]
+    assert catalog.list(prefix="mor", after="z.pdf") == []
+
+
+def test_list_indexed(catalog):
+    for full_name in ["a.pdf", "b.pdf", "c.pdf"]:
+        catalog.put(full_name, size=1)
+    catalog.update("a.pdf", indexed=1)
+    catalog.update("c.pdf", indexed=1)
+    assert catalog.list_indexed() == ["a", "c"]
+    assert catalog.list_indexed(after="a.pdf", limit=1) == ["c"]
+
+
+def test_sync_adds_removes_and_fixes_flags(catalog, tmp_path):
+    file_dir, index_dir = tmp_path / "file", tmp_path / "index"
+    file_dir.mkdir()
+    index_dir.mkdir()
+    for name in ["kept", "copied", "unindexed"]:
+        (file_dir / f"{name}.pdf").write_bytes(b"%PDF" * 10)
+    (index_dir / "copied.json").write_text("{}")
+    catalog.put("kept.pdf", size=40)
+    catalog.put("unindexed.pdf", size=40)
+    catalog.update("unindexed.pdf", indexed=1)
+    catalog.put("deleted.pdf", size=1)
+
+    assert catalog.sync(str(file_dir), str(index_dir)) == 3
+    assert names(catalog.list()) == ["copied.pdf", "kept.pdf", "unindexed.pdf"]
+    assert catalog.get("copied.pdf")["indexed"] == 1
+    assert catalog.get("copied.pdf")["size"] == 40
+    assert catalog.get("unindexed.pdf")["indexed"] == 0
+    # nothing left to fix
+    assert catalog.sync(str(file_dir), str(index_dir)) == 0
+
+
+def test_changes_bump_the_version(catalog, tmp_path):
+    version = catalog.version()
+
+    def bumped():
+        nonlocal version
+        old, version = version, catalog.version()
+        return version > old
+
+    catalog.put("a.pdf", size=1)
+    assert bumped()
+    assert catalog.update("a.pdf", pages=3) and bumped()
+    assert not catalog.update("missing.pdf", pages=3) and not bumped()
+    catalog.remove("missing.pdf")
+    assert not bumped()
+    catalog.remove("a.pdf")
+    assert bumped()
+    assert catalog.etag() == f"catalog-{version}"
+    # the version is shared with the other processes through the file
+    other = Catalog(str(tmp_path / "catalog.db"))
+    other.put("b.pdf", size=1)
+    assert bumped()
+    other.close()
+
+
+def test_put_keeps_pages_of_the_same_content(catalog):
+    catalog.put("a.pdf", size=1, file_hash="h1")
+    catalog.update("a.pdf", pages=7, indexed=1)
+    catalog.put("a.pdf", size=1, file_hash="h1")
+    assert catalog.get("a.pdf")["pages"] == 7
+    catalog.put("a.pdf", size=2, file_hash="h2")
+    row = catalog.get("a.pdf")
+    assert row["pages"] is None and row["indexed"] == 1
+    with pytest.raises(ValueError):
+        catalog.update("a.pdf", name="b")
+
+
+@pytest.fixture(scope="module")
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def test_limit_is_checked_and_clamped(client):
+    import app
+
+    for full_name in ["x1.pdf", "x2.pdf", "x3.pdf"]:
+        app.catalog.put(full_name, size=1)
+    assert client.get("/api/file-list?limit=ten").status_code == 400
+    assert client.get("/api/index-list?limit=1.5").status_code == 400
+    assert len(client.get("/api/file-list?prefix=x&limit=0").json) == 1
+    assert len(client.get("/api/file-list?prefix=x&limit=-5").json) == 1
+    assert len(client.get("/api/file-list?prefix=x&limit=99999").json) == 3
+    assert len(client.get("/api/file-list?prefix=x").json) == 3
+
+
+def test_document_without_hash_is_not_hashed(client):
+    import app
+
+    filepath = os.path.join(app.staticPath, "file", "unhashed.pdf")
+    with open(filepath, "wb") as f:
+        f.write(b"%PDF-1.4 " * 100)
+    app.catalog.put("unhashed.pdf", size=os.path.getsize(filepath))
+    stat = os.stat(filepath)
+
+    response = client.get("/static/file/unhashed.pdf")
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    # left to the ingest job
+    assert app.catalog.get("unhashed.pdf")["file_hash"] is None
+
+    app.catalog.update("unhashed.pdf", file_hash="abc123")
+    assert client.get("/static/file/unhashed.pdf").headers["ETag"] == '"abc123"'
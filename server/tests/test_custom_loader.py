@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from bench.bench_custom_loader import make_markdown, old_load_data, to_html
+from custom_loader import CustomReader
+
+SAMPLE = """# Morphology
+
+A morpheme is the smallest unit of meaning. Words are built from morphemes.
+
+- free morphemes stand alone
+- bound morphemes attach to a stem
+
+## Syntax
+
+""" + " ".join(["Constituents combine into phrases and phrases into clauses."] * 120) + """
+
+```python
+tree = parse(sentence)
+```
+
+### Semantics
+
+Meaning is composed from the parts.
+"""
+
+NO_HEADINGS = "<p>First paragraph of a page without headings.</p><p>Second one.</p>"
+
+
+@pytest.fixture(autouse=True)
+def file_dir():
+    os.makedirs("static/file", exist_ok=True)
+
+
+def chunk(load, html, filename):
+    documents = load(html, filename)
+    with open(f"static/file/{filename}.html", encoding="utf-8") as f:
+        markup = f.read()
+    return [(document.text, document.extra_info) for document in documents], markup
+
+
+@pytest.mark.parametrize("html", [to_html(SAMPLE), NO_HEADINGS, to_html(make_markdown(40))],
+                         ids=["sample", "no-headings", "generated"])
+def test_chunks_are_unchanged(html):
+    old, old_markup = chunk(old_load_data, html, "before")
+    new, new_markup = chunk(lambda html, filename: CustomReader().load_data(html=html, filename=filename),
+                            html, "after")
+    assert new == old
+    # the data-chunk_id of every block
+    assert new_markup == old_markup
+    assert "data-chunk_id" in new_markup
@@ -0,0 +1,125 @@
+import json
+import time
+
+import pytest
+
+from definition_cache import DAY, DefinitionCache, normalize
+
+
+class StubParser:
+    """WiktionaryParser.fetch over a dict of titles, counting the calls."""
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def fetch(self, term):
+        self.calls.append(term)
+        if term in self.pages:
+            return [{"definitions": [{"partOfSpeech": "noun", "text": [term, self.pages[term]]}]}]
+        # missing pages come back as an entry without definitions
+        return [{"etymology": "", "definitions": []}]
+
+
+def definition(entries):
+    return entries[0]["definitions"][0]["text"][1]
+
+
+@pytest.fixture
+def parser():
+    return StubParser({
+        "BERT": "a language model",
+        "bert": "a given name",
+        "analyses": "plural of analysis",
+        "analyse": "to examine in detail (verb)",
+        "weight": "a numeric parameter",
+        "context-free grammar": "a formal grammar",
+    })
+
+
+@pytest.fixture
+def cache(parser, tmp_path):
+    return DefinitionCache(fetch=parser.fetch, path=str(tmp_path / "definitions.db"))
+
+
+def test_normalize():
+    assert normalize("  The Eigenvalues. ") == "the eigenvalue"
+    assert normalize("Weights") == "weight"
+    assert normalize("analysis") == "analysis"
+    assert normalize("") == ""
+
+
+def test_fetches_the_selected_term_as_is_first(cache, parser):
+    assert definition(cache.get("BERT")) == "a language model"
+    assert parser.calls == ["BERT"]
+
+
+def test_plural_selection_keeps_its_own_entry(cache, parser):
+    assert definition(cache.get("analyses")) == "plural of analysis"
+    assert parser.calls == ["analyses"]
+
+
+def test_falls_back_to_the_lemma(cache, parser):
+    assert definition(cache.get("Weights.")) == "a numeric parameter"
+    assert parser.calls == ["Weights", "weight"]
+    # the lemma shares the entry
+    assert definition(cache.get("weight")) == "a numeric parameter"
+    assert parser.calls == ["Weights", "weight"]
+
+
+def test_hits_do_not_fetch(cache, parser):
+    cache.get("context-free grammar")
+    cache.get("Context-free grammar ")
+    assert parser.calls == ["context-free grammar"]
+
+
+def test_negative_cache(cache, parser):
+    assert cache.get("nonexistentterm") == []
+    assert cache.get("nonexistentterm") == []
+    assert parser.calls == ["nonexistentterm"]
+
+
+def test_negative_entries_expire_sooner(cache, parser):
+    old = time.time() - 2 * DAY
+    cache.put("nonexistentterm", [], fetched_at=old)
+    cache.put("weight", parser.fetch("weight"), fetched_at=old)
+    parser.calls.clear()
+    assert cache.lookup("nonexistentterm") is None
+    assert cache.lookup("weight") is not None
+    cache.get("nonexistentterm")
+    assert parser.calls == ["nonexistentterm"]
+
+
+def test_persists_across_instances(cache, parser, tmp_path):
+    cache.get("BERT")
+    other = DefinitionCache(fetch=parser.fetch, path=str(tmp_path / "definitions.db"))
+    assert definition(other.get("BERT")) == "a language model"
+    assert parser.calls == ["BERT"]
+
+
+def test_memory_is_bounded(parser, tmp_path):
+    cache = DefinitionCache(fetch=parser.fetch, path=str(tmp_path / "definitions.db"),
+                            memory_entries=2)
+    for term in ("BERT", "weight", "context-free grammar"):
+        cache.get(term)
+    assert len(cache._memory) == 2
+    # the evicted term is still on disk
+    assert cache.lookup("BERT") is not None
+    assert len(parser.calls) == 3
+
+
+def test_warm_up_from_dump(cache, parser, tmp_path):
+    dump = tmp_path / "dump.jsonl"
+    lines = [
+        {"word": "morpheme", "pos": "noun",
+         "senses": [{"glosses": ["the smallest meaningful unit"]}]},
+        {"word": "morphemes", "pos": "noun",
+         "senses": [{"glosses": ["plural of morpheme"], "form_of": [{"word": "morpheme"}]}]},
+        {"word": "syntax", "pos": "noun", "senses": [{"glosses": ["sentence structure"]}]},
+    ]
+    dump.write_text("\n".join(json.dumps(line) for line in lines), encoding="utf-8")
+    assert cache.warm_up(str(dump), terms=["Morphemes", "unknownterm"]) == 2
+    assert definition(cache.get("morpheme")) == "the smallest meaningful unit"
+    assert cache.get("unknownterm") == []
+    # syntax wasn't asked for
+    assert cache.lookup("syntax") is None
+    assert parser.calls == []
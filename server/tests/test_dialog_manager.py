@@ -0,0 +1,47 @@
+import pytest
+
+import gpt4_wrapper
+from gpt4_wrapper import DialogManager
+from llm_client import LLMError
+
+
+def events(*texts):
+    return iter({"choices": [{"delta": {"content": text}}]} for text in texts)
+
+
+@pytest.fixture
+def chatbot(tmp_path, monkeypatch):
+    monkeypatch.setattr(gpt4_wrapper.definition_cache, "get", lambda term: [])
+    monkeypatch.setattr(gpt4_wrapper, "response_cache", gpt4_wrapper.ResponseCache())
+    chatbot = DialogManager(file_path=str(tmp_path / "chat.db"), major="Linguistics")
+    yield chatbot
+    chatbot.close()
+
+
+def test_cached_query_error_is_raised_before_the_stream(chatbot, monkeypatch):
+    def chat(messages, **params):
+        raise LLMError("Rate limit reached", status_code=429)
+
+    monkeypatch.setattr(gpt4_wrapper.llm_client, "chat", chat)
+    with pytest.raises(LLMError) as error:
+        chatbot.get_response("::explain::morpheme", "Linguistics")
+    assert error.value.status_code == 429
+    # no question without an answer in the history
+    assert len(chatbot.history.messages) == 0
+
+
+def test_cached_query_is_answered_once(chatbot, monkeypatch):
+    calls = []
+
+    def chat(messages, **params):
+        calls.append(messages)
+        return events("A morpheme ", "is a unit.")
+
+    monkeypatch.setattr(gpt4_wrapper.llm_client, "chat", chat)
+    for _ in range(2):
+        chunks, sources = chatbot.get_response("::explain::morpheme", "Linguistics")
+        answer = "".join(chunks)
+        chatbot.collect_response(answer)
+        assert answer == "A morpheme is a unit."
+    assert len(calls) == 1
+    assert [m["role"] for m in chatbot.history.messages] == ["user", "assistant"] * 2
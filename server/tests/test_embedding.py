@@ -0,0 +1,90 @@
+import hashlib
+from collections import Counter
+
+import pytest
+
+from bench.synthetic_pdf import write_pdf
+from create_index import batched
+from embedding import EmbeddingStage
+from manifest import Manifest
+from pdf_loader import CJKPDFReader
+
+
+class CountingEmbedder:
+    """Deterministic vectors from the text hash, recording every call."""
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[b / 255 for b in hashlib.sha256(text.encode()).digest()[:self.dim]]
+                for text in texts]
+
+    @property
+    def texts(self):
+        return [text for call in self.calls for text in call]
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    # short pages, so merge_pages packs several into a chunk
+    path = str(tmp_path / "slides.pdf")
+    write_pdf(path, pages=30, lines=6)
+    return path
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return Manifest(str(tmp_path / "manifest.db"))
+
+
+def build(pdf, manifest, embedder, merge_pages=False, dry_run=False):
+    """What create_index does with the chunks, without writing the index."""
+    stage = EmbeddingStage(embed=embedder, cache=manifest, batch_size=16)
+    documents = CJKPDFReader(workers=1, merge_pages=merge_pages).lazy_load_data(pdf)
+    texts = []
+    for batch in batched(documents, 64):
+        stage.embed_documents(batch, dry_run=dry_run)
+        texts.extend(document.text for document in batch)
+        if not dry_run:
+            assert all(document.embedding is not None for document in batch)
+    return stage, texts
+
+
+def test_no_chunk_is_embedded_twice(pdf, manifest):
+    embedder = CountingEmbedder()
+
+    stage, texts = build(pdf, manifest, embedder)
+    assert len(embedder.texts) == len(set(texts)) == stage.embedded
+    assert all(len(call) <= 16 for call in embedder.calls)
+
+    # an unchanged rebuild embeds nothing
+    stage, _ = build(pdf, manifest, embedder)
+    assert stage.embedded == 0 and stage.reused == len(texts)
+
+    # merged chunks: only the ones not seen before are embedded
+    calls = len(embedder.texts)
+    stage, merged = build(pdf, manifest, embedder, merge_pages=True)
+    assert embedder.texts[calls:] == [t for t in dict.fromkeys(merged) if t not in set(texts)]
+    assert stage.embedded > 0
+    assert max(Counter(embedder.texts).values()) == 1
+
+
+def test_dry_run_estimates_the_tokens_of_a_build(pdf, manifest):
+    embedder = CountingEmbedder()
+    estimate, _ = build(pdf, manifest, embedder, dry_run=True)
+    assert embedder.calls == []
+    stage, _ = build(pdf, manifest, embedder)
+    assert estimate.tokens == stage.tokens > 0
+
+
+def test_duplicate_chunks_in_a_batch_are_embedded_once(manifest):
+    from llama_index.readers.schema.base import Document
+
+    embedder = CountingEmbedder()
+    stage = EmbeddingStage(embed=embedder, cache=manifest)
+    documents = [Document("same slide footer"), Document("other"), Document("same slide footer")]
+    stage.embed_documents(documents)
+    assert sorted(embedder.texts) == ["other", "same slide footer"]
+    assert documents[0].embedding == documents[2].embedding
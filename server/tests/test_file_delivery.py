@@ -0,0 +1,90 @@
+import pytest
+from flask import Flask, request as flask_request
+from werkzeug.wsgi import FileWrapper
+
+from file_delivery import IMMUTABLE, send_document
+
+ETAG = "abc123"
+DATA = bytes(range(256)) * 40
+SIZE = len(DATA)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "api_intro.pdf"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+@pytest.fixture(params=[False, True], ids=["blocks", "file_wrapper"])
+def get(request, path):
+    app = Flask(__name__)
+
+    @app.route("/doc")
+    def doc():
+        return send_document(flask_request, path, ETAG, cache_control=IMMUTABLE,
+                             accel_prefix=flask_request.headers.get("X-Accel-Location"))
+
+    environ = {"wsgi.file_wrapper": FileWrapper} if request.param else {}
+    client = app.test_client()
+    return lambda **headers: client.get("/doc", headers=headers, environ_base=environ)
+
+
+def test_whole_file(get):
+    response = get()
+    assert response.status_code == 200 and response.data == DATA
+    assert response.headers["Content-Length"] == str(SIZE)
+    assert response.headers["ETag"] == f'"{ETAG}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["Cache-Control"] == IMMUTABLE
+    assert response.headers["Content-Type"] == "application/pdf"
+
+
+@pytest.mark.parametrize("header, start, stop", [
+    ("bytes=100-199", 100, 200),
+    ("bytes=0-9", 0, 10),
+    ("bytes=-50", SIZE - 50, SIZE),
+    (f"bytes={SIZE - 10}-", SIZE - 10, SIZE),
+    (f"bytes=9000-{SIZE * 2}", 9000, SIZE),
+])
+def test_single_range(get, header, start, stop):
+    response = get(Range=header)
+    assert response.status_code == 206
+    assert response.data == DATA[start:stop]
+    assert response.headers["Content-Length"] == str(stop - start)
+    assert response.headers["Content-Range"] == f"bytes {start}-{stop - 1}/{SIZE}"
+
+
+def test_unsatisfiable_range(get):
+    response = get(Range=f"bytes={SIZE}-")
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+def test_several_ranges_get_the_whole_file(get):
+    response = get(Range="bytes=0-9,20-29")
+    assert response.status_code == 200 and response.data == DATA
+
+
+def test_not_modified(get):
+    response = get(**{"If-None-Match": f'"{ETAG}"'})
+    assert response.status_code == 304 and response.data == b""
+    assert get(**{"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_if_range(get):
+    response = get(Range="bytes=0-9", **{"If-Range": f'"{ETAG}"'})
+    assert response.status_code == 206 and response.data == DATA[:10]
+    # the file changed, the whole new version is sent
+    response = get(Range="bytes=0-9", **{"If-Range": '"stale"'})
+    assert response.status_code == 200 and response.data == DATA
+
+
+def test_nginx_sends_the_file(get):
+    response = get(**{"X-Accel-Location": "/protected-files/"})
+    assert response.status_code == 200 and response.data == b""
+    assert response.headers["X-Accel-Redirect"] == "/protected-files/api_intro.pdf"
+    assert response.headers["ETag"] == f'"{ETAG}"'
+    # a conditional request is answered here, without a redirect
+    response = get(**{"X-Accel-Location": "/protected-files/", "If-None-Match": f'"{ETAG}"'})
+    assert response.status_code == 304 and "X-Accel-Redirect" not in response.headers
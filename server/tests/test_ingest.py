@@ -0,0 +1,103 @@
+import sys
+import time
+import types
+
+import pytest
+
+import ingest
+from ingest import DONE, QUEUED, RUNNING, IngestQueue, run_job
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append(args[1])
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = IngestQueue(db_path=str(tmp_path / "jobs.db"))
+    queue._executor = RecordingExecutor()
+    return queue
+
+
+def set_job(queue, job_id, **fields):
+    conn = ingest._connect(queue.db_path)
+    with conn:
+        conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                     (*fields.values(), job_id))
+    conn.close()
+
+
+def test_resume_leaves_live_leases_alone(queue):
+    live = queue.submit("a.pdf", "a.pdf")
+    dead = queue.submit("b.pdf", "b.pdf")
+    now = time.time()
+    set_job(queue, live, status=RUNNING, owner="web-1:10", heartbeat=now)
+    set_job(queue, dead, status=RUNNING, owner="web-1:11",
+            heartbeat=now - 2 * ingest.LEASE_SECONDS)
+    queue._executor.jobs.clear()
+
+    assert queue.resume() == 1
+    assert queue._executor.jobs == [dead]
+    assert queue.get(live)["status"] == RUNNING
+    assert queue.get(dead)["status"] == QUEUED
+
+
+def test_a_job_is_claimed_once(queue, monkeypatch):
+    runs = []
+
+    def create_index(filepath, filename, progress=None, api_key=None):
+        runs.append(filename)
+        return 42
+
+    monkeypatch.setitem(sys.modules, "create_index", types.SimpleNamespace(create_index=create_index))
+    monkeypatch.setitem(sys.modules, "ann_index", types.SimpleNamespace(
+        ann_index=types.SimpleNamespace(add=lambda name: None)))
+    job_id = queue.submit("a.pdf", "a.pdf")
+    # a second worker resumes the queued job as well
+    queue.resume()
+    for _ in queue._executor.jobs:
+        run_job(queue.db_path, job_id, "a.pdf", "a.pdf")
+    assert runs == ["a.pdf"]
+    job = queue.get(job_id)
+    assert job["status"] == DONE and job["tokens"] == 42
+
+
+def test_heartbeat_renews_the_lease(queue, monkeypatch):
+    monkeypatch.setattr(ingest, "HEARTBEAT_SECONDS", 0.01)
+    job_id = queue.submit("a.pdf", "a.pdf")
+    set_job(queue, job_id, status=RUNNING, owner="me", heartbeat=0)
+    stop = ingest.threading.Event()
+    thread = ingest.threading.Thread(target=ingest._heartbeat,
+                                     args=(queue.db_path, job_id, "me", stop))
+    thread.start()
+    time.sleep(0.1)
+    stop.set()
+    thread.join(5)
+    assert queue.resume() == 0
+
+
+def test_the_job_records_the_file_hash(queue, tmp_path, monkeypatch):
+    from catalog import Catalog
+
+    def create_index(filepath, filename, progress=None, api_key=None):
+        progress(file_hash="abc123")
+        progress(pages=3, chunks=5)
+        return 7
+
+    monkeypatch.setitem(sys.modules, "create_index", types.SimpleNamespace(create_index=create_index))
+    monkeypatch.setitem(sys.modules, "ann_index", types.SimpleNamespace(
+        ann_index=types.SimpleNamespace(add=lambda name: None)))
+    catalog_path = str(tmp_path / "catalog.db")
+    catalog = Catalog(catalog_path)
+    # the upload doesn't hash
+    catalog.put("a.pdf", size=10, status=QUEUED)
+    job_id = queue.submit("a.pdf", "a.pdf")
+    run_job(queue.db_path, job_id, "a.pdf", "a.pdf", catalog_path=catalog_path)
+    row = catalog.get("a.pdf")
+    assert (row["file_hash"], row["pages"], row["status"]) == ("abc123", 3, DONE)
+    assert queue.get(job_id)["status"] == DONE
+    catalog.close()
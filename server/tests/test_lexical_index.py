@@ -0,0 +1,80 @@
+import os
+from collections import Counter
+
+import numpy as np
+
+from lexical_index import LexicalIndex, LexicalIndexWriter, tokenize
+
+CHUNKS = [
+    "Context-free grammars generate the constituents of a sentence.",
+    "The tagger assigns a part of speech to every token.",
+    "形態素解析は文を形態素に分割する",
+    # one very long token, e.g. a url or a formula without spaces
+    "see " + "x" * 2000,
+]
+
+
+def write(path, chunks=CHUNKS):
+    writer = LexicalIndexWriter(str(path))
+    writer.add_documents(type("Doc", (), {"text": text}) for text in chunks)
+    writer.close()
+    return LexicalIndex(str(path))
+
+
+def test_round_trip(tmp_path):
+    index = write(tmp_path / "doc.bm25.npz")
+    assert len(index) == len(CHUNKS)
+    for row, text in enumerate(CHUNKS):
+        for term in set(tokenize(text)):
+            assert row in index.postings(term)[0].tolist()
+    assert int(np.argmax(index.scores("part of speech tagger"))) == 1
+    assert int(np.argmax(index.scores("形態素"))) == 2
+
+
+def test_long_terms_do_not_pad_the_vocabulary(tmp_path):
+    path = tmp_path / "doc.bm25.npz"
+    write(path, CHUNKS + [f"term{i}" for i in range(5000)])
+    # fixed width, the vocabulary alone would be 5000 x 2000 x 4 bytes
+    assert os.path.getsize(path) < 200_000
+
+
+def test_reads_the_fixed_width_vocabulary(tmp_path):
+    path = tmp_path / "doc.bm25.npz"
+    index = write(path)
+    with np.load(path) as saved:
+        arrays = {name: saved[name] for name in saved.files
+                  if name not in ("vocab_bytes", "vocab_offsets")}
+    vocab = sorted(index.terms, key=index.terms.get)
+    legacy = tmp_path / "legacy.bm25.npz"
+    np.savez(legacy, vocab=np.array(vocab, dtype=str), **arrays)
+    old = LexicalIndex(str(legacy))
+    assert old.terms == index.terms
+    assert np.array_equal(old.scores("grammar"), index.scores("grammar"))
+
+
+def test_postings_of_several_batches(tmp_path):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(300)]
+    chunks = [" ".join(rng.choice(words, 40)) for _ in range(500)]
+    writer = LexicalIndexWriter(str(tmp_path / "doc.bm25.npz"))
+    for start in range(0, len(chunks), 64):
+        writer.add_documents(type("Doc", (), {"text": text}) for text in chunks[start:start + 64])
+    writer.close()
+    index = LexicalIndex(str(tmp_path / "doc.bm25.npz"))
+
+    expected = {}
+    for row, text in enumerate(chunks):
+        for term, tf in Counter(tokenize(text)).items():
+            expected.setdefault(term, []).append((row, tf))
+    assert sorted(index.terms) == sorted(expected)
+    for term, postings in expected.items():
+        rows, tfs = index.postings(term)
+        assert list(zip(rows.tolist(), tfs.astype(int).tolist())) == postings
+
+
+def test_abort_writes_nothing(tmp_path):
+    path = tmp_path / "doc.bm25.npz"
+    writer = LexicalIndexWriter(str(path))
+    writer.add_documents(type("Doc", (), {"text": text}) for text in CHUNKS)
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
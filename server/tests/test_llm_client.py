@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bench.mock_openai import MockOpenAI
+from llm_client import LLMClient, LLMError, resolve_api_key
+
+MESSAGES = [{"role": "user", "content": "What is a morpheme?"}]
+
+
+@pytest.fixture
+def server_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "server-key")
+    monkeypatch.delenv("LLM_ALLOW_SERVER_KEY", raising=False)
+
+
+@pytest.fixture
+def mock():
+    with MockOpenAI(tokens=5) as mock:
+        yield mock
+
+
+@pytest.fixture
+def client(mock):
+    client = LLMClient(api_base=mock.url, backoff=0)
+    yield client
+    client.close()
+
+
+def answer(response):
+    return response["choices"][0]["message"]["content"]
+
+
+def test_no_key_is_refused_without_the_opt_in(server_key, client, mock):
+    with pytest.raises(LLMError) as error:
+        client.chat(MESSAGES)
+    assert error.value.status_code == 401
+    assert mock.calls == []
+    with pytest.raises(LLMError):
+        resolve_api_key(None)
+
+
+def test_server_key_is_opt_in(server_key, client, monkeypatch):
+    monkeypatch.setenv("LLM_ALLOW_SERVER_KEY", "1")
+    assert answer(client.chat(MESSAGES)) == "key:server-key"
+    # a key of the user still wins
+    assert answer(client.chat(MESSAGES, api_key="user-key")) == "key:user-key"
+
+
+def test_keys_are_isolated_between_threads(server_key, client, mock):
+    threads, calls = 16, 20
+    results = {}
+
+    def worker(i):
+        results[i] = [answer(client.chat(MESSAGES, api_key=f"user-{i}"))
+                      for _ in range(calls)]
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(30)
+    elapsed = time.perf_counter() - start
+
+    assert results == {i: [f"key:user-{i}"] * calls for i in range(threads)}
+    assert sorted(key for _, key in mock.calls) == \
+        sorted(f"user-{i}" for i in range(threads) for _ in range(calls))
+    # connections are kept alive and shared, not opened per call
+    assert mock.connections <= threads
+    print(f"{threads * calls / elapsed:.0f} calls/s")
+
+
+def test_streamed_answers_keep_their_key(server_key, client, mock):
+    events = list(client.chat(MESSAGES, api_key="stream-key", stream=True))
+    assert "".join(e["choices"][0]["delta"]["content"] for e in events) == "tok " * 5
+    assert mock.calls == [("/chat/completions", "stream-key")]
+
+
+def test_5xx_is_retried(server_key):
+    with MockOpenAI(fail=[503, 503]) as mock:
+        client = LLMClient(api_base=mock.url, backoff=0, retries=2)
+        assert answer(client.chat(MESSAGES, api_key="k")) == "key:k"
+        assert len(mock.calls) == 3
+
+
+def test_401_is_raised_once(server_key):
+    with MockOpenAI(fail=[401]) as mock:
+        client = LLMClient(api_base=mock.url, backoff=0)
+        with pytest.raises(LLMError) as error:
+            client.chat(MESSAGES, api_key="bad-key")
+        assert error.value.status_code == 401
+        assert str(error.value) == "mock error 401"
+        assert len(mock.calls) == 1
+
+
+def run(coro_fn, client):
+    async def main():
+        try:
+            return await coro_fn()
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+
+def test_async_keys_are_isolated(server_key, client, mock):
+    tasks, calls = 16, 10
+
+    async def worker(i):
+        return [answer(await client.achat(MESSAGES, api_key=f"user-{i}")) for _ in range(calls)]
+
+    async def main():
+        return await asyncio.gather(*(worker(i) for i in range(tasks)))
+
+    assert run(main, client) == [[f"key:user-{i}"] * calls for i in range(tasks)]
+    # one pooled session, not a connection per call
+    assert mock.connections <= tasks
+
+
+def test_async_stream_and_embed(server_key, client, mock):
+    async def main():
+        events = [e async for e in await client.achat(MESSAGES, api_key="stream-key", stream=True)]
+        embedded = await client.aembed(["morpheme"], model="ada", api_key="embed-key")
+        return events, embedded
+
+    events, embedded = run(main, client)
+    assert "".join(e["choices"][0]["delta"]["content"] for e in events) == "tok " * 5
+    assert embedded["data"][0]["embedding"] == mock.embed("morpheme")
+    assert mock.calls == [("/chat/completions", "stream-key"), ("/embeddings", "embed-key")]
+
+
+def test_async_5xx_is_retried_and_401_raised_once(server_key):
+    with MockOpenAI(fail=[503, 503]) as mock:
+        client = LLMClient(api_base=mock.url, backoff=0, retries=2)
+        assert answer(run(lambda: client.achat(MESSAGES, api_key="k"), client)) == "key:k"
+        assert len(mock.calls) == 3
+
+    with MockOpenAI(fail=[401]) as mock:
+        client = LLMClient(api_base=mock.url, backoff=0)
+        with pytest.raises(LLMError) as error:
+            run(lambda: client.achat(MESSAGES, api_key="bad-key"), client)
+        assert error.value.status_code == 401
+        assert str(error.value) == "mock error 401"
+        assert len(mock.calls) == 1
+
+
+def test_async_no_key_is_refused(server_key, client, mock):
+    with pytest.raises(LLMError) as error:
+        run(lambda: client.achat(MESSAGES), client)
+    assert error.value.status_code == 401
+    assert mock.calls == []
@@ -0,0 +1,77 @@
+import pytest
+
+from bench.synthetic_pdf import page_lines
+from pdf_loader import SPLITTER_ENCODING, CJKPDFReader
+from tokenizer import get_encoding
+
+CHUNK_SIZE = 400
+
+
+def slides(lines_per_page):
+    """Pages of a few sentences each, like a slide deck."""
+    return [(page_no, " ".join(page_lines(page_no, lines)))
+            for page_no, lines in enumerate(lines_per_page, start=1)]
+
+
+def load(pages, merge_pages):
+    reader = CJKPDFReader(workers=1, chunk_size=CHUNK_SIZE, merge_pages=merge_pages)
+    reader.iter_page_texts = lambda filepath: iter(pages)
+    calls = []
+    documents = list(reader.lazy_load_data("deck.pdf", on_page=lambda *args: calls.append(args)))
+    return documents, calls
+
+
+def tokens(text):
+    return len(get_encoding(SPLITTER_ENCODING).encode(text, disallowed_special=()))
+
+
+@pytest.fixture
+def pages():
+    # short pages, one long one and an empty one
+    return slides([3, 5, 2, 80, 0, 4, 10, 3, 2])
+
+
+def test_merged_chunks_keep_every_page_chunk_in_order(pages):
+    split, _ = load(pages, merge_pages=False)
+    merged, _ = load(pages, merge_pages=True)
+    assert len(merged) < len(split)
+    assert [part for document in merged for part in document.text.split("\n")] == \
+        [document.text for document in split]
+    # the chunks of a page are counted with the joining newline
+    assert all(tokens(document.text) + document.text.count("\n") + 1 <= CHUNK_SIZE
+               for document in merged)
+
+
+def test_merged_chunks_record_their_pages(pages):
+    split, _ = load(pages, merge_pages=False)
+    merged, _ = load(pages, merge_pages=True)
+    page_of = {}
+    for document in split:
+        page_of.setdefault(document.text, document.extra_info["page_no"])
+    previous_end = 0
+    for document in merged:
+        info = document.extra_info
+        covered = [page_of[part] for part in document.text.split("\n")]
+        assert info["page_no"] == info["start_page"] == covered[0]
+        assert info["end_page"] == covered[-1]
+        # a chunk starts on the page the previous one ended on, or later
+        assert info["start_page"] >= previous_end
+        previous_end = info["end_page"]
+    assert any(info["start_page"] < info["end_page"]
+               for info in (document.extra_info for document in merged))
+
+
+def test_a_page_boundary_starts_a_chunk_when_it_is_full():
+    # each page fills most of a chunk, two don't fit in one
+    pages = slides([20, 20, 20])
+    assert all(tokens(text) > CHUNK_SIZE // 2 for _, text in pages)
+    merged, _ = load(pages, merge_pages=True)
+    assert [(d.extra_info["start_page"], d.extra_info["end_page"]) for d in merged] == \
+        [(1, 1), (2, 2), (3, 3)]
+
+
+@pytest.mark.parametrize("merge_pages", [False, True])
+def test_progress_reaches_every_page(pages, merge_pages):
+    documents, calls = load(pages, merge_pages)
+    assert [page_no for page_no, _ in calls][:len(pages)] == [page_no for page_no, _ in pages]
+    assert calls[-1] == (len(pages), len(documents))
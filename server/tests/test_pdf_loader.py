@@ -0,0 +1,106 @@
+import pytest
+
+from pdf_loader import CJKPDFReader, page_hashes
+
+FONT = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+
+def write_pdf(path, objects, pages):
+    """objects: {id: body} of the non-page objects, pages: (contents id,
+    resources) per page."""
+    objects = dict(objects)
+    first = max(objects) + 1
+    kids = []
+    for i, (contents, resources) in enumerate(pages):
+        kids.append(b"%d 0 R" % (first + i))
+        objects[first + i] = (b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792]"
+                              b" /Contents %d 0 R /Resources %s >>"
+                              % (first + len(pages), contents, resources))
+    objects[first + len(pages)] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(kids), len(pages))
+    objects[first + len(pages) + 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % (first + len(pages))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (max(objects) + 1)
+    for obj_id in range(1, max(objects) + 1):
+        if obj_id in offsets:
+            out += b"%010d 00000 n \n" % offsets[obj_id]
+        else:
+            out += b"0000000000 65535 f \n"
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        max(objects) + 1, max(objects), xref)
+    path.write_bytes(bytes(out))
+    return str(path)
+
+
+def stream(data, attrs=b""):
+    # pdfminer drops an operator at the very end of a stream
+    data += b"\n"
+    return b"<< %s /Length %d >>\nstream\n%s\nendstream" % (attrs, len(data), data)
+
+
+def form(text, font=1):
+    return stream(b"BT /F1 12 Tf 50 700 Td (%s) Tj ET" % text,
+                  b"/Type /XObject /Subtype /Form /BBox [0 0 612 792]"
+                  b" /Resources << /Font << /F1 %d 0 R >> >>" % font)
+
+
+def xobject_pdf(path, first=1):
+    """Two pages with the same content stream, drawing different forms."""
+    font, alpha, beta, draw1, draw2 = range(first, first + 5)
+    return write_pdf(path, {
+        font: FONT,
+        alpha: form(b"Alpha page one", font),
+        beta: form(b"Beta page two", font),
+        draw1: stream(b"/X0 Do"),
+        draw2: stream(b"/X0 Do"),
+    }, [(draw1, b"<< /XObject << /X0 %d 0 R >> >>" % alpha),
+        (draw2, b"<< /XObject << /X0 %d 0 R >> >>" % beta)])
+
+
+class PageCache:
+    def __init__(self):
+        self.pages = {}
+
+    def get_page(self, page_hash):
+        return self.pages.get(page_hash)
+
+    def put_page(self, page_hash, text):
+        self.pages[page_hash] = text
+
+
+def test_pages_drawing_different_forms_differ(tmp_path):
+    hashes = page_hashes(xobject_pdf(tmp_path / "forms.pdf"))
+    assert len(set(hashes)) == 2
+
+
+def test_page_cache_keeps_the_text_of_each_page(tmp_path):
+    path = xobject_pdf(tmp_path / "forms.pdf")
+    reader = CJKPDFReader(workers=1, page_cache=PageCache())
+    for extracted in (2, 0):
+        pages = list(reader.iter_page_texts(path))
+        assert [(page_no, text.strip()) for page_no, text in pages] == \
+            [(1, "Alpha page one"), (2, "Beta page two")]
+        assert reader.pages_extracted == extracted
+
+
+def test_object_numbers_are_not_hashed(tmp_path):
+    assert page_hashes(xobject_pdf(tmp_path / "a.pdf")) == \
+        page_hashes(xobject_pdf(tmp_path / "b.pdf", first=7))
+
+
+@pytest.mark.parametrize("font", [
+    b"<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman >>",
+    b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica"
+    b" /Encoding << /Differences [65 /B] >> >>",
+])
+def test_font_is_hashed(tmp_path, font):
+    def pdf(name, font):
+        return write_pdf(tmp_path / name, {1: font, 2: stream(b"BT /F1 12 Tf 50 700 Td (A) Tj ET")},
+                         [(2, b"<< /Font << /F1 1 0 R >> >>")])
+
+    assert page_hashes(pdf("a.pdf", FONT)) != page_hashes(pdf("b.pdf", font))
@@ -0,0 +1,109 @@
+import asyncio
+import gc
+import threading
+
+import pytest
+
+from response_cache import ResponseCache, make_key
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def failing_produce():
+    raise UpstreamError("429")
+
+
+def test_key_normalizes_the_query():
+    assert make_key("explain", "  Eigen  Value ", "cs", "gpt-4", 1) \
+        == make_key("explain", "eigen value", "cs", "gpt-4", 1)
+    assert make_key("explain", "eigenvalue", "cs", "gpt-4", 1) \
+        != make_key("explain", "eigenvalue", "cs", "gpt-4", 2)
+
+
+def test_miss_then_hit():
+    cache = ResponseCache(replay_chunk_size=4)
+    assert "".join(cache.open("k", lambda: iter(["an ", "answer"]))) == "an answer"
+    chunks = list(cache.open("k", failing_produce))
+    assert "".join(chunks) == "an answer"
+    assert chunks == ["an a", "nswe", "r"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_upstream_error_is_raised_before_streaming():
+    cache = ResponseCache()
+    with pytest.raises(UpstreamError):
+        cache.open("k", failing_produce)
+    # the failed flight landed, the next request leads again
+    assert "".join(cache.open("k", lambda: iter(["ok"]))) == "ok"
+
+
+def test_produce_is_called_eagerly():
+    cache = ResponseCache()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return iter(["x"])
+
+    chunks = cache.open("k", produce)
+    assert calls == [1]
+    assert list(chunks) == ["x"]
+
+
+def test_unread_answer_releases_the_waiters():
+    cache = ResponseCache(wait_timeout=5)
+    chunks = cache.open("k", lambda: iter(["x"]))
+    del chunks
+    gc.collect()
+    assert cache._flights == {}
+    assert cache.get("k") is None
+
+
+def test_identical_requests_share_one_call():
+    cache = ResponseCache()
+    release = threading.Event()
+    calls = []
+
+    def slow_produce():
+        calls.append(1)
+        release.wait(5)
+        yield "shared answer"
+
+    leader = cache.open("k", slow_produce)
+    results = []
+    followers = [threading.Thread(target=lambda: results.append(
+        "".join(cache.open("k", slow_produce)))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    release.set()
+    assert "".join(leader) == "shared answer"
+    for follower in followers:
+        follower.join(5)
+    assert results == ["shared answer"] * 3
+    assert len(calls) == 1
+    assert cache.stats()["shared"] == 3
+
+
+def test_async_error_is_raised_before_streaming():
+    cache = ResponseCache()
+
+    async def failing_aproduce():
+        raise UpstreamError("401")
+
+    async def chunks():
+        yield "async "
+        yield "answer"
+
+    async def aproduce():
+        return chunks()
+
+    async def run():
+        with pytest.raises(UpstreamError):
+            await cache.aopen("k", failing_aproduce)
+        answer = [chunk async for chunk in await cache.aopen("k", aproduce)]
+        replay = [chunk async for chunk in await cache.aopen("k", failing_aproduce)]
+        return "".join(answer), "".join(replay)
+
+    assert asyncio.run(run()) == ("async answer", "async answer")
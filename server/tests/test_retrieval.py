@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from retrieval import Retriever, best_of, scores_of, top_k
+from vector_store import VectorIndexWriter, index_prefix
+
+DIM = 32
+
+
+def unit_vectors(count, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def brute_force(matrix, vector, k):
+    scores = np.asarray(matrix, dtype=np.float32) @ vector
+    rows = np.argsort(-scores, kind="stable")[:k]
+    return rows, scores[rows]
+
+
+@pytest.mark.parametrize("k", [1, 5, 10, 999, 1000, 1500])
+def test_top_k_matches_a_full_sort(k):
+    matrix, queries = unit_vectors(1000), unit_vectors(20, seed=1)
+    for query in queries:
+        rows, scores = top_k(matrix, query, k)
+        expected_rows, expected_scores = brute_force(matrix, query, k)
+        # equal scores may come in any order
+        assert np.array_equal(scores, expected_scores)
+        assert sorted(rows.tolist()) == sorted(expected_rows.tolist())
+
+
+def test_float16_scores_are_upcast():
+    matrix = unit_vectors(10000).astype(np.float16)
+    query = unit_vectors(1, seed=1)[0]
+    # several blocks, the last one partial
+    assert np.allclose(scores_of(matrix, query, block_rows=4096),
+                       matrix.astype(np.float32) @ query, atol=1e-6)
+    assert top_k(matrix, query, 10)[0].tolist() == brute_force(matrix, query, 10)[0].tolist()
+
+
+def test_best_of_edge_cases():
+    assert best_of(np.zeros(0, np.float32), 5)[0].tolist() == []
+    assert best_of(np.ones(3, np.float32), 0)[0].tolist() == []
+    rows, scores = best_of(np.array([0.1, 0.9, 0.5], np.float32), 5)
+    assert rows.tolist() == [1, 2, 0]
+    assert scores.dtype == np.float32
+
+
+def test_retriever_returns_the_best_chunks():
+    vectors = unit_vectors(200)
+    with VectorIndexWriter(index_prefix("retrieval-test"), dim=DIM) as writer:
+        for i, vector in enumerate(vectors):
+            writer.add(f"chunk {i}", vector, {"page_no": i // 10 + 1})
+    retriever = Retriever(k=4, hybrid=False)
+    query = unit_vectors(1, seed=1)[0]
+
+    results = retriever.search("retrieval-test", query)
+    rows, scores = brute_force(vectors, query, 4)
+    assert [r["text"] for r in results] == [f"chunk {row}" for row in rows]
+    assert [r["page_no"] for r in results] == [row // 10 + 1 for row in rows]
+    assert [r["score"] for r in results] == [round(float(s), 4) for s in scores]
+
+    # below min_score
+    retriever.min_score = float(scores[1])
+    assert len(retriever.search("retrieval-test", query)) == 2
+    assert retriever.search("missing", query) == []
@@ -0,0 +1,78 @@
+import multiprocessing
+
+import numpy as np
+
+from semantic_cache import SemanticCache
+
+DIM = 8
+
+
+def unit(i):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1
+    return vector
+
+
+def make_cache(tmp_path, **kwargs):
+    return SemanticCache(path=str(tmp_path / "semantic"), dim=DIM, threshold=0.9, **kwargs)
+
+
+def test_hit_and_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("explain", "cs", unit(0), "eigenvalue answer")
+    assert cache.lookup("explain", "cs", unit(0)) == "eigenvalue answer"
+    assert cache.lookup("explain", "cs", unit(1)) is None
+    assert cache.lookup("simplify", "cs", unit(0)) is None
+    assert cache.lookup("explain", "linguistics", unit(0)) is None
+
+
+def test_two_workers_on_the_same_files(tmp_path):
+    a = make_cache(tmp_path)
+    b = make_cache(tmp_path)
+    a.add("explain", "cs", unit(0), "eigenvalue")
+    b.add("explain", "cs", unit(1), "syntax")
+    a.add("explain", "cs", unit(2), "morpheme")
+    for cache in (a, b):
+        assert cache.lookup("explain", "cs", unit(0)) == "eigenvalue"
+        assert cache.lookup("explain", "cs", unit(1)) == "syntax"
+        assert cache.lookup("explain", "cs", unit(2)) == "morpheme"
+
+
+def test_scope_has_model_and_prompt_version(tmp_path):
+    make_cache(tmp_path, model="gpt-4", prompt_version=1).add("explain", "cs", unit(0), "old")
+    assert make_cache(tmp_path, model="gpt-4", prompt_version=1) \
+        .lookup("explain", "cs", unit(0)) == "old"
+    assert make_cache(tmp_path, model="gpt-4", prompt_version=2) \
+        .lookup("explain", "cs", unit(0)) is None
+    assert make_cache(tmp_path, model="gpt-3.5-turbo", prompt_version=1) \
+        .lookup("explain", "cs", unit(0)) is None
+
+
+def test_partial_row_is_dropped(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.add("explain", "cs", unit(0), "eigenvalue")
+    # a worker died halfway through a vector
+    with open(cache.vectors_path, "ab") as f:
+        f.write(b"\0" * 5)
+    cache.add("explain", "cs", unit(1), "syntax")
+    assert make_cache(tmp_path).lookup("explain", "cs", unit(1)) == "syntax"
+
+
+def add_many(path, worker):
+    cache = SemanticCache(path=path, dim=DIM, threshold=0.9)
+    for i in range(50):
+        cache.add("explain", f"{worker}-{i}", unit(worker), f"{worker}-{i}")
+
+
+def test_concurrent_appends(tmp_path):
+    path = str(tmp_path / "semantic")
+    workers = [multiprocessing.Process(target=add_many, args=(path, w)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+    cache = SemanticCache(path=path, dim=DIM, threshold=0.9)
+    assert cache.stats()["size"] == 200
+    for w in range(4):
+        for i in range(50):
+            assert cache.lookup("explain", f"{w}-{i}", unit(w)) == f"{w}-{i}"
@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from bench.bench_vector_store import legacy_json
+from vector_store import VectorIndex, VectorIndexWriter, convert_json_index, is_vector_index
+
+DIM = 8
+ROWS = [
+    ("A morpheme is the smallest unit of meaning.", {"page_no": 1, "chunk_id": "chunk-1"}),
+    ("形態素は意味の最小単位である", {"page_no": 1, "start_page": 1, "end_page": 2}),
+    ("", {"page_no": 2}),
+    ("The tagger assigns a part of speech.", None),
+]
+
+
+def vectors(count=len(ROWS), seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((count, DIM)).astype(np.float32)
+
+
+def write(prefix, dtype="float32"):
+    with VectorIndexWriter(prefix, dim=DIM, dtype=dtype) as writer:
+        for (text, extra_info), vector in zip(ROWS, vectors()):
+            writer.add(text, vector, extra_info)
+
+
+def assert_rows(index, dtype):
+    assert len(index) == len(ROWS)
+    assert index.vectors.dtype == np.dtype(dtype)
+    assert np.array_equal(index.vectors, vectors().astype(dtype))
+    assert [index.text(i) for i in range(len(index))] == [text for text, _ in ROWS]
+    assert index.extra_info == [extra_info or {} for _, extra_info in ROWS]
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_round_trip(tmp_path, dtype):
+    write(str(tmp_path / "doc"), dtype)
+    index = VectorIndex(str(tmp_path / "doc"))
+    # opening maps the vectors, nothing is read
+    assert isinstance(index.vectors, np.memmap)
+    assert_rows(index, dtype)
+    ext = "f32" if dtype == "float32" else "f16"
+    assert sorted(os.listdir(tmp_path)) == \
+        sorted(f"doc.{e}" for e in (ext, "txt", "json"))
+
+
+def test_empty_index(tmp_path):
+    with VectorIndexWriter(str(tmp_path / "empty"), dim=DIM):
+        pass
+    index = VectorIndex(str(tmp_path / "empty"))
+    assert len(index) == 0 and index.vectors.shape == (0, DIM)
+
+
+def test_abort_leaves_no_index(tmp_path):
+    writer = VectorIndexWriter(str(tmp_path / "doc"), dim=DIM)
+    writer.add("text", vectors()[0])
+    with pytest.raises(ValueError):
+        writer.add("wrong size", np.zeros(DIM + 1))
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def test_convert_a_llama_index_json(tmp_path):
+    prefix = str(tmp_path / "legacy")
+    path = f"{prefix}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(legacy_json(zip([text for text, _ in ROWS], vectors(),
+                                  [extra_info for _, extra_info in ROWS])), f)
+
+    assert not is_vector_index(prefix)
+    assert convert_json_index(path) == len(ROWS)
+    assert is_vector_index(prefix)
+    assert os.path.exists(path + ".bak")
+    assert_rows(VectorIndex(prefix), "float32")
+    # a converted index is left alone
+    assert convert_json_index(path) is None
+
+
+def test_convert_reads_embeddings_of_the_docstore(tmp_path):
+    # older llama_index versions kept the embeddings on the nodes
+    saved = legacy_json(zip(["alpha", "beta"], vectors(2), [{"page_no": 1}, {"page_no": 2}]))
+    embeddings = saved["vector_store"]["__data__"]["simple_vector_store_data_dict"].pop("embedding_dict")
+    for node_id, embedding in embeddings.items():
+        saved["docstore"]["__data__"]["docs"][node_id]["embedding"] = embedding
+    path = str(tmp_path / "old.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(saved, f)
+
+    assert convert_json_index(path, dtype="float16", backup=False) == 2
+    index = VectorIndex(str(tmp_path / "old"))
+    assert np.array_equal(index.vectors, vectors(2).astype(np.float16))
+    assert [index.text(0), index.text(1)] == ["alpha", "beta"]
@@ -0,0 +1,20 @@
+"""Cached tiktoken encoders shared by the server modules."""
+
+from functools import lru_cache
+
+import tiktoken
+
+# gpt-4 / gpt-3.5-turbo encoding
+CHAT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = CHAT_ENCODING):
+    """`tiktoken.get_encoding` is not free, build each encoder once."""
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = CHAT_ENCODING) -> int:
+    """Returns the number of tokens in a text string."""
+    # user text may contain things like <|endoftext|>, count them as plain text
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
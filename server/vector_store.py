@@ -0,0 +1,233 @@
+# encoding: utf-8
+"""Binary on-disk format of the document indexes.
+
+An index `static/index/<name>` is three files:
+- <name>.f32 (or .f16): the chunk embeddings, a raw row-major matrix that is
+  memory-mapped, so opening an index reads nothing and all the worker
+  processes share the same pages of the OS page cache
+- <name>.txt: the chunk texts, utf-8, one after the other
+- <name>.json: the metadata, i.e. dim, dtype, the extra_info (page_no,
+  chunk_id, ...) of each chunk and the byte offsets of the texts
+
+The metadata is written last, an index without it is incomplete.
+
+Indexes saved by llama_index (`save_to_disk`) can be converted with
+    python vector_store.py static/index/*.json
+"""
+
+import argparse
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from embedding import EMBED_DIM, EMBED_MODEL
+
+staticPath = "static"
+
+FORMAT = "vector-index/1"
+DTYPE_EXT = {"float32": "f32", "float16": "f16"}
+
+
+def index_prefix(name):
+    return f"{staticPath}/index/{name}"
+
+
+class VectorIndexWriter:
+    """Writes an index chunk by chunk, nothing is kept in memory: the
+    extra_info of the chunks goes to the metadata file as they are added and
+    the text offsets to a temporary file, copied into the metadata at close.
+
+    Args:
+        prefix: path of the index without extension
+        dim: embedding size
+        dtype: float32, or float16 for half the size
+        model: embedding model the vectors come from
+    """
+    def __init__(self, prefix, dim=EMBED_DIM, dtype="float32", model=EMBED_MODEL):
+        self.prefix = prefix
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model = model
+        self.vectors_path = f"{prefix}.{DTYPE_EXT[self.dtype.name]}"
+        self.texts_path = f"{prefix}.txt"
+        self.meta_path = f"{prefix}.json"
+        dirname = os.path.dirname(prefix)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._vectors = open(self.vectors_path + ".tmp", "wb")
+        self._texts = open(self.texts_path + ".tmp", "wb")
+        self._offsets = open(f"{prefix}.offsets.tmp", "w+b")
+        self._meta = open(self.meta_path + ".tmp", "w", encoding="utf-8")
+        # the format must come first, see is_vector_index
+        header = {"format": FORMAT, "model": model, "dim": dim, "dtype": self.dtype.name}
+        self._meta.write(json.dumps(header, ensure_ascii=False, separators=(",", ":"))[:-1]
+                         + ',"extra_info":[')
+        self.count = 0
+        self.size = 0
+
+    def add(self, text, embedding, extra_info=None):
+        vector = np.asarray(embedding, dtype=self.dtype)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"expected an embedding of size {self.dim}, got {vector.shape}")
+        self._vectors.write(vector.tobytes())
+        data = text.encode("utf-8")
+        self._texts.write(data)
+        self._offsets.write(self.size.to_bytes(8, "little"))
+        self.size += len(data)
+        if self.count:
+            self._meta.write(",")
+        json.dump(extra_info or {}, self._meta, ensure_ascii=False, separators=(",", ":"))
+        self.count += 1
+
+    def add_documents(self, documents: Iterable):
+        for document in documents:
+            self.add(document.text, document.embedding, document.extra_info)
+
+    def _write_offsets(self, block_size=1 << 16):
+        self._offsets.write(self.size.to_bytes(8, "little"))
+        self._offsets.seek(0)
+        self._meta.write('],"offsets":[')
+        first = True
+        while True:
+            block = self._offsets.read(8 * block_size)
+            if not block:
+                break
+            numbers = ",".join(map(str, np.frombuffer(block, dtype="<i8").tolist()))
+            self._meta.write(numbers if first else "," + numbers)
+            first = False
+        self._meta.write(f'],"count":{self.count}}}')
+
+    def close(self):
+        self._vectors.close()
+        self._texts.close()
+        self._write_offsets()
+        self._offsets.close()
+        os.remove(f"{self.prefix}.offsets.tmp")
+        self._meta.close()
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.texts_path + ".tmp", self.texts_path)
+        # the metadata goes last, it marks the index as complete
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def abort(self):
+        for f in (self._vectors, self._texts, self._offsets, self._meta):
+            f.close()
+        for path in (self.vectors_path + ".tmp", self.texts_path + ".tmp",
+                     f"{self.prefix}.offsets.tmp", self.meta_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def is_vector_index(prefix):
+    """True if <prefix>.json is the metadata of a binary index. Only the
+    head of the file is read, a llama_index json can be large."""
+    with open(f"{prefix}.json", "rb") as f:
+        head = f.read(64)
+    return head.startswith(b'{"format":"' + FORMAT.encode() + b'"')
+
+
+def remove_index(name):
+    """Delete the files of an index, the metadata first."""
+    prefix = index_prefix(name)
+    for ext in ("json", *DTYPE_EXT.values(), "txt"):
+        if os.path.exists(f"{prefix}.{ext}"):
+            os.remove(f"{prefix}.{ext}")
+
+
+class VectorIndex:
+    """Read-only view of an index written by VectorIndexWriter.
+
+    Args:
+        prefix: path of the index without extension
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        if not is_vector_index(prefix):
+            raise ValueError(f"{prefix}.json is not a {FORMAT} index, convert it with vector_store.py")
+        with open(f"{prefix}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model = meta["model"]
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.offsets = meta["offsets"]
+        self.extra_info = meta["extra_info"]
+        count = meta["count"]
+        if count == 0:
+            # an empty file can't be mapped
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self._texts = b""
+        else:
+            self.vectors = np.memmap(f"{prefix}.{DTYPE_EXT[self.dtype.name]}",
+                                     dtype=self.dtype, mode="r", shape=(count, self.dim))
+            with open(f"{prefix}.txt", "rb") as f:
+                self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.extra_info)
+
+    def text(self, i) -> str:
+        return self._texts[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    @classmethod
+    def load(cls, name):
+        return cls(index_prefix(name))
+
+
+def convert_json_index(json_path, prefix: Optional[str] = None, dtype="float32", backup=True):
+    """Convert an index saved by llama_index's GPTSimpleVectorIndex into the
+    binary format. By default the result replaces the json file, which is
+    kept as <name>.json.bak."""
+    if is_vector_index(os.path.splitext(json_path)[0]):
+        return None
+    with open(json_path, "r", encoding="utf-8") as f:
+        saved = json.load(f)
+    prefix = prefix or os.path.splitext(json_path)[0]
+
+    index_struct = saved["index_struct"]["__data__"]
+    docs = saved["docstore"]["__data__"]["docs"]
+    embedding_dict = saved.get("vector_store", {}).get("__data__", {}) \
+        .get("simple_vector_store_data_dict", {}).get("embedding_dict", {})
+    rows = []
+    # nodes_dict keeps the insertion order, i.e. the chunk order
+    for vector_id, node_id in index_struct["nodes_dict"].items():
+        node = docs[node_id]
+        embedding = (embedding_dict.get(vector_id)
+                     or index_struct.get("embeddings_dict", {}).get(vector_id)
+                     or node.get("embedding"))
+        if embedding is None:
+            raise ValueError(f"chunk {node_id} of {json_path} has no embedding")
+        rows.append((node["text"], embedding, node.get("extra_info")))
+
+    dim = len(rows[0][1]) if rows else EMBED_DIM
+    if backup and os.path.abspath(f"{prefix}.json") == os.path.abspath(json_path):
+        os.replace(json_path, json_path + ".bak")
+    with VectorIndexWriter(prefix, dim=dim, dtype=dtype) as writer:
+        for text, embedding, extra_info in rows:
+            writer.add(text, embedding, extra_info)
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert llama_index json indexes to the binary format")
+    parser.add_argument("paths", nargs="+", help="json files saved by GPTSimpleVectorIndex.save_to_disk")
+    parser.add_argument("--dtype", default="float32", choices=sorted(DTYPE_EXT))
+    parser.add_argument("--no-backup", action="store_true", help="don't keep the json as .json.bak")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        count = convert_json_index(path, dtype=args.dtype, backup=not args.no_backup)
+        if count is None:
+            print(f"{path}: already converted")
+        else:
+            print(f"{path}: {count} chunks")